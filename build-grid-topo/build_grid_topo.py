@@ -21,6 +21,15 @@ import pandas as pd
 from geopy.distance import vincenty 
 import geocoder
 
+import grid_adjacency
+import grid_graph
+import grid_binning
+import grid_anchor
+import grid_tiles
+import grid_incremental
+import grid_components
+import grid_order
+
 from sklearn.neighbors import DistanceMetric
 from scipy.spatial import Voronoi, voronoi_plot_2d, Delaunay
 from sklearn.neighbors import NearestNeighbors
@@ -40,6 +49,52 @@ cell_household_threshold = 5
 # this prepares an approximation of a local topology
 migration_radius = 3 
 
+# the grid graph is always saved in binary CSR form (e.g. gridded_households_adj_graph.npz; see grid_graph.py)
+# single direction storage keeps only one direction of each edge and no self-loops; both are restored on load
+adj_graph_single_direction = False
+
+# also export the json adjacency list (e.g. gridded_households_adj_list.json); required by the dtk-tools spatial workflow migration generation
+export_adj_list_json = True
+
+# number of structures csv rows to read at a time; if set, the csv is streamed in chunks and binned into the grid chunk by chunk (out-of-core) 
+# instead of being read at once, e.g. for country-scale inputs; the grid is the same either way 
+chunk_size = None # e.g. 1000000
+
+# bin structures into occupied cells only (sparse grid), instead of a dense histogram and meshgrids over the whole bounding box, e.g. for large bounding boxes
+# memory then scales with the number of structures rather than the bounding box area; the resulting nodes are the same (given a positive cell threshold)
+sparse_grid = False
+
+# anchor the grid to a fixed global origin and resolution (see grid_anchor.py), instead of fitting it to the extent of the binned structures;
+# cells then get stable integer ids (column cell_id in pop_gridded.csv), so that per cell attributes (e.g. elevations) can be cached and reused across runs
+anchored_grid = False
+
+# resolution (x, y) of the anchored grid in arc-seconds; keep it fixed across runs for the cell ids to remain stable
+# the default gives ~cell_size square cells around Haiti's latitude
+anchored_grid_resolution_arcsec = grid_anchor.get_resolution_arcsec(cell_size, 18.5)
+
+# number of worker processes; if more than 1, the grid is split into tiles (bands of columns) which are binned and connected in a process pool (see grid_tiles.py), 
+# e.g. for multi-department bounding boxes; cells are binned sparsely (as with sparse_grid) and the nodes and graph are the same as in a single-process run
+num_processes = 1
+
+# number of grid tiles if num_processes is more than 1; more tiles than processes even out the work per process at the cost of more halo columns to bin
+num_tiles = None # defaults to num_processes
+
+# incremental rebuild (requires anchored_grid): the nodes, node labels and grid graph of each build are kept in this state file (see grid_incremental.py);
+# if it exists, the new households are diffed against it and only the affected cells and their stencil neighborhoods are rebuilt; node labels of unchanged cells 
+# are preserved and the changed nodes and edges are saved to gridded_households_changes.json for later stages
+incremental_state = None # e.g. "grid_state.npz"
+
+# prune connected components of the filtered cells (cells within migration_radius hops of each other are connected; see grid_components.py) with fewer than 
+# min_component_cells cells or fewer than min_component_households households: "drop" them, "merge" their households into the nearest cell of a larger component, 
+# or "bridge" them to that cell with an additional edge; pruned components are reported in gridded_households_pruned_components.csv
+prune_components = None # e.g. "drop", "merge" or "bridge"
+min_component_cells = 3
+min_component_households = 50
+
+# order the nodes (node labels and the rows of all outputs) along a space-filling curve of the grid, so that nearby cells get nearby node labels: "hilbert" or "morton" 
+# (see grid_order.py); None keeps the column by column grid order
+node_order = None # e.g. "hilbert"
+
 # average household size (in people); verify with census/other data?
 avg_household_size = 4.5 # can change to distribution...
 
@@ -75,26 +130,68 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(message)s', level='INFO')
 
     
-    logging.info("Reading data...")
-    
-    # get household records within the given bounding box
-    all_hh_records = pd.read_csv("structures_households.csv")
-    hh_records = all_hh_records[(all_hh_records.lon > x_min) & (all_hh_records.lon < x_max) & (all_hh_records.lat > y_min) & (all_hh_records.lat < y_max)]
-    
-
-    # get point locations of households
-    points = hh_records.as_matrix(["lon", "lat"])
-    
-    
     logging.info("Calculating grid cell mesh...")
     
-    # get number of grid cells along the x (grid width) and y axis (grid height) based on the bounding box dimensions and pixel/cell size
-    num_cells_x = int(1000*vincenty((y_min, x_min), (y_min, x_max)).km/cell_size) + 1
-    num_cells_y = int(1000*vincenty((y_min, x_min), (y_max, x_min)).km/cell_size) + 1
+    if anchored_grid:
+        
+        # cells of the global grid covering the bounding box; the edges do not depend on the extent of the structures
+        anchored_edges = grid_anchor.get_anchored_edges((x_min, x_max, y_min, y_max), anchored_grid_resolution_arcsec)
+        
+        num_cells_x = len(anchored_edges[0]) - 1
+        num_cells_y = len(anchored_edges[1]) - 1
+        
+    else:
+        
+        # get number of grid cells along the x (grid width) and y axis (grid height) based on the bounding box dimensions and pixel/cell size
+        num_cells_x = int(1000*vincenty((y_min, x_min), (y_min, x_max)).km/cell_size) + 1
+        num_cells_y = int(1000*vincenty((y_min, x_min), (y_max, x_min)).km/cell_size) + 1
+        
+        anchored_edges = None
     
     
-    # bin households in the grid
-    H, xedges, yedges = np.histogram2d(points[:,0], points[:,1], bins=[num_cells_x, num_cells_y])
+    if chunk_size:
+        
+        logging.info("Reading and binning data in chunks of " + str(chunk_size) + " rows...")
+        
+        # bin households within the given bounding box in the grid, one chunk of household records at a time
+        if num_processes > 1:
+            xedges, yedges = grid_binning.get_chunked_edges("structures_households.csv", (x_min, x_max, y_min, y_max), num_cells_x, num_cells_y, chunk_size, anchored_edges)
+            
+            # the households csv is read once and split into per tile shards of the households of its own and halo columns, which the tiles stream
+            logging.info("Binning and connecting " + str(num_tiles or num_processes) + " grid tiles in " + str(num_processes) + " processes...")
+            cell_keys, cell_counts, adj_src, adj_dst, adj_w = grid_tiles.build_tiled_grid(xedges, yedges, cell_household_threshold, migration_radius, num_processes, num_tiles, csv = ("structures_households.csv", (x_min, x_max, y_min, y_max), chunk_size, None, None))
+        elif sparse_grid:
+            cell_keys, cell_counts, xedges, yedges = grid_binning.sparse_histogram2d_chunked("structures_households.csv", (x_min, x_max, y_min, y_max), num_cells_x, num_cells_y, chunk_size, edges = anchored_edges)
+        else:
+            H, xedges, yedges = grid_binning.histogram2d_chunked("structures_households.csv", (x_min, x_max, y_min, y_max), num_cells_x, num_cells_y, chunk_size, edges = anchored_edges)
+        
+    else:
+        
+        logging.info("Reading data...")
+        
+        # get household records within the given bounding box
+        all_hh_records = pd.read_csv("structures_households.csv")
+        hh_records = all_hh_records[(all_hh_records.lon > x_min) & (all_hh_records.lon < x_max) & (all_hh_records.lat > y_min) & (all_hh_records.lat < y_max)]
+        
+        
+        # get point locations of households
+        points = hh_records.as_matrix(["lon", "lat"])
+        
+        
+        # bin households in the grid
+        if sparse_grid or num_processes > 1:
+            if anchored_grid:
+                xedges, yedges = anchored_edges
+            else:
+                xedges, yedges = grid_binning.get_histogram_edges((points[:,0].min(), points[:,0].max()), (points[:,1].min(), points[:,1].max()), num_cells_x, num_cells_y)
+            
+            if num_processes > 1:
+                logging.info("Binning and connecting " + str(num_tiles or num_processes) + " grid tiles in " + str(num_processes) + " processes...")
+                cell_keys, cell_counts, adj_src, adj_dst, adj_w = grid_tiles.build_tiled_grid(xedges, yedges, cell_household_threshold, migration_radius, num_processes, num_tiles, points = (points[:,0], points[:,1], None))
+            else:
+                cell_keys, cell_counts = grid_binning.sparse_histogram2d(points[:,0], points[:,1], xedges, yedges)
+        else:
+            H, xedges, yedges = np.histogram2d(points[:,0], points[:,1], bins=list(anchored_edges) if anchored_grid else [num_cells_x, num_cells_y])
     
     
     # get centroids of grid cells
@@ -102,56 +199,135 @@ if __name__ == '__main__':
     y_mid = (yedges[1:] + yedges[:-1])/2
     
     
-    # build a mesh of centroids
-    X_mid, Y_mid = np.meshgrid(x_mid[:], y_mid[:])
+    if sparse_grid or num_processes > 1:
+        
+        # plot occupied grid cells; color by density
+        fig = plt.figure(figsize = (13,9))
+        
+        logging.info("Plotting all filtered grid cells...")
+        
+        plt.scatter(x_mid[cell_keys // num_cells_y], y_mid[cell_keys % num_cells_y], s = 1, c = cell_counts, cmap = 'coolwarm', vmin = 0, vmax = 20, linewidths = 0)
+        plt.colorbar()
+        plt.show()
+        
+        
+        # filter occupied cells by number of households greater than a threshold in each cell
+        # cell keys are sorted, so the filtered cells are in the same order as in the dense case below 
+        filtered_cell_keys = cell_keys[cell_counts >= cell_household_threshold]
+        filtered_household_cells_idx = (filtered_cell_keys // num_cells_y, filtered_cell_keys % num_cells_y)
+        filtered_household_cells_counts = cell_counts[cell_counts >= cell_household_threshold]
+        
+    else:
+        
+        # build a mesh of grid cell vertexes
+        X, Y = np.meshgrid(xedges[:-1], yedges[:-1])
+        
+        
+        # plot grid cells; color by density 
+        fig = plt.figure(figsize = (13,9))
+        
+        logging.info("Plotting all filtered grid cells...")
+            
+        plt.pcolormesh(X, Y, np.swapaxes(H,0,1), cmap = 'coolwarm', vmin = 0, vmax = 20)
+        plt.colorbar()
+        plt.show()
+        
+        
+        # filter pixels/cells by number of households greater than a threshold in each cell
+        cells_masking = ma.masked_less(H, cell_household_threshold)
+        cells_mask = cells_masking.mask
+        cells_data =  cells_masking.data
+        
+        # mask returns False for valid entries;  True would be easier to work with
+        inverted_filtered_households_mask = np.in1d(cells_mask.ravel(), [False]).reshape(cells_mask.shape)
+        filtered_household_cells_idx = np.where(inverted_filtered_households_mask)
+        filtered_household_cells_counts = cells_data[filtered_household_cells_idx]
+        
     
-    # build a mesh of grid cell vertexes
-    X, Y = np.meshgrid(xedges[:-1], yedges[:-1])
+    if prune_components:
+        
+        if prune_components == "bridge" and incremental_state:
+            raise ValueError("Incremental rebuilds do not support bridged components (prune_components = \"bridge\")")
+        
+        logging.info("Pruning small connected components of the filtered grid cells...")
+        
+        kept_cells, filtered_household_cells_counts, bridge_src, bridge_dst, bridge_w, pruned_components = grid_components.prune_components(filtered_household_cells_idx[0], filtered_household_cells_idx[1], filtered_household_cells_counts, 
+                                                                                                                                            x_mid, y_mid, migration_radius, min_component_cells, min_component_households, prune_components)
+        
+        # tiled grids are already connected; keep the edges between the remaining cells
+        if num_processes > 1:
+            adj_src, adj_dst, adj_w = grid_graph.get_subgraph(adj_src, adj_dst, adj_w, np.flatnonzero(kept_cells), len(kept_cells))
+        
+        filtered_household_cells_idx = (filtered_household_cells_idx[0][kept_cells], filtered_household_cells_idx[1][kept_cells])
+        
+        pruned_components.to_csv("gridded_households_pruned_components.csv", index = False)
+        
+        logging.info(str(len(pruned_components)) + " components (" + str(int(pruned_components.num_cells.sum())) + " cells, " + str(pruned_components["count"].sum()) + " households) pruned (" + prune_components + "); saved to gridded_households_pruned_components.csv")
     
-
-    # plot grid cells; color by density 
-    fig = plt.figure(figsize = (13,9))
     
-    logging.info("Plotting all filtered grid cells...")
+    if node_order:
         
-    plt.pcolormesh(X, Y, np.swapaxes(H,0,1), cmap = 'coolwarm', vmin = 0, vmax = 20)
-    plt.colorbar()
-    plt.show()
+        if incremental_state:
+            raise ValueError("Incremental rebuilds keep the node order of the grid state; node_order is not supported with incremental_state")
+        
+        logging.info("Ordering grid nodes along a " + node_order + " curve...")
+        
+        ordering = grid_order.get_node_order(filtered_household_cells_idx[0], filtered_household_cells_idx[1], node_order)
+        
+        filtered_household_cells_idx = (filtered_household_cells_idx[0][ordering], filtered_household_cells_idx[1][ordering])
+        filtered_household_cells_counts = filtered_household_cells_counts[ordering]
+        
+        # tiled grids and bridges of pruned components are already connected; relabel their edges
+        if num_processes > 1:
+            adj_src, adj_dst, adj_w = grid_order.reorder_edges(adj_src, adj_dst, adj_w, ordering)
+        
+        if prune_components == "bridge":
+            bridge_src, bridge_dst, bridge_w = grid_order.reorder_edges(bridge_src, bridge_dst, bridge_w, ordering)
     
     
-    # filter pixels/cells by number of households greater than a threshold in each cell
-    cells_masking = ma.masked_less(H, cell_household_threshold)
-    cells_mask = cells_masking.mask
-    cells_data =  cells_masking.data
+    node_labels = np.arange(len(filtered_household_cells_idx[0]))
+    grid_state = None
     
-    # mask returns False for valid entries;  True would be easier to work with
-    inverted_filtered_households_mask = np.in1d(cells_mask.ravel(), [False]).reshape(cells_mask.shape)
-    filtered_household_cells_idx = np.where(inverted_filtered_households_mask)
+    if incremental_state:
+        
+        if not anchored_grid:
+            raise ValueError("Incremental rebuilds require an anchored grid (anchored_grid = True)")
+        
+        # cells and edge weights only stay in place on the same anchored grid and stencil
+        state_meta = {"resolution_arcsec": list(anchored_grid_resolution_arcsec), "bbox": [x_min, x_max, y_min, y_max], "migration_radius": migration_radius}
+        
+        node_keys = grid_adjacency.get_cell_keys(filtered_household_cells_idx[0], filtered_household_cells_idx[1], num_cells_y)
+        grid_state = grid_incremental.load_state(incremental_state, state_meta)
         
+        if grid_state is not None:
+            logging.info("Updating grid nodes and graph from " + incremental_state + "...")
+            node_labels, next_label, adj_src, adj_dst, adj_w, grid_changes = grid_incremental.update_grid(grid_state, node_keys, filtered_household_cells_counts, x_mid, y_mid, migration_radius)
+        else:
+            next_label = len(node_labels)
+    
     
     logging.info("Constructing population nodes...")
     
+    # stable cell ids of the anchored grid cells
+    if anchored_grid:
+        cell_ids = grid_anchor.get_cell_ids(filtered_household_cells_idx[0], filtered_household_cells_idx[1], xedges, yedges, anchored_grid_resolution_arcsec)
+    
     # get coordinates of filtered cells' midpoints and calculate approximate population per pixels using number of households and avg # people (guess) per household
     # use that to assemble population nodes 
-    pop_nodes = "node_label,lat,lon,pop,num_hhs\n"
-    
-    # map between node coordinates and node label; to avoid look-up logic
-    coor_idxs_2_node_label = {}
+    pop_nodes = "node_label,lat,lon,pop,num_hhs" + (",cell_id" if anchored_grid else "") + "\n"
     
     for i, idx_x in enumerate(filtered_household_cells_idx[0]):
         
         idx_y = filtered_household_cells_idx[1][i]
         
-        node_label = str(i) # unique node label
-        
-        coor_idxs_2_node_label[str(idx_x)+"_"+str(idx_y)] = node_label
+        node_label = str(node_labels[i]) # unique node label
         
-        lat = str(Y_mid[idx_y][idx_x])
-        lon = str(X_mid[idx_y][idx_x])
-        pop = str(int(cells_data[idx_x][idx_y] * avg_household_size))
-        num_hhs = str(cells_data[idx_x][idx_y])
+        lat = str(y_mid[idx_y])
+        lon = str(x_mid[idx_x])
+        pop = str(int(filtered_household_cells_counts[i] * avg_household_size))
+        num_hhs = str(filtered_household_cells_counts[i])
         
-        pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "," + num_hhs + "\n"
+        pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "," + num_hhs + ("," + str(cell_ids[i]) if anchored_grid else "") + "\n"
         
 
     with open("pop_gridded.csv", "w") as phg_f:
@@ -166,43 +342,40 @@ if __name__ == '__main__':
     '''
     Construct the grid graph adjacency list based on local connectivity constraints
     
-    There are more efficient ways to do that, but for graphs of dozens of thousands of nodes this is probably fine
+    Cells are keyed by integers and their neighbors within migration_radius hops are looked up one stencil offset at a time for all cells at once;
+    edge weights (vincenty distances between cell centroids) are computed in batches; see grid_adjacency.py
     '''
-    adj_list = {}
+    # tiled grids are connected along with binning (see grid_tiles.py); incremental rebuilds only connect the affected cells (see grid_incremental.py)
+    if num_processes <= 1 and grid_state is None:
+        adj_src, adj_dst, adj_w = grid_adjacency.build_adjacency(filtered_household_cells_idx[0], filtered_household_cells_idx[1], x_mid, y_mid, migration_radius)
     
-    # get each cell in the grid
-    for i, idx_x in enumerate(filtered_household_cells_idx[0]):
-        idx_y = filtered_household_cells_idx[1][i]
-        node_label = str(i) 
-        
-        adj_list[node_label] = {}
-        
-        # find the potential neighbors of the cell
-        neigh_candidates = []
-        for i in range(idx_x - migration_radius, idx_x + migration_radius + 1):
-            for j in range(idx_y - migration_radius, idx_y + migration_radius + 1): 
-                neigh_candidates.append([i, j])
-                 
-        # check if neighbor cells exist on the grid (e.g. their household density is sufficiently high)
-        for neigh_cand in neigh_candidates: 
-             if str(neigh_cand[0])+"_"+str(neigh_cand[1]) in coor_idxs_2_node_label: 
-                neigh_node_label = coor_idxs_2_node_label[str(neigh_cand[0])+"_"+str(neigh_cand[1])]
-                
-                lat_src = Y_mid[idx_y][idx_x]
-                lon_src = X_mid[idx_y][idx_x]
-                
-                lat_dst = Y_mid[neigh_cand[1]][neigh_cand[0]]
-                lon_dst = X_mid[neigh_cand[1]][neigh_cand[0]]
-        
-                # calculate source destination distance and weight the graph
-                w = vincenty((lat_src, lon_src), (lat_dst, lon_dst)).km
-                
-                adj_list[node_label][neigh_node_label] = w
-    
-    with open("gridded_households_adj_list.json", "w") as a_f:
-        json.dump(adj_list, a_f, indent = 3)
-        
-    logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list.json")
+    # bridges of pruned components to their nearest larger components (see grid_components.py)
+    if prune_components == "bridge":
+        adj_src, adj_dst, adj_w = np.concatenate((adj_src, bridge_src)), np.concatenate((adj_dst, bridge_dst)), np.concatenate((adj_w, bridge_w))
+    
+    adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(adj_src, adj_dst, adj_w, len(filtered_household_cells_idx[0]), single_direction = adj_graph_single_direction)
+    grid_graph.save_csr("gridded_households_adj_graph.npz", adj_indptr, adj_indices, adj_weights, node_labels = node_labels, single_direction = adj_graph_single_direction)
+    
+    logging.info("Grid graph saved to gridded_households_adj_graph.npz")
+    
+    if export_adj_list_json:
+        adj_list = grid_adjacency.to_adj_list(adj_src, adj_dst, adj_w, len(filtered_household_cells_idx[0]), [str(node_label) for node_label in node_labels])
+        
+        with open("gridded_households_adj_list.json", "w") as a_f:
+            json.dump(adj_list, a_f, indent = 3)
+            
+        logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list.json")
+    
+    if incremental_state:
+        grid_incremental.save_state(incremental_state, state_meta, node_keys, filtered_household_cells_counts, node_labels, next_label, adj_src, adj_dst, adj_w)
+        
+        logging.info("Grid state saved to " + incremental_state)
+        
+        if grid_state is not None:
+            with open("gridded_households_changes.json", "w") as c_f:
+                json.dump(grid_changes, c_f, indent = 3)
+            
+            logging.info("Grid changes (" + str(len(grid_changes["nodes"]["added"])) + " added, " + str(len(grid_changes["nodes"]["removed"])) + " removed, " + str(len(grid_changes["nodes"]["modified"])) + " modified nodes) saved to gridded_households_changes.json")
 
 
 
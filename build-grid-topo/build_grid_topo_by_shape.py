@@ -0,0 +1,260 @@
+'''
+- process a collection of households into a connected grid of cells and split it by a collection of geojson shapes (e.g. haiti admin2 communes) in one build,
+  instead of running build_grid_topo_filter_by_shape.py once per shape
+- every kept grid cell is joined to the shape containing its centroid in a single pass over all shapes (scanlines through the rows of the kept cells only;
+  see grid_shapes.py); cells outside of all shapes are dropped
+- the grid graph is built once for all cells; each group of shapes (e.g. each commune, or each province/departement) gets its own nodes csv and the subgraph
+  of its nodes (edges across group borders are dropped); node labels are the same in the combined and in the per group outputs
+
+- input:     - households csv file with required columns lat,lon # see example input files (structures_households.csv)
+             - geojson file with the shapes (e.g. haiti_admin2.geojson)
+
+- output:    - csv file of grid locations in all shapes, with additional shape columns (e.g. commune,province) # see example output files (pop_gridded.csv)
+             - binary grid graph and json adjacency list of all grid locations (gridded_households_adj_graph.npz, gridded_households_adj_list.json)
+             - per group: csv file of grid locations, binary grid graph and json adjacency list of the group's subgraph
+               # e.g. pop_gridded_jeremie.csv, gridded_households_adj_graph_jeremie.npz, gridded_households_adj_list_jeremie.json
+'''
+
+import re
+import json
+import logging
+import unicodedata
+
+import numpy as np
+
+import pandas as pd
+
+from geopy.distance import vincenty
+
+import grid_adjacency
+import grid_graph
+import grid_binning
+import grid_shapes
+import grid_order
+
+import matplotlib.pyplot as plt
+
+
+# ascii text of a shape property value (accents removed), for csv columns
+def to_ascii(value):
+    return unicodedata.normalize('NFKD', u"%s" % value).encode('ascii', 'ignore').decode('ascii')
+
+
+# output file name suffix of a group, e.g. _jeremie, _grand_anse
+def get_group_suffix(group):
+    return "_" + re.sub('[^0-9a-z]+', '_', to_ascii(group).lower()).strip('_')
+
+
+# square grid cell/pixel side (in m)
+cell_size = 50
+
+# demographic grid cell should contain more households than a threshold
+cell_household_threshold = 5
+
+# how far people would definitely go by foot in units of neighborhood hops (1 hop is the adjacent 8 cells on the grid; 2 hops is the adjacent 24 cells, etc.
+# this prepares an approximation of a local topology
+migration_radius = 3
+
+# the grid graph is always saved in binary CSR form (e.g. gridded_households_adj_graph.npz; see grid_graph.py)
+# single direction storage keeps only one direction of each edge and no self-loops; both are restored on load
+adj_graph_single_direction = False
+
+# also export the json adjacency lists (e.g. gridded_households_adj_list.json); required by the dtk-tools spatial workflow migration generation
+export_adj_list_json = True
+
+# geojson file with the shapes cells are joined to
+shapes_geojson = "haiti_admin2.geojson"
+
+# directory of the prepared geojson shapes cache (see grid_shapes.py); None to disable the cache
+shapes_cache_dir = "."
+
+# node columns from the properties of the shape containing each cell, as (column, geojson property);
+# the haiti admin2 communes also carry their admin1 province (departement)
+shape_columns = [("commune", "commune"), ("province", "departemen")]
+
+# node column by which the nodes are grouped into per group outputs (e.g. "province" for per departement grids); None to only write the combined outputs
+group_column = "commune"
+
+# order the nodes (node labels and the rows of all (combined and per group) outputs) along a space-filling curve of the grid, so that nearby cells get nearby node labels: "hilbert" or "morton"
+# (see grid_order.py); None keeps the column by column grid order
+node_order = None # e.g. "hilbert"
+
+# average household size (in people); verify with census/other data?
+avg_household_size = 4.5 # can change to distribution...
+
+
+# lat lon bounding box to filter input buildings if needed
+
+'''
+area around Moron
+
+x_min = -74.339894
+x_max = -74.093235
+y_min = 18.511138
+y_max = 18.597931
+
+'''
+
+# Grand'Anse
+# this is a pretty big area and you might want to use 500m cell size above
+
+x_min = -74.544151
+x_max = -73.784895
+y_min = 18.362657
+y_max = 18.699085
+
+
+
+
+if __name__ == '__main__':
+
+
+    logging.basicConfig(format='%(message)s', level='INFO')
+
+
+    logging.info("Reading data...")
+
+    # get household records within the given bounding box
+    all_hh_records = pd.read_csv("structures_households.csv")
+    hh_records = all_hh_records[(all_hh_records.lon > x_min) & (all_hh_records.lon < x_max) & (all_hh_records.lat > y_min) & (all_hh_records.lat < y_max)]
+
+    # get point locations of households
+    points = hh_records[["lon", "lat"]].values
+
+
+    logging.info("Calculating grid cell mesh...")
+
+    # get number of grid cells along the x (grid width) and y axis (grid height) based on the bounding box dimensions and pixel/cell size
+    num_cells_x = int(1000*vincenty((y_min, x_min), (y_min, x_max)).km/cell_size) + 1
+    num_cells_y = int(1000*vincenty((y_min, x_min), (y_max, x_min)).km/cell_size) + 1
+
+    # bin households into occupied cells (see grid_binning.py)
+    xedges, yedges = grid_binning.get_histogram_edges((points[:,0].min(), points[:,0].max()), (points[:,1].min(), points[:,1].max()), num_cells_x, num_cells_y)
+    cell_keys, cell_counts = grid_binning.sparse_histogram2d(points[:,0], points[:,1], xedges, yedges)
+
+    # get centroids of grid cells
+    x_mid = (xedges[1:] + xedges[:-1])/2
+    y_mid = (yedges[1:] + yedges[:-1])/2
+
+    # filter occupied cells by number of households greater than a threshold in each cell
+    filtered_cell_keys = cell_keys[cell_counts >= cell_household_threshold]
+    filtered_cell_counts = cell_counts[cell_counts >= cell_household_threshold]
+
+
+    logging.info("Joining grid cells to shapes in " + shapes_geojson + "...")
+
+    # prepared shapes (see grid_shapes.py); all kept cells are joined to all shapes at once
+    shape_index = grid_shapes.ShapeIndex.load(shapes_geojson, shapes_cache_dir)
+    cells_shape_idxs = shape_index.join_cells(xedges, yedges, filtered_cell_keys)
+
+    in_shapes = cells_shape_idxs >= 0
+
+    node_keys = filtered_cell_keys[in_shapes]
+    node_counts = filtered_cell_counts[in_shapes]
+    node_shape_idxs = cells_shape_idxs[in_shapes]
+
+    if node_order:
+
+        logging.info("Ordering grid nodes along a " + node_order + " curve...")
+
+        ordering = grid_order.get_node_order(node_keys // num_cells_y, node_keys % num_cells_y, node_order)
+        node_keys, node_counts, node_shape_idxs = node_keys[ordering], node_counts[ordering], node_shape_idxs[ordering]
+
+    nodes_idx = (node_keys // num_cells_y, node_keys % num_cells_y)
+
+    num_nodes = len(node_keys)
+    node_labels = np.arange(num_nodes)
+
+    logging.info(str(num_nodes) + " of " + str(len(filtered_cell_keys)) + " filtered grid cells are within the shapes")
+
+    # shape columns of each node
+    node_columns = dict((column, np.array([to_ascii(properties.get(shape_property, "")) for properties in shape_index.properties], dtype = object)[node_shape_idxs]) for column, shape_property in shape_columns)
+
+
+    logging.info("Constructing population nodes...")
+
+    # get coordinates of filtered cells' midpoints and calculate approximate population per pixels using number of households and avg # people (guess) per household
+    # one csv row per node, shared by the combined and per group csv files
+    pop_nodes_header = "node_label,lat,lon,pop,num_hhs" + "".join("," + column for column, shape_property in shape_columns) + "\n"
+    pop_nodes_rows = []
+
+    for i, idx_x in enumerate(nodes_idx[0]):
+
+        idx_y = nodes_idx[1][i]
+
+        node_label = str(node_labels[i]) # unique node label
+
+        lat = str(y_mid[idx_y])
+        lon = str(x_mid[idx_x])
+        pop = str(int(node_counts[i] * avg_household_size))
+        num_hhs = str(node_counts[i])
+
+        pop_nodes_rows.append(node_label + "," + lat + "," + lon + "," + pop + "," + num_hhs + "".join("," + node_columns[column][i] for column, shape_property in shape_columns) + "\n")
+
+
+    with open("pop_gridded.csv", "w") as phg_f:
+        phg_f.write(pop_nodes_header + "".join(pop_nodes_rows))
+
+    logging.info("Saved grid population nodes to pop_gridded.csv")
+
+
+    logging.info("Generating grid graph adjacency matrix")
+
+    '''
+    Construct the grid graph adjacency list based on local connectivity constraints, once for all groups; see grid_adjacency.py
+    '''
+    adj_src, adj_dst, adj_w = grid_adjacency.build_adjacency(nodes_idx[0], nodes_idx[1], x_mid, y_mid, migration_radius)
+
+    adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(adj_src, adj_dst, adj_w, num_nodes, single_direction = adj_graph_single_direction)
+    grid_graph.save_csr("gridded_households_adj_graph.npz", adj_indptr, adj_indices, adj_weights, node_labels = node_labels, single_direction = adj_graph_single_direction)
+
+    logging.info("Grid graph saved to gridded_households_adj_graph.npz")
+
+    if export_adj_list_json:
+        adj_list = grid_adjacency.to_adj_list(adj_src, adj_dst, adj_w, num_nodes, [str(node_label) for node_label in node_labels])
+
+        with open("gridded_households_adj_list.json", "w") as a_f:
+            json.dump(adj_list, a_f, indent = 3)
+
+        logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list.json")
+
+
+    if group_column:
+
+        groups = np.unique(node_columns[group_column])
+
+        logging.info("Saving the nodes and subgraphs of " + str(len(groups)) + " groups by " + group_column + "...")
+
+        num_group_edges = 0
+
+        for group in groups:
+
+            group_nodes = np.flatnonzero(node_columns[group_column] == group)
+            suffix = get_group_suffix(group)
+
+            with open("pop_gridded" + suffix + ".csv", "w") as phg_f:
+                phg_f.write(pop_nodes_header + "".join(pop_nodes_rows[i] for i in group_nodes))
+
+            # edges within the group; positions in group_nodes
+            group_src, group_dst, group_w = grid_graph.get_subgraph(adj_src, adj_dst, adj_w, group_nodes, num_nodes)
+            num_group_edges += len(group_src)
+
+            group_indptr, group_indices, group_weights = grid_graph.to_csr(group_src, group_dst, group_w, len(group_nodes), single_direction = adj_graph_single_direction)
+            grid_graph.save_csr("gridded_households_adj_graph" + suffix + ".npz", group_indptr, group_indices, group_weights, node_labels = node_labels[group_nodes], single_direction = adj_graph_single_direction)
+
+            if export_adj_list_json:
+                adj_list = grid_adjacency.to_adj_list(group_src, group_dst, group_w, len(group_nodes), [str(node_label) for node_label in node_labels[group_nodes]])
+
+                with open("gridded_households_adj_list" + suffix + ".json", "w") as a_f:
+                    json.dump(adj_list, a_f, indent = 3)
+
+            logging.info(group + ": " + str(len(group_nodes)) + " nodes saved to pop_gridded" + suffix + ".csv, subgraph saved to gridded_households_adj_graph" + suffix + ".npz")
+
+        logging.info(str(len(adj_src) - num_group_edges) + " adjacency entries across " + group_column + " borders were dropped from the group subgraphs")
+
+
+    # plotting grid cells; color by group
+    logging.info("Plotting grid cells by shape.")
+    plt.scatter(x_mid[nodes_idx[0]], y_mid[nodes_idx[1]], s = np.sqrt(node_counts * avg_household_size), c = node_shape_idxs, cmap = 'jet', linewidths = 0)
+
+    plt.show()
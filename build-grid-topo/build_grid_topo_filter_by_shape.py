@@ -1,10 +1,12 @@
 '''
 - process a collection of households into a connected grid of cells; only cells whose centroids is within the union of a colletion of shapes is included 
+- alternatively (shape_coverage = "fraction"), cells are included if enough of their area is within the shapes, and border cells can be weighted by their covered fraction
 
 - input:     - households csv file with required columns lat,lon # see example input files (structures_households.csv)
              - using geojson shape-based household/grid cell filter requires a geojson file with filter shapes (e.g. haiti_admin2.geojson) 
 
 - output:    - csv file of grid locations filtered by bounding box and geojson shape # see example output files (pop_gridded.csv)
+               with shape_coverage = "fraction", an additional column shape_fraction with the fraction of each cell's area within the shapes
              - json adjacency list of local grid connectivity (compatible with dtk-tools spatial workflow) # see example output files (gridded_households_adj_list.json)  
 '''
 
@@ -20,6 +22,11 @@ import pandas as pd
 
 from geopy.distance import vincenty 
 import geocoder
+
+import grid_adjacency
+import grid_graph
+import grid_shapes
+import grid_order
 from shapely.geometry import shape, Point
 from descartes import PolygonPatch
 
@@ -47,6 +54,7 @@ def is_in_shape(point, shape):
 # decide if a pandas dataframe record with lat, lon features corresponds to a point within the union of geojson shapes;
 # note that point here could be a data frame row with columns including "lat", "lon" or a dictionary with keys lat, lon; 
 # useful in pandas dataframe apply-type of filter functions (see example below) 
+# for many points, use the bulk filter in grid_shapes.py instead (e.g. shape_index.contains(lons, lats))
 def shape_filter(point, geo_json_shapes):
     
     for shape_features in geo_json_shapes:
@@ -67,6 +75,31 @@ cell_household_threshold = 5
 # this prepares an approximation of a local topology
 migration_radius = 3 
 
+# the grid graph is always saved in binary CSR form (e.g. gridded_households_adj_graph.npz; see grid_graph.py)
+# single direction storage keeps only one direction of each edge and no self-loops; both are restored on load
+adj_graph_single_direction = False
+
+# also export the json adjacency list (e.g. gridded_households_adj_list.json); required by the dtk-tools spatial workflow migration generation
+export_adj_list_json = True
+
+# directory of the prepared geojson shapes cache (see grid_shapes.py); None to disable the cache
+shapes_cache_dir = "."
+
+# how grid cells are matched to the filter shapes (shapes are rasterized onto the grid; see grid_shapes.py)
+# "centroid": cells whose centroid is within the shapes; "fraction": cells with at least min_shape_fraction of their area within the shapes
+shape_coverage = "centroid"
+min_shape_fraction = 0.5
+
+# with shape_coverage = "fraction", scale the number of households (and population) of cells on the shapes borders by their covered fraction
+weight_by_shape_fraction = False
+
+# number of scanlines per row of grid cells used to estimate covered fractions
+shape_fraction_subsamples = 8
+
+# order the nodes (node labels and the rows of all outputs) along a space-filling curve of the grid, so that nearby cells get nearby node labels: "hilbert" or "morton" 
+# (see grid_order.py); None keeps the column by column grid order
+node_order = None # e.g. "hilbert"
+
 # average household size (in people); verify with census/other data?
 avg_household_size = 4.5 # can change to distribution...
 
@@ -121,15 +154,16 @@ if __name__ == '__main__':
     for shape_features in shapes["features"]:
         if remove_accents(shape_features["properties"]["commune"]) == "jeremie":
             filter_shapes.append(shape_features)
+    
+    # prepared filter shapes for bulk point-in-shape tests (see grid_shapes.py); same selection as above
+    shape_index = grid_shapes.ShapeIndex.load('haiti_admin2.geojson', shapes_cache_dir).select(lambda properties: remove_accents(properties["commune"]) == "jeremie")
             
     # note that one could apply the filter directly to pandas data frame containing households (or grid cells centroid) lat/lon columns
-    # the apply filter operations is a bit slow for hundreds of thousands of households (on the order of a minute)
-    # but here is an example usage, that can be applied to the households data frame above, if needed:    
-    # hh_records = hh_records[hh_records.apply(shape_filter, args = (filter_shapes, ), axis = 1)]
+    # the apply filter operations (shape_filter) is a bit slow for hundreds of thousands of households (on the order of a minute)
+    # the bulk filter takes seconds for millions of households; here is an example usage, that can be applied to the households data frame above, if needed:    
+    # hh_records = hh_records[shape_index.contains(hh_records.lon.values, hh_records.lat.values)]
     #
     # in this example we apply the filter directly to grid cells, prior generating adjacency grid matrix below
-    # one could refactor a bit and apply the filter directly to a pandas grid cells data frame as well
-    # the pandas operation is not noticeably faster for a few thousand grid cells
 
     # get point locations of households
     points = hh_records.as_matrix(["lon", "lat"])
@@ -176,6 +210,13 @@ if __name__ == '__main__':
     # mask returns False for valid entries;  True would be easier to work with
     inverted_filtered_households_mask = np.in1d(cells_mask.ravel(), [False]).reshape(cells_mask.shape)
     filtered_household_cells_idx = np.where(inverted_filtered_households_mask)
+    
+    if node_order:
+        
+        logging.info("Ordering grid nodes along a " + node_order + " curve...")
+        
+        ordering = grid_order.get_node_order(filtered_household_cells_idx[0], filtered_household_cells_idx[1], node_order)
+        filtered_household_cells_idx = (filtered_household_cells_idx[0][ordering], filtered_household_cells_idx[1][ordering])
         
 
     
@@ -187,10 +228,16 @@ if __name__ == '__main__':
     #
     # also filter by provided gepjson shape files above
     
-    pop_nodes = "node_label,lat,lon,pop,num_hhs\n"
+    pop_nodes = "node_label,lat,lon,pop,num_hhs" + (",shape_fraction" if shape_coverage == "fraction" else "") + "\n"
     
-    # map between node coordinates and node label; to avoid look-up logic
-    coor_idxs_2_node_label = {}
+    # rasterize the filter shapes onto the grid and look up the coverage of all cells at once
+    cells_shape_fractions = shape_index.get_cell_coverage(xedges, yedges, grid_adjacency.get_cell_keys(filtered_household_cells_idx[0], filtered_household_cells_idx[1], num_cells_y),
+                                                          fractions = shape_coverage == "fraction", subsamples = shape_fraction_subsamples)
+    
+    if shape_coverage == "fraction":
+        cells_in_shapes = (cells_shape_fractions > 0) & (cells_shape_fractions >= min_shape_fraction)
+    else:
+        cells_in_shapes = cells_shape_fractions > 0
     
     for i, idx_x in enumerate(filtered_household_cells_idx[0]):
         
@@ -198,21 +245,24 @@ if __name__ == '__main__':
         
         node_label = str(i) # unique node label
         
-        coor_idxs_2_node_label[str(idx_x)+"_"+str(idx_y)] = node_label
-        
         lat = str(Y_mid[idx_y][idx_x])
         lon = str(X_mid[idx_y][idx_x])
         
-        point = {"lat":lat, "lon":lon}
-        
-        if not shape_filter(point, filter_shapes):
+        if not cells_in_shapes[i]:
             # filter a cell if it is not in the bounding union of shapefiles
             continue
         
-        pop = str(int(cells_data[idx_x][idx_y] * avg_household_size))
-        num_hhs = str(cells_data[idx_x][idx_y])
+        num_hhs = cells_data[idx_x][idx_y]
         
-        pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "," + num_hhs + "\n"
+        if shape_coverage == "fraction" and weight_by_shape_fraction:
+            num_hhs = num_hhs * cells_shape_fractions[i]
+        
+        pop = str(int(num_hhs * avg_household_size))
+        
+        if shape_coverage == "fraction":
+            pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "," + str(num_hhs) + "," + str(cells_shape_fractions[i]) + "\n"
+        else:
+            pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "," + str(num_hhs) + "\n"
         
 
     with open("pop_gridded.csv", "w") as phg_f:
@@ -228,43 +278,23 @@ if __name__ == '__main__':
     '''
     Construct the grid graph adjacency list based on local connectivity constraints
     
-    There are more efficient ways to do that, but for graphs of dozens of thousands of nodes this is probably fine
+    Cells are keyed by integers and their neighbors within migration_radius hops are looked up one stencil offset at a time for all cells at once;
+    edge weights (vincenty distances between cell centroids) are computed in batches; see grid_adjacency.py
     '''
-    adj_list = {}
+    adj_src, adj_dst, adj_w = grid_adjacency.build_adjacency(filtered_household_cells_idx[0], filtered_household_cells_idx[1], x_mid, y_mid, migration_radius)
     
-    # get each cell in the grid
-    for i, idx_x in enumerate(filtered_household_cells_idx[0]):
-        idx_y = filtered_household_cells_idx[1][i]
-        node_label = str(i) 
-        
-        adj_list[node_label] = {}
-        
-        # find the potential neighbors of the cell
-        neigh_candidates = []
-        for i in range(idx_x - migration_radius, idx_x + migration_radius + 1):
-            for j in range(idx_y - migration_radius, idx_y + migration_radius + 1): 
-                neigh_candidates.append([i, j])
-                 
-        # check if neighbor cells exist on the grid (e.g. their household density is sufficiently high)
-        for neigh_cand in neigh_candidates: 
-             if str(neigh_cand[0])+"_"+str(neigh_cand[1]) in coor_idxs_2_node_label: 
-                neigh_node_label = coor_idxs_2_node_label[str(neigh_cand[0])+"_"+str(neigh_cand[1])]
-                
-                lat_src = Y_mid[idx_y][idx_x]
-                lon_src = X_mid[idx_y][idx_x]
-                
-                lat_dst = Y_mid[neigh_cand[1]][neigh_cand[0]]
-                lon_dst = X_mid[neigh_cand[1]][neigh_cand[0]]
-        
-                # calculate source destination distance and weight the graph
-                w = vincenty((lat_src, lon_src), (lat_dst, lon_dst)).km
-                
-                adj_list[node_label][neigh_node_label] = w
+    adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(adj_src, adj_dst, adj_w, len(filtered_household_cells_idx[0]), single_direction = adj_graph_single_direction)
+    grid_graph.save_csr("gridded_households_adj_graph.npz", adj_indptr, adj_indices, adj_weights, single_direction = adj_graph_single_direction)
+    
+    logging.info("Grid graph saved to gridded_households_adj_graph.npz")
     
-    with open("gridded_households_adj_list.json", "w") as a_f:
-        json.dump(adj_list, a_f, indent = 3)
+    if export_adj_list_json:
+        adj_list = grid_adjacency.to_adj_list(adj_src, adj_dst, adj_w, len(filtered_household_cells_idx[0]))
         
-    logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list.json")
+        with open("gridded_households_adj_list.json", "w") as a_f:
+            json.dump(adj_list, a_f, indent = 3)
+            
+        logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list.json")
 
 
     fig, ax = plt.subplots()
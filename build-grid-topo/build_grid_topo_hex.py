@@ -0,0 +1,165 @@
+'''
+- process a collection of households into a connected grid of hexagonal cells, instead of the square cells of build_grid_topo.py (see grid_hex.py)
+- hexagons have the same area as the square cells of side cell_size, so the cell_household_threshold means the same household density
+- hexagonal cells only have face neighbors, all (approximately) at the same distance; for the same migration_radius (in hex rings) the graph has
+  ~25-30% fewer edges than the square grid graph (e.g. 36 instead of 48 neighbors per cell for migration_radius = 3)
+- this is a modified version of build_grid_topo.py
+
+- input:     - households csv file with required columns lat,lon # see example input files (structures_households.csv)
+
+- output:    - csv file of grid locations (hexagon centers) # e.g. pop_gridded_hex.csv
+             - binary grid graph and optionally json adjacency list, in the same formats as the square grid # e.g. gridded_households_adj_graph_hex.npz, gridded_households_adj_list_hex.json
+'''
+
+import json
+import logging
+
+import numpy as np
+
+import pandas as pd
+
+import grid_adjacency
+import grid_graph
+import grid_hex
+
+import matplotlib.pyplot as plt
+
+
+# side (in m) of the square grid cell/pixel of the same area as a hexagonal cell; hexagon centers are ~1.075 * cell_size apart
+cell_size = 50
+
+# demographic grid cell should contain more households than a threshold
+cell_household_threshold = 5
+
+# how far people would definitely go by foot in units of hex rings (1 ring is the adjacent 6 cells; 2 rings is the adjacent 18 cells, etc.)
+# this prepares an approximation of a local topology
+migration_radius = 3
+
+# the grid graph is always saved in binary CSR form (see grid_graph.py)
+# single direction storage keeps only one direction of each edge and no self-loops; both are restored on load
+adj_graph_single_direction = False
+
+# also export the json adjacency list; required by the dtk-tools spatial workflow migration generation
+export_adj_list_json = True
+
+# number of households csv rows to read at a time; if set, the csv is streamed in chunks (out-of-core) instead of being read at once
+chunk_size = None # e.g. 1000000
+
+# average household size (in people); verify with census/other data?
+avg_household_size = 4.5 # can change to distribution...
+
+
+# lat lon bounding box to filter input buildings if needed
+
+
+#area around Moron
+
+x_min = -74.339894
+x_max = -74.093235
+y_min = 18.511138
+y_max = 18.597931
+
+
+'''
+# Grand'Anse
+# this is a pretty big area and you might want to use 500m cell size above
+
+x_min = -74.544151
+x_max = -73.784895
+y_min = 18.362657
+y_max = 18.699085
+'''
+
+
+
+if __name__ == '__main__':
+
+
+    logging.basicConfig(format='%(message)s', level='INFO')
+
+
+    logging.info("Calculating hexagonal grid cell mesh...")
+
+    hex_grid = grid_hex.HexGrid((x_min, x_max, y_min, y_max), cell_size)
+
+
+    # bin households in the hexagonal cells
+    if chunk_size:
+
+        logging.info("Reading and binning data in chunks of " + str(chunk_size) + " rows...")
+
+        cell_keys, cell_counts = hex_grid.sparse_histogram_chunked("structures_households.csv", chunk_size)
+
+    else:
+
+        logging.info("Reading data...")
+
+        # get household records within the given bounding box
+        all_hh_records = pd.read_csv("structures_households.csv")
+        hh_records = all_hh_records[(all_hh_records.lon > x_min) & (all_hh_records.lon < x_max) & (all_hh_records.lat > y_min) & (all_hh_records.lat < y_max)]
+
+        cell_keys, cell_counts = hex_grid.sparse_histogram(hh_records.lon.values, hh_records.lat.values)
+
+
+    # filter cells by number of households greater than a threshold in each cell
+    filtered_cell_keys = cell_keys[cell_counts >= cell_household_threshold]
+    filtered_cell_counts = cell_counts[cell_counts >= cell_household_threshold]
+
+    nodes_idx = (filtered_cell_keys // hex_grid.num_cells_r, filtered_cell_keys % hex_grid.num_cells_r)
+    num_nodes = len(filtered_cell_keys)
+
+    node_lons, node_lats = hex_grid.get_centroids(nodes_idx[0], nodes_idx[1])
+
+    logging.info(str(num_nodes) + " of " + str(len(cell_keys)) + " occupied hexagonal cells kept")
+
+
+    logging.info("Constructing population nodes...")
+
+    pop_nodes = "node_label,lat,lon,pop,num_hhs\n"
+
+    for i in range(num_nodes):
+
+        node_label = str(i) # unique node label
+
+        lat = str(node_lats[i])
+        lon = str(node_lons[i])
+        pop = str(int(filtered_cell_counts[i] * avg_household_size))
+        num_hhs = str(filtered_cell_counts[i])
+
+        pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "," + num_hhs + "\n"
+
+
+    with open("pop_gridded_hex.csv", "w") as phg_f:
+        phg_f.write(pop_nodes)
+
+    logging.info("Saved grid population nodes to pop_gridded_hex.csv")
+
+
+    logging.info("Generating grid graph adjacency matrix")
+
+    '''
+    Construct the grid graph adjacency list of the cells within migration_radius hex rings; see grid_hex.py
+    '''
+    adj_src, adj_dst, adj_w = hex_grid.build_adjacency(nodes_idx[0], nodes_idx[1], migration_radius)
+
+    logging.info(str(len(adj_src)) + " adjacency entries (at most " + str(len(grid_hex.get_hex_stencil(migration_radius)[0])) + " per cell; " + str(len(grid_adjacency.get_stencil(migration_radius)[0])) + " on the square grid)")
+
+    adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(adj_src, adj_dst, adj_w, num_nodes, single_direction = adj_graph_single_direction)
+    grid_graph.save_csr("gridded_households_adj_graph_hex.npz", adj_indptr, adj_indices, adj_weights, single_direction = adj_graph_single_direction)
+
+    logging.info("Grid graph saved to gridded_households_adj_graph_hex.npz")
+
+    if export_adj_list_json:
+        adj_list = grid_adjacency.to_adj_list(adj_src, adj_dst, adj_w, num_nodes)
+
+        with open("gridded_households_adj_list_hex.json", "w") as a_f:
+            json.dump(adj_list, a_f, indent = 3)
+
+        logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list_hex.json")
+
+
+    # plotting grid cells; size by population
+    logging.info("Plotting hexagonal grid cells.")
+    plt.scatter(node_lons, node_lats, s = np.sqrt(filtered_cell_counts * avg_household_size), marker = 'h', linewidths = 0)
+
+    plt.show()
@@ -0,0 +1,185 @@
+'''
+- process a collection of households into connected grids of cells at multiple resolutions (e.g. to choose a cell size) in a single pass over the households
+- households are binned once at the finest resolution; coarser levels are obtained by sum-pooling blocks of cells of the finest grid, so all levels are aligned
+  (see grid_pyramid.py); note that coarse levels thus span the finest grid rather than being fit to the households extent as in build_grid_topo.py
+- this is a modified version of build_grid_topo.py
+
+- input:     - households csv file with required columns lat,lon # see example input files (structures_households.csv)
+
+- output:    - for each cell size (e.g. 500m): csv file of grid locations # e.g. pop_gridded_500m.csv (same format as pop_gridded.csv)
+             - for each cell size: binary grid graph and optionally json adjacency list of local grid connectivity # e.g. gridded_households_adj_graph_500m.npz, gridded_households_adj_list_500m.json
+'''
+
+import json
+import logging
+
+import numpy as np
+
+import pandas as pd
+
+from geopy.distance import vincenty
+
+import grid_adjacency
+import grid_graph
+import grid_binning
+import grid_pyramid
+
+import matplotlib.pyplot as plt
+
+
+# square grid cell/pixel sides (in m) of the pyramid levels; all must be multiples of the smallest one
+pyramid_cell_sizes = [50, 100, 250, 500]
+
+# demographic grid cell should contain more households than a threshold (at each level)
+cell_household_threshold = 5
+
+# how far people would definitely go by foot in units of neighborhood hops (1 hop is the adjacent 8 cells on the grid; 2 hops is the adjacent 24 cells, etc.
+# this prepares an approximation of a local topology (at each level)
+migration_radius = 3
+
+# the grid graphs are always saved in binary CSR form (see grid_graph.py)
+# single direction storage keeps only one direction of each edge and no self-loops; both are restored on load
+adj_graph_single_direction = False
+
+# also export the json adjacency lists; required by the dtk-tools spatial workflow migration generation
+export_adj_list_json = True
+
+# number of households csv rows to read at a time; if set, the csv is streamed in chunks (out-of-core) instead of being read at once
+chunk_size = None # e.g. 1000000
+
+# average household size (in people); verify with census/other data?
+avg_household_size = 4.5 # can change to distribution...
+
+
+# lat lon bounding box to filter input buildings if needed
+
+
+#area around Moron
+
+x_min = -74.339894
+x_max = -74.093235
+y_min = 18.511138
+y_max = 18.597931
+
+
+'''
+# Grand'Anse
+
+x_min = -74.544151
+x_max = -73.784895
+y_min = 18.362657
+y_max = 18.699085
+'''
+
+
+
+if __name__ == '__main__':
+
+
+    logging.basicConfig(format='%(message)s', level='INFO')
+
+
+    finest_cell_size, pyramid_factors = grid_pyramid.get_pyramid_factors(pyramid_cell_sizes)
+
+    logging.info("Calculating finest grid cell mesh (" + str(finest_cell_size) + "m)...")
+
+    # get number of grid cells along the x (grid width) and y axis (grid height) based on the bounding box dimensions and the finest pixel/cell size
+    num_cells_x = int(1000*vincenty((y_min, x_min), (y_min, x_max)).km/finest_cell_size) + 1
+    num_cells_y = int(1000*vincenty((y_min, x_min), (y_max, x_min)).km/finest_cell_size) + 1
+
+
+    # bin households in the finest grid, once
+    if chunk_size:
+
+        logging.info("Reading and binning data in chunks of " + str(chunk_size) + " rows...")
+
+        cell_keys, cell_counts, xedges, yedges = grid_binning.sparse_histogram2d_chunked("structures_households.csv", (x_min, x_max, y_min, y_max), num_cells_x, num_cells_y, chunk_size)
+
+    else:
+
+        logging.info("Reading data...")
+
+        # get household records within the given bounding box
+        all_hh_records = pd.read_csv("structures_households.csv")
+        hh_records = all_hh_records[(all_hh_records.lon > x_min) & (all_hh_records.lon < x_max) & (all_hh_records.lat > y_min) & (all_hh_records.lat < y_max)]
+
+        points = hh_records.as_matrix(["lon", "lat"])
+
+        xedges, yedges = grid_binning.get_histogram_edges((points[:,0].min(), points[:,0].max()), (points[:,1].min(), points[:,1].max()), num_cells_x, num_cells_y)
+        cell_keys, cell_counts = grid_binning.sparse_histogram2d(points[:,0], points[:,1], xedges, yedges)
+
+
+    fig, axes = plt.subplots(1, len(pyramid_factors), figsize = (13,9), squeeze = False)
+
+    for level, (level_cell_size, factor) in enumerate(pyramid_factors):
+
+        level_suffix = "_" + str(level_cell_size) + "m"
+
+        logging.info("Pooling grid level " + level_suffix[1:] + "...")
+
+        # sum-pool factor x factor blocks of the finest grid cells
+        level_cell_keys, level_cell_counts, level_xedges, level_yedges = grid_pyramid.pool_level(cell_keys, cell_counts, xedges, yedges, factor)
+
+        level_num_cells_y = len(level_yedges) - 1
+
+        # get centroids of grid cells
+        x_mid = (level_xedges[1:] + level_xedges[:-1])/2
+        y_mid = (level_yedges[1:] + level_yedges[:-1])/2
+
+
+        # filter cells by number of households greater than a threshold in each cell
+        filtered_cell_keys = level_cell_keys[level_cell_counts >= cell_household_threshold]
+        filtered_household_cells_idx = (filtered_cell_keys // level_num_cells_y, filtered_cell_keys % level_num_cells_y)
+        filtered_household_cells_counts = level_cell_counts[level_cell_counts >= cell_household_threshold]
+
+
+        logging.info("Constructing population nodes...")
+
+        pop_nodes = "node_label,lat,lon,pop,num_hhs\n"
+
+        for i, idx_x in enumerate(filtered_household_cells_idx[0]):
+
+            idx_y = filtered_household_cells_idx[1][i]
+
+            node_label = str(i) # unique node label
+
+            lat = str(y_mid[idx_y])
+            lon = str(x_mid[idx_x])
+            pop = str(int(filtered_household_cells_counts[i] * avg_household_size))
+            num_hhs = str(filtered_household_cells_counts[i])
+
+            pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "," + num_hhs + "\n"
+
+
+        with open("pop_gridded" + level_suffix + ".csv", "w") as phg_f:
+            phg_f.write(pop_nodes)
+
+        logging.info("Saved grid population nodes to pop_gridded" + level_suffix + ".csv")
+
+
+        logging.info("Generating grid graph adjacency matrix")
+
+        adj_src, adj_dst, adj_w = grid_adjacency.build_adjacency(filtered_household_cells_idx[0], filtered_household_cells_idx[1], x_mid, y_mid, migration_radius)
+
+        adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(adj_src, adj_dst, adj_w, len(filtered_household_cells_idx[0]), single_direction = adj_graph_single_direction)
+        grid_graph.save_csr("gridded_households_adj_graph" + level_suffix + ".npz", adj_indptr, adj_indices, adj_weights, single_direction = adj_graph_single_direction)
+
+        logging.info("Grid graph saved to gridded_households_adj_graph" + level_suffix + ".npz")
+
+        if export_adj_list_json:
+            adj_list = grid_adjacency.to_adj_list(adj_src, adj_dst, adj_w, len(filtered_household_cells_idx[0]))
+
+            with open("gridded_households_adj_list" + level_suffix + ".json", "w") as a_f:
+                json.dump(adj_list, a_f, indent = 3)
+
+            logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list" + level_suffix + ".json")
+
+
+        # plot the level's grid cells
+        ax = axes[0][level]
+        ax.scatter(x_mid[filtered_household_cells_idx[0]], y_mid[filtered_household_cells_idx[1]], s = np.sqrt(filtered_household_cells_counts * avg_household_size), c = "red", linewidths = 0)
+        ax.set_title(level_suffix[1:] + ": " + str(len(filtered_cell_keys)) + " nodes, " + str(len(adj_src)) + " edges")
+
+
+    logging.info("Plotting grid levels.")
+    plt.show()
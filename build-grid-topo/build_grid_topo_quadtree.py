@@ -0,0 +1,179 @@
+'''
+- process a collection of households into a connected adaptive (variable resolution) grid of cells: cells are recursively split into quadrants only where
+  they contain more households than a limit, down to a minimum cell size (see grid_quadtree.py); e.g. fine cells in towns (Jeremie) and coarse cells in
+  rural areas, with far fewer nodes than a uniform grid of the minimum cell size for the same urban detail
+- households are binned once at the minimum cell size; coarser cells are aligned blocks of 2^level x 2^level minimum size cells
+- cells (quadtree leaves) are connected if they share a face, or are within migration_radius face hops of each other; edge weights are distances between cell centroids
+- this is a modified version of build_grid_topo.py
+
+- input:     - households csv file with required columns lat,lon # see example input files (structures_households.csv)
+
+- output:    - csv file of grid locations, with an additional column cell_size (in m) of each (variable size) cell # e.g. pop_gridded_quadtree.csv
+             - binary grid graph and optionally json adjacency list of the face-sharing cells # e.g. gridded_households_adj_graph_quadtree.npz, gridded_households_adj_list_quadtree.json
+'''
+
+import json
+import logging
+
+import numpy as np
+
+import pandas as pd
+
+from geopy.distance import vincenty
+
+import grid_adjacency
+import grid_graph
+import grid_binning
+import grid_quadtree
+
+import matplotlib.pyplot as plt
+
+
+# minimum square grid cell/pixel side (in m); cells are not split further
+min_cell_size = 50
+
+# number of quadtree levels; the largest cells are min_cell_size * 2^(quadtree_levels - 1) (e.g. 800m for 5 levels of 50m minimum cells)
+quadtree_levels = 5
+
+# cells with more households than this limit are split into their quadrants (unless at the minimum cell size)
+split_household_limit = 50
+
+# demographic grid cell (of any size) should contain more households than a threshold
+cell_household_threshold = 5
+
+# how far people would definitely go by foot in units of face hops between (variable size) cells; 1 connects cells sharing a face
+migration_radius = 1
+
+# the grid graph is always saved in binary CSR form (see grid_graph.py)
+# single direction storage keeps only one direction of each edge and no self-loops; both are restored on load
+adj_graph_single_direction = False
+
+# also export the json adjacency list; required by the dtk-tools spatial workflow migration generation
+export_adj_list_json = True
+
+# number of households csv rows to read at a time; if set, the csv is streamed in chunks (out-of-core) instead of being read at once
+chunk_size = None # e.g. 1000000
+
+# average household size (in people); verify with census/other data?
+avg_household_size = 4.5 # can change to distribution...
+
+
+# lat lon bounding box to filter input buildings if needed
+
+
+#area around Moron
+
+x_min = -74.339894
+x_max = -74.093235
+y_min = 18.511138
+y_max = 18.597931
+
+
+'''
+# Grand'Anse
+
+x_min = -74.544151
+x_max = -73.784895
+y_min = 18.362657
+y_max = 18.699085
+'''
+
+
+
+if __name__ == '__main__':
+
+
+    logging.basicConfig(format='%(message)s', level='INFO')
+
+
+    logging.info("Calculating finest grid cell mesh (" + str(min_cell_size) + "m)...")
+
+    # get number of grid cells along the x (grid width) and y axis (grid height) based on the bounding box dimensions and the minimum pixel/cell size
+    num_cells_x = int(1000*vincenty((y_min, x_min), (y_min, x_max)).km/min_cell_size) + 1
+    num_cells_y = int(1000*vincenty((y_min, x_min), (y_max, x_min)).km/min_cell_size) + 1
+
+
+    # bin households in the finest grid, once
+    if chunk_size:
+
+        logging.info("Reading and binning data in chunks of " + str(chunk_size) + " rows...")
+
+        cell_keys, cell_counts, xedges, yedges = grid_binning.sparse_histogram2d_chunked("structures_households.csv", (x_min, x_max, y_min, y_max), num_cells_x, num_cells_y, chunk_size)
+
+    else:
+
+        logging.info("Reading data...")
+
+        # get household records within the given bounding box
+        all_hh_records = pd.read_csv("structures_households.csv")
+        hh_records = all_hh_records[(all_hh_records.lon > x_min) & (all_hh_records.lon < x_max) & (all_hh_records.lat > y_min) & (all_hh_records.lat < y_max)]
+
+        points = hh_records.as_matrix(["lon", "lat"])
+
+        xedges, yedges = grid_binning.get_histogram_edges((points[:,0].min(), points[:,0].max()), (points[:,1].min(), points[:,1].max()), num_cells_x, num_cells_y)
+        cell_keys, cell_counts = grid_binning.sparse_histogram2d(points[:,0], points[:,1], xedges, yedges)
+
+
+    logging.info("Splitting cells with more than " + str(split_household_limit) + " households over " + str(quadtree_levels) + " levels...")
+
+    leaf_levels, leaf_x, leaf_y, leaf_counts = grid_quadtree.build_quadtree(cell_keys, cell_counts, num_cells_y, quadtree_levels, split_household_limit)
+
+    # filter cells by number of households greater than a threshold in each cell
+    kept = leaf_counts >= cell_household_threshold
+    leaf_levels, leaf_x, leaf_y, leaf_counts = leaf_levels[kept], leaf_x[kept], leaf_y[kept], leaf_counts[kept]
+
+    leaf_lons, leaf_lats = grid_quadtree.get_leaf_centroids(leaf_levels, leaf_x, leaf_y, xedges, yedges)
+
+    logging.info(str(len(leaf_levels)) + " variable size cells kept (a uniform " + str(min_cell_size) + "m grid keeps " + str((cell_counts >= cell_household_threshold).sum()) + " cells)")
+
+
+    logging.info("Constructing population nodes...")
+
+    pop_nodes = "node_label,lat,lon,pop,num_hhs,cell_size\n"
+
+    for i, level in enumerate(leaf_levels):
+
+        node_label = str(i) # unique node label
+
+        lat = str(leaf_lats[i])
+        lon = str(leaf_lons[i])
+        pop = str(int(leaf_counts[i] * avg_household_size))
+        num_hhs = str(leaf_counts[i])
+        cell_size = str(min_cell_size * 2**level)
+
+        pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "," + num_hhs + "," + cell_size + "\n"
+
+
+    with open("pop_gridded_quadtree.csv", "w") as phg_f:
+        phg_f.write(pop_nodes)
+
+    logging.info("Saved grid population nodes to pop_gridded_quadtree.csv")
+
+
+    logging.info("Generating grid graph adjacency matrix")
+
+    '''
+    Construct the grid graph adjacency list of the face-sharing cells (within migration_radius face hops); see grid_quadtree.py
+    '''
+    adj_src, adj_dst, adj_w = grid_quadtree.build_quadtree_adjacency(leaf_levels, leaf_x, leaf_y, leaf_lons, leaf_lats, num_cells_y, migration_radius)
+
+    adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(adj_src, adj_dst, adj_w, len(leaf_levels), single_direction = adj_graph_single_direction)
+    grid_graph.save_csr("gridded_households_adj_graph_quadtree.npz", adj_indptr, adj_indices, adj_weights, single_direction = adj_graph_single_direction)
+
+    logging.info("Grid graph saved to gridded_households_adj_graph_quadtree.npz")
+
+    if export_adj_list_json:
+        adj_list = grid_adjacency.to_adj_list(adj_src, adj_dst, adj_w, len(leaf_levels))
+
+        with open("gridded_households_adj_list_quadtree.json", "w") as a_f:
+            json.dump(adj_list, a_f, indent = 3)
+
+        logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list_quadtree.json")
+
+
+    # plotting grid cells; size by population, color by cell size
+    logging.info("Plotting variable size grid cells.")
+    plt.scatter(leaf_lons, leaf_lats, s = np.sqrt(leaf_counts * avg_household_size), c = leaf_levels, cmap = 'coolwarm', linewidths = 0)
+    plt.colorbar()
+
+    plt.show()
@@ -21,6 +21,13 @@ import pandas as pd
 from geopy.distance import vincenty 
 import geocoder
 
+import grid_adjacency
+import grid_graph
+import grid_binning
+import grid_anchor
+import grid_components
+import grid_order
+
 from sklearn.neighbors import DistanceMetric
 from scipy.spatial import Voronoi, voronoi_plot_2d, Delaunay
 from sklearn.neighbors import NearestNeighbors
@@ -40,6 +47,40 @@ cell_struct_threshold = 20
 # this prepares an approximation of a local topology
 migration_radius = 3 
 
+# the grid graph is always saved in binary CSR form (e.g. gridded_struct_adj_graph.npz; see grid_graph.py)
+# single direction storage keeps only one direction of each edge and no self-loops; both are restored on load
+adj_graph_single_direction = False
+
+# also export the json adjacency list (e.g. gridded_struct_adj_list.json); required by the dtk-tools spatial workflow migration generation
+export_adj_list_json = True
+
+# number of structures csv rows to read at a time; if set, the csv is streamed in chunks and binned into the grid chunk by chunk (out-of-core) 
+# instead of being read at once, e.g. for country-scale inputs; the grid is the same either way 
+chunk_size = None # e.g. 1000000
+
+# bin structures into occupied cells only (sparse grid), instead of a dense histogram and meshgrids over the whole bounding box, e.g. for large bounding boxes
+# memory then scales with the number of structures rather than the bounding box area; the resulting nodes are the same (given a positive cell threshold)
+sparse_grid = False
+
+# anchor the grid to a fixed global origin and resolution (see grid_anchor.py), instead of fitting it to the extent of the binned structures;
+# cells then get stable integer ids (column cell_id in pop_gridded_struct.csv), so that per cell attributes (e.g. elevations) can be cached and reused across runs
+anchored_grid = False
+
+# resolution (x, y) of the anchored grid in arc-seconds; keep it fixed across runs for the cell ids to remain stable
+# the default gives ~cell_size square cells around Haiti's latitude
+anchored_grid_resolution_arcsec = grid_anchor.get_resolution_arcsec(cell_size, 18.5)
+
+# prune connected components of the filtered cells (cells within migration_radius hops of each other are connected; see grid_components.py) with fewer than 
+# min_component_cells cells or lower population than min_component_pop: "drop" them, "merge" their population into the nearest cell of a larger component, 
+# or "bridge" them to that cell with an additional edge; pruned components are reported in gridded_struct_pruned_components.csv
+prune_components = None # e.g. "drop", "merge" or "bridge"
+min_component_cells = 3
+min_component_pop = 250
+
+# order the nodes (node labels and the rows of all outputs) along a space-filling curve of the grid, so that nearby cells get nearby node labels: "hilbert" or "morton" 
+# (see grid_order.py); None keeps the column by column grid order
+node_order = None # e.g. "hilbert"
+
 # default average structure size (in people); verify with census/other data?
 # if population data for each structure is available (i.e. column 'pop' structures csv input file) that data would be used instead
 avg_structure_size = 5 # can change to distribution...
@@ -76,29 +117,69 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(message)s', level='INFO')
 
     
-    logging.info("Reading data...")
-    
-    # get structure records within the given bounding box
-    all_struct_records = pd.read_csv("structures.csv")
-    struct_records = all_struct_records[(all_struct_records.lon > x_min) & (all_struct_records.lon < x_max) & (all_struct_records.lat > y_min) & (all_struct_records.lat < y_max)]
-    
-    
     logging.info("Calculating grid cell mesh...")
     
-    # get number of grid cells along the x (grid width) and y axis (grid height) based on the bounding box dimensions and pixel/cell size
-    num_cells_x = int(1000*vincenty((y_min, x_min), (y_min, x_max)).km/cell_size) + 1
-    num_cells_y = int(1000*vincenty((y_min, x_min), (y_max, x_min)).km/cell_size) + 1
+    if anchored_grid:
+        
+        # cells of the global grid covering the bounding box; the edges do not depend on the extent of the structures
+        anchored_edges = grid_anchor.get_anchored_edges((x_min, x_max, y_min, y_max), anchored_grid_resolution_arcsec)
+        
+        num_cells_x = len(anchored_edges[0]) - 1
+        num_cells_y = len(anchored_edges[1]) - 1
+        
+    else:
+        
+        # get number of grid cells along the x (grid width) and y axis (grid height) based on the bounding box dimensions and pixel/cell size
+        num_cells_x = int(1000*vincenty((y_min, x_min), (y_min, x_max)).km/cell_size) + 1
+        num_cells_y = int(1000*vincenty((y_min, x_min), (y_max, x_min)).km/cell_size) + 1
+        
+        anchored_edges = None
 
 
-    # get point locations of structures
-    if 'pop' in struct_records.columns:
-        points = struct_records.as_matrix(["lon", "lat", "pop"])
-        # bin structures in the grid; weight by population per structures provided 
-        H, xedges, yedges = np.histogram2d(points[:,0], points[:,1], bins=[num_cells_x, num_cells_y], weights = points[:,2], normed = False)
+    if chunk_size:
+        
+        logging.info("Reading and binning data in chunks of " + str(chunk_size) + " rows...")
+        
+        # bin structures within the given bounding box in the grid, one chunk of structure records at a time
+        # weight by population per structures if provided; otherwise by default average population per structure
+        if 'pop' in grid_binning.get_csv_columns("structures.csv"):
+            weighting = {"weight_column": "pop"}
+        else:
+            weighting = {"default_weight": avg_structure_size}
+        
+        if sparse_grid:
+            cell_keys, cell_counts, xedges, yedges = grid_binning.sparse_histogram2d_chunked("structures.csv", (x_min, x_max, y_min, y_max), num_cells_x, num_cells_y, chunk_size, edges = anchored_edges, **weighting)
+        else:
+            H, xedges, yedges = grid_binning.histogram2d_chunked("structures.csv", (x_min, x_max, y_min, y_max), num_cells_x, num_cells_y, chunk_size, edges = anchored_edges, **weighting)
+    
     else:
-        points = struct_records.as_matrix(["lon", "lat"])
-        # bin households in the grid; weight by default average popuplation per structure
-        H, xedges, yedges = np.histogram2d(points[:,0], points[:,1], bins=[num_cells_x, num_cells_y], weights = np.ones(len(points[:,0]))*avg_structure_size, normed = False)
+        
+        logging.info("Reading data...")
+        
+        # get structure records within the given bounding box
+        all_struct_records = pd.read_csv("structures.csv")
+        struct_records = all_struct_records[(all_struct_records.lon > x_min) & (all_struct_records.lon < x_max) & (all_struct_records.lat > y_min) & (all_struct_records.lat < y_max)]
+        
+        
+        # get point locations of structures
+        if 'pop' in struct_records.columns:
+            points = struct_records.as_matrix(["lon", "lat", "pop"])
+            # weight by population per structures provided 
+            weights = points[:,2]
+        else:
+            points = struct_records.as_matrix(["lon", "lat"])
+            # weight by default average popuplation per structure
+            weights = np.ones(len(points[:,0]))*avg_structure_size
+        
+        # bin structures in the grid
+        if sparse_grid:
+            if anchored_grid:
+                xedges, yedges = anchored_edges
+            else:
+                xedges, yedges = grid_binning.get_histogram_edges((points[:,0].min(), points[:,0].max()), (points[:,1].min(), points[:,1].max()), num_cells_x, num_cells_y)
+            cell_keys, cell_counts = grid_binning.sparse_histogram2d(points[:,0], points[:,1], xedges, yedges, weights = weights)
+        else:
+            H, xedges, yedges = np.histogram2d(points[:,0], points[:,1], bins=list(anchored_edges) if anchored_grid else [num_cells_x, num_cells_y], weights = weights, normed = False)
     
     
     # get centroids of grid cells
@@ -106,41 +187,88 @@ if __name__ == '__main__':
     y_mid = (yedges[1:] + yedges[:-1])/2
     
     
-    # build a mesh of centroids
-    X_mid, Y_mid = np.meshgrid(x_mid[:], y_mid[:])
-    
-    # build a mesh of grid cell vertexes
-    X, Y = np.meshgrid(xedges[:-1], yedges[:-1])
-    
-
-    # plot grid cells; color by density 
-    fig = plt.figure(figsize = (13,9))
-    
-    logging.info("Plotting all filtered grid cells...")
+    if sparse_grid:
+        
+        # plot occupied grid cells; color by density
+        fig = plt.figure(figsize = (13,9))
+        
+        logging.info("Plotting all filtered grid cells...")
+        
+        plt.scatter(x_mid[cell_keys // num_cells_y], y_mid[cell_keys % num_cells_y], s = 1, c = cell_counts, cmap = 'coolwarm', vmin = 0, vmax = 20, linewidths = 0)
+        plt.colorbar()
+        plt.show()
+        
+        
+        # filter occupied cells by number of structures greater than a threshold in each cell
+        # cell keys are sorted, so the filtered cells are in the same order as in the dense case below 
+        filtered_cell_keys = cell_keys[cell_counts >= cell_struct_threshold]
+        filtered_struct_cells_idx = (filtered_cell_keys // num_cells_y, filtered_cell_keys % num_cells_y)
+        filtered_struct_cells_counts = cell_counts[cell_counts >= cell_struct_threshold]
+        
+    else:
+        
+        # build a mesh of grid cell vertexes
+        X, Y = np.meshgrid(xedges[:-1], yedges[:-1])
+        
+        
+        # plot grid cells; color by density 
+        fig = plt.figure(figsize = (13,9))
+        
+        logging.info("Plotting all filtered grid cells...")
+            
+        plt.pcolormesh(X, Y, np.swapaxes(H,0,1), cmap = 'coolwarm', vmin = 0, vmax = 20)
+        plt.colorbar()
+        plt.show()
+        
+        
+        # filter pixels/cells by number of structures greater than a threshold in each cell
+        cells_masking = ma.masked_less(H, cell_struct_threshold)
+        cells_mask = cells_masking.mask
+        cells_data =  cells_masking.data
+        
+        # mask returns False for valid entries;  True would be easier to work with
+        inverted_filtered_struct_mask = np.in1d(cells_mask.ravel(), [False]).reshape(cells_mask.shape)
+        filtered_struct_cells_idx = np.where(inverted_filtered_struct_mask)
+        filtered_struct_cells_counts = cells_data[filtered_struct_cells_idx]
         
-    plt.pcolormesh(X, Y, np.swapaxes(H,0,1), cmap = 'coolwarm', vmin = 0, vmax = 20)
-    plt.colorbar()
-    plt.show()
     
+    if prune_components:
+        
+        logging.info("Pruning small connected components of the filtered grid cells...")
+        
+        kept_cells, filtered_struct_cells_counts, bridge_src, bridge_dst, bridge_w, pruned_components = grid_components.prune_components(filtered_struct_cells_idx[0], filtered_struct_cells_idx[1], filtered_struct_cells_counts, 
+                                                                                                                                         x_mid, y_mid, migration_radius, min_component_cells, min_component_pop, prune_components)
+        
+        filtered_struct_cells_idx = (filtered_struct_cells_idx[0][kept_cells], filtered_struct_cells_idx[1][kept_cells])
+        
+        pruned_components.to_csv("gridded_struct_pruned_components.csv", index = False)
+        
+        logging.info(str(len(pruned_components)) + " components (" + str(int(pruned_components.num_cells.sum())) + " cells, population " + str(pruned_components["count"].sum()) + ") pruned (" + prune_components + "); saved to gridded_struct_pruned_components.csv")
     
-    # filter pixels/cells by number of structures greater than a threshold in each cell
-    cells_masking = ma.masked_less(H, cell_struct_threshold)
-    cells_mask = cells_masking.mask
-    cells_data =  cells_masking.data
     
-    # mask returns False for valid entries;  True would be easier to work with
-    inverted_filtered_struct_mask = np.in1d(cells_mask.ravel(), [False]).reshape(cells_mask.shape)
-    filtered_struct_cells_idx = np.where(inverted_filtered_struct_mask)
+    if node_order:
+        
+        logging.info("Ordering grid nodes along a " + node_order + " curve...")
+        
+        ordering = grid_order.get_node_order(filtered_struct_cells_idx[0], filtered_struct_cells_idx[1], node_order)
         
+        filtered_struct_cells_idx = (filtered_struct_cells_idx[0][ordering], filtered_struct_cells_idx[1][ordering])
+        filtered_struct_cells_counts = filtered_struct_cells_counts[ordering]
+        
+        # bridges of pruned components are already connected; relabel their edges
+        if prune_components == "bridge":
+            bridge_src, bridge_dst, bridge_w = grid_order.reorder_edges(bridge_src, bridge_dst, bridge_w, ordering)
+    
     
     logging.info("Constructing population nodes...")
     
+    # stable cell ids of the anchored grid cells
+    if anchored_grid:
+        cell_ids = grid_anchor.get_cell_ids(filtered_struct_cells_idx[0], filtered_struct_cells_idx[1], xedges, yedges, anchored_grid_resolution_arcsec)
+    
     # get coordinates of filtered cells' midpoints and calculate approximate population per pixels using number of structures and avg # people per structure
     # use that to assemble population nodes 
-    pop_nodes = "node_label,lat,lon,pop\n"
-    
-    # map between node coordinates and node label; to avoid look-up logic
-    coor_idxs_2_node_label = {}
+    pop_nodes = "node_label,lat,lon,pop" + (",cell_id" if anchored_grid else "") + "\n"
     
     for i, idx_x in enumerate(filtered_struct_cells_idx[0]):
         
@@ -148,17 +276,15 @@ if __name__ == '__main__':
         
         node_label = str(i) # unique node label
         
-        coor_idxs_2_node_label[str(idx_x)+"_"+str(idx_y)] = node_label
-        
-        lat = str(Y_mid[idx_y][idx_x])
-        lon = str(X_mid[idx_y][idx_x])
+        lat = str(y_mid[idx_y])
+        lon = str(x_mid[idx_x])
 
-        pop = str(int(cells_data[idx_x][idx_y]))
+        pop = str(int(filtered_struct_cells_counts[i]))
             
             
-        num_structs = str(cells_data[idx_x][idx_y])
+        num_structs = str(filtered_struct_cells_counts[i])
         
-        pop_nodes += node_label + "," + lat + "," + lon + "," + pop + "\n"
+        pop_nodes += node_label + "," + lat + "," + lon + "," + pop + ("," + str(cell_ids[i]) if anchored_grid else "") + "\n"
         
 
     with open("pop_gridded_struct.csv", "w") as phg_f:
@@ -173,43 +299,27 @@ if __name__ == '__main__':
     '''
     Construct the grid graph adjacency list based on local connectivity constraints
     
-    There are more efficient ways to do that, but for graphs of dozens of thousands of nodes this is probably fine
+    Cells are keyed by integers and their neighbors within migration_radius hops are looked up one stencil offset at a time for all cells at once;
+    edge weights (vincenty distances between cell centroids) are computed in batches; see grid_adjacency.py
     '''
-    adj_list = {}
+    adj_src, adj_dst, adj_w = grid_adjacency.build_adjacency(filtered_struct_cells_idx[0], filtered_struct_cells_idx[1], x_mid, y_mid, migration_radius)
     
-    # get each cell in the grid
-    for i, idx_x in enumerate(filtered_struct_cells_idx[0]):
-        idx_y = filtered_struct_cells_idx[1][i]
-        node_label = str(i) 
-        
-        adj_list[node_label] = {}
-        
-        # find the potential neighbors of the cell
-        neigh_candidates = []
-        for i in range(idx_x - migration_radius, idx_x + migration_radius + 1):
-            for j in range(idx_y - migration_radius, idx_y + migration_radius + 1): 
-                neigh_candidates.append([i, j])
-                 
-        # check if neighbor cells exist on the grid (e.g. their structure density is sufficiently high)
-        for neigh_cand in neigh_candidates: 
-             if str(neigh_cand[0])+"_"+str(neigh_cand[1]) in coor_idxs_2_node_label: 
-                neigh_node_label = coor_idxs_2_node_label[str(neigh_cand[0])+"_"+str(neigh_cand[1])]
-                
-                lat_src = Y_mid[idx_y][idx_x]
-                lon_src = X_mid[idx_y][idx_x]
-                
-                lat_dst = Y_mid[neigh_cand[1]][neigh_cand[0]]
-                lon_dst = X_mid[neigh_cand[1]][neigh_cand[0]]
-        
-                # calculate source destination distance and weight the graph
-                w = vincenty((lat_src, lon_src), (lat_dst, lon_dst)).km
-                
-                adj_list[node_label][neigh_node_label] = w
-    
-    with open("gridded_struct_adj_list.json", "w") as a_f:
-        json.dump(adj_list, a_f, indent = 3)
-        
-    logging.info("Grid graph adjacency matrix saved to gridded_structs_adj_list.json")
+    # bridges of pruned components to their nearest larger components (see grid_components.py)
+    if prune_components == "bridge":
+        adj_src, adj_dst, adj_w = np.concatenate((adj_src, bridge_src)), np.concatenate((adj_dst, bridge_dst)), np.concatenate((adj_w, bridge_w))
+    
+    adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(adj_src, adj_dst, adj_w, len(filtered_struct_cells_idx[0]), single_direction = adj_graph_single_direction)
+    grid_graph.save_csr("gridded_struct_adj_graph.npz", adj_indptr, adj_indices, adj_weights, single_direction = adj_graph_single_direction)
+    
+    logging.info("Grid graph saved to gridded_struct_adj_graph.npz")
+    
+    if export_adj_list_json:
+        adj_list = grid_adjacency.to_adj_list(adj_src, adj_dst, adj_w, len(filtered_struct_cells_idx[0]))
+        
+        with open("gridded_struct_adj_list.json", "w") as a_f:
+            json.dump(adj_list, a_f, indent = 3)
+            
+        logging.info("Grid graph adjacency matrix saved to gridded_structs_adj_list.json")
 
 
 
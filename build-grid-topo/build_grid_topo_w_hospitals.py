@@ -1,14 +1,17 @@
 '''
 - process a collection of households into a connected grid of cells 
-- place a collection of hospitals within the grid cells; note that other building structures (e.g. schools) can be placed similarly
+- place a collection of hospitals within the grid cells; note that other building structures (e.g. schools, markets) can be placed similarly as additional
+  point of interest layers (see poi_layers below and grid_poi.py)
 - this is a modified version of build_grid_topo.py, for illustration
 
 - input:     - households csv file with required columns lat,lon # see example input files (structures_households.csv)
              - hospitals csv file with required columns lat,lon,type # see example input files (structures_hospitals.csv)
+             - optional: csv files of other point of interest layers with required columns lat,lon,type
 
 - output:    - csv file of grid locations # see example output files (pop_gridded.csv)
              - json adjacency list of local grid connectivity (compatible with dtk-tools spatial workflow) # see example output files (gridded_households_adj_list.json)
              - csv file of hospital locations labeled by the grid cell they belong to # see example output files # see example output files (hospitals_node_labeled.csv)     
+             - same for each other point of interest layer (e.g. schools_node_labeled.csv)
 '''
 
 import math
@@ -23,6 +26,11 @@ import pandas as pd
 from geopy.distance import vincenty 
 import geocoder
 
+import grid_adjacency
+import grid_graph
+import grid_poi
+import grid_order
+
 from sklearn.neighbors import DistanceMetric
 from scipy.spatial import Voronoi, voronoi_plot_2d, Delaunay
 from sklearn.neighbors import NearestNeighbors
@@ -40,6 +48,22 @@ cell_household_threshold = 5
 # this prepares an approximation of a local topology
 migration_radius = 3 
 
+# the grid graph is always saved in binary CSR form (e.g. gridded_households_adj_graph.npz; see grid_graph.py)
+# single direction storage keeps only one direction of each edge and no self-loops; both are restored on load
+adj_graph_single_direction = False
+
+# also export the json adjacency list (e.g. gridded_households_adj_list.json); required by the dtk-tools spatial workflow migration generation
+export_adj_list_json = True
+
+# point of interest layers placed on the grid, as (layer, csv file with required columns lat,lon,type, keep cells); each layer is saved labeled by the node 
+# of its grid cell to <layer>_node_labeled.csv (see grid_poi.py); with keep cells, households are artificially added to the cells of the layer's points of interest,
+# so that they are included in the grid independent of household density
+poi_layers = [("hospitals", "structures_hospitals.csv", True)] # e.g. + [("schools", "structures_schools.csv", False)]
+
+# order the nodes (node labels and the rows of all outputs) along a space-filling curve of the grid, so that nearby cells get nearby node labels: "hilbert" or "morton" 
+# (see grid_order.py); None keeps the column by column grid order
+node_order = None # e.g. "hilbert"
+
 # average household size (in people); verify with census/other data?
 avg_household_size = 4.5 # can change to distribution...
 
@@ -81,16 +105,12 @@ if __name__ == '__main__':
     all_hh_records = pd.read_csv("structures_households.csv")
     hh_records = all_hh_records[(all_hh_records.lon > x_min) & (all_hh_records.lon < x_max) & (all_hh_records.lat > y_min) & (all_hh_records.lat < y_max)]
     
-    # get hospital records within the given bounding box; can modify if buildings of different types need to be positioned on the grid 
-    all_hospital_records = pd.read_csv("structures_hospitals.csv")
-    hospital_records = all_hospital_records[(all_hospital_records.lon > x_min) & (all_hospital_records.lon < x_max) & (all_hospital_records.lat > y_min) & (all_hospital_records.lat < y_max)]
+    # get hospital (and other point of interest layers) records within the given bounding box
+    poi_records = [grid_poi.load_poi_layer(poi_csv, (x_min, x_max, y_min, y_max)) for layer, poi_csv, keep_cells in poi_layers]
     
     # get point locations of households
     points = hh_records.as_matrix(["lon", "lat"])
     
-    # get point locations of hospitals
-    hospital_records = hospital_records.as_matrix(["lon", "lat", "type"]) 
-    
     logging.info("Calculating grid cell mesh...")
     
     # get number of grid cells along the x (grid width) and y axis (grid height) based on the bounding box dimensions and pixel/cell size
@@ -115,27 +135,23 @@ if __name__ == '__main__':
     
     
     
-    logging.info("Placing hospitals on the grid...")
+    logging.info("Placing hospitals (and other points of interest) on the grid...")
     
-    # position given hospital locations in the cells mesh
-    # can be done more efficiently; if we account for projection and grid structure  
-    hospital_mesh_idx = []
-    for hospital_record in hospital_records:
-
-        # find location index of HF in grid (need to account for projection; for now we exhaustively check each cell instead...)
-        cell_found = False
-        for idx_x in range(0, len(xedges[:-1])):
-            for idx_y in range(0, len(yedges[:-1])):
-                if hospital_record[0] > xedges[idx_x] and hospital_record[0] < xedges[idx_x + 1] and hospital_record[1] > yedges[idx_y] and hospital_record[1] < yedges[idx_y + 1]:      
-                    hospital_mesh_idx.append((idx_x, idx_y))
-                    # we'd like to ensure that the hf location is added to the grid independent of household density...  
-                    # artificially add household_thershold to existing households in the cell/pixel
-                    # could add an if to check if households threshold is satisfied and only artificially add people if not... 
-                    H[idx_x, idx_y] += H[idx_x, idx_y] + (cell_household_threshold + 1)
-                    cell_found = True
-                    break
-            if cell_found:
-                break  
+    # position given point of interest locations in the cells mesh; all points of a layer at once (see grid_poi.py)
+    poi_mesh_idx = []
+    for (layer, poi_csv, keep_cells), records in zip(poi_layers, poi_records):
+        
+        idx_x, idx_y, placed = grid_poi.place_points(records.lon.values, records.lat.values, xedges, yedges)
+        poi_mesh_idx.append((idx_x, idx_y, placed))
+        
+        logging.info(layer + ": " + str(placed.sum()) + " of " + str(len(records)) + " placed on the grid")
+        
+        if keep_cells:
+            for cell_idx_x, cell_idx_y in zip(idx_x[placed], idx_y[placed]):
+                # we'd like to ensure that the hf location is added to the grid independent of household density...  
+                # artificially add household_thershold to existing households in the cell/pixel
+                # could add an if to check if households threshold is satisfied and only artificially add people if not... 
+                H[cell_idx_x, cell_idx_y] += H[cell_idx_x, cell_idx_y] + (cell_household_threshold + 1)
 
 
     # plot grid cells; color by density 
@@ -146,8 +162,9 @@ if __name__ == '__main__':
     plt.pcolormesh(X, Y, np.swapaxes(H,0,1), cmap = 'coolwarm', vmin = 0, vmax = 20)
     plt.colorbar()
     
-    # plot hospital locations
-    plt.scatter(hospital_records[:,0], hospital_records[:,1], s = np.sqrt(2000), c = "black", linewidths = 0)
+    # plot hospital (and other points of interest) locations
+    for records in poi_records:
+        plt.scatter(records.lon.values, records.lat.values, s = np.sqrt(2000), c = "black", linewidths = 0)
     
     plt.show()
     
@@ -160,6 +177,13 @@ if __name__ == '__main__':
     # mask returns False for valid entries;  True would be easier to work with
     inverted_filtered_households_mask = np.in1d(cells_mask.ravel(), [False]).reshape(cells_mask.shape)
     filtered_household_cells_idx = np.where(inverted_filtered_households_mask)
+    
+    if node_order:
+        
+        logging.info("Ordering grid nodes along a " + node_order + " curve...")
+        
+        ordering = grid_order.get_node_order(filtered_household_cells_idx[0], filtered_household_cells_idx[1], node_order)
+        filtered_household_cells_idx = (filtered_household_cells_idx[0][ordering], filtered_household_cells_idx[1][ordering])
         
     
     logging.info("Constructing population nodes...")
@@ -168,16 +192,15 @@ if __name__ == '__main__':
     # use that to assemble population nodes 
     pop_nodes = "node_label,lat,lon,pop,num_hhs\n"
     
-    # map between node coordinates and node label; to avoid look-up logic
-    coor_idxs_2_node_label = {}
+    # cell keys of the nodes and their labels; to look up the nodes of points of interest
+    node_keys = grid_adjacency.get_cell_keys(filtered_household_cells_idx[0], filtered_household_cells_idx[1], num_cells_y)
+    node_labels = np.arange(len(node_keys))
     
     for i, idx_x in enumerate(filtered_household_cells_idx[0]):
         
         idx_y = filtered_household_cells_idx[1][i]
         
-        node_label = str(i) # unique node label
-        
-        coor_idxs_2_node_label[str(idx_x)+"_"+str(idx_y)] = node_label
+        node_label = str(node_labels[i]) # unique node label
         
         lat = str(Y_mid[idx_y][idx_x])
         lon = str(X_mid[idx_y][idx_x])
@@ -193,26 +216,18 @@ if __name__ == '__main__':
     logging.info("Saved grid population nodes to pop_gridded.csv")
     
 
-    logging.info("Placing hospitals in population nodes...")
+    logging.info("Placing hospitals (and other points of interest) in population nodes...")
     
-    # label each hospital/health facility by the cell/node label it is in
-    hf_cell_labeled = "lat,lon,type,node_label\n"
-    for i, (idx_x, idx_y) in enumerate(hospital_mesh_idx):
-        lat = hospital_records[i, 0]
-        lon = hospital_records[i, 1]
-        type = hospital_records[i, 2]
-        label = "No cell"
-        if str(idx_x)+"_"+str(idx_y) in coor_idxs_2_node_label:
-            label = coor_idxs_2_node_label[str(idx_x)+"_"+str(idx_y)]
-        
-        hf_cell_labeled += str(lat)+","+str(lon)+","+str(type)+","+str(label)+"\n"
-        
+    # label each hospital/health facility (point of interest) by the cell/node label it is in; "No cell" if outside of the grid or the population nodes
+    # nodes are looked up by sorted cell key (already sorted unless ordered by node_order)
+    keys_order = np.argsort(node_keys, kind = 'mergesort')
+    
+    for (layer, poi_csv, keep_cells), records, (idx_x, idx_y, placed) in zip(poi_layers, poi_records, poi_mesh_idx):
         
-    with open("hospitals_node_labeled.csv", "w") as h_f:
-        h_f.write(hf_cell_labeled)
+        poi_node_labels = grid_poi.get_poi_node_labels(idx_x, idx_y, placed, node_keys[keys_order], node_labels[keys_order], num_cells_y)
+        grid_poi.save_poi_layer(layer + "_node_labeled.csv", records, poi_node_labels)
         
-    
-    logging.info("Saved hospital node locations to hospitals_node_labeled.csv")
+        logging.info("Saved " + layer + " node locations to " + layer + "_node_labeled.csv")
     
         
     
@@ -222,43 +237,23 @@ if __name__ == '__main__':
     '''
     Construct the grid graph adjacency list based on local connectivity constraints
     
-    There are more efficient ways to do that, but for graphs of dozens of thousands of nodes this is probably fine
+    Cells are keyed by integers and their neighbors within migration_radius hops are looked up one stencil offset at a time for all cells at once;
+    edge weights (vincenty distances between cell centroids) are computed in batches; see grid_adjacency.py
     '''
-    adj_list = {}
+    adj_src, adj_dst, adj_w = grid_adjacency.build_adjacency(filtered_household_cells_idx[0], filtered_household_cells_idx[1], x_mid, y_mid, migration_radius)
     
-    # get each cell in the grid
-    for i, idx_x in enumerate(filtered_household_cells_idx[0]):
-        idx_y = filtered_household_cells_idx[1][i]
-        node_label = str(i) 
-        
-        adj_list[node_label] = {}
-        
-        # find the potential neighbors of the cell
-        neigh_candidates = []
-        for i in range(idx_x - migration_radius, idx_x + migration_radius + 1):
-            for j in range(idx_y - migration_radius, idx_y + migration_radius + 1): 
-                neigh_candidates.append([i, j])
-                 
-        # check if neighbor cells exist on the grid (e.g. their household density is sufficiently high)
-        for neigh_cand in neigh_candidates: 
-             if str(neigh_cand[0])+"_"+str(neigh_cand[1]) in coor_idxs_2_node_label: 
-                neigh_node_label = coor_idxs_2_node_label[str(neigh_cand[0])+"_"+str(neigh_cand[1])]
-                
-                lat_src = Y_mid[idx_y][idx_x]
-                lon_src = X_mid[idx_y][idx_x]
-                
-                lat_dst = Y_mid[neigh_cand[1]][neigh_cand[0]]
-                lon_dst = X_mid[neigh_cand[1]][neigh_cand[0]]
-        
-                # calculate source destination distance and weight the graph
-                w = vincenty((lat_src, lon_src), (lat_dst, lon_dst)).km
-                
-                adj_list[node_label][neigh_node_label] = w
+    adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(adj_src, adj_dst, adj_w, len(filtered_household_cells_idx[0]), single_direction = adj_graph_single_direction)
+    grid_graph.save_csr("gridded_households_adj_graph.npz", adj_indptr, adj_indices, adj_weights, single_direction = adj_graph_single_direction)
+    
+    logging.info("Grid graph saved to gridded_households_adj_graph.npz")
     
-    with open("gridded_households_adj_list.json", "w") as a_f:
-        json.dump(adj_list, a_f, indent = 3)
+    if export_adj_list_json:
+        adj_list = grid_adjacency.to_adj_list(adj_src, adj_dst, adj_w, len(filtered_household_cells_idx[0]))
         
-    logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list.json")
+        with open("gridded_households_adj_list.json", "w") as a_f:
+            json.dump(adj_list, a_f, indent = 3)
+            
+        logging.info("Grid graph adjacency matrix saved to gridded_households_adj_list.json")
 
 
 
@@ -272,7 +267,8 @@ if __name__ == '__main__':
     
     plt.scatter(points[:,0], points[:,1], s = np.sqrt(points[:,2]), c = "blue", linewidths = 0)
 
-    # plotting hospital locations
-    plt.scatter(hospital_records[:,0], hospital_records[:,1], s = np.sqrt(2000), c = "red", linewidths = 0)
+    # plotting hospital (and other points of interest) locations
+    for records in poi_records:
+        plt.scatter(records.lon.values, records.lat.values, s = np.sqrt(2000), c = "red", linewidths = 0)
     
     plt.show()
@@ -0,0 +1,59 @@
+'''
+- remove duplicate structures (e.g. the same building as an OSM node and as the center of a way, or near duplicate points of overlapping imports)
+  between the download (or extraction) of the structures and the grid topo build, so that duplicates do not inflate the cell counts and populations
+- structures within the merge distance of an earlier structure (in file order) are merged into it: the earlier structure is kept and the later ones dropped;
+  points are bucketed in a spatial hash, so the run time is linear in the number of structures (see grid_dedup.py)
+- the structures csv is replaced by default (run the download or extraction again to restore it); kept structures are more than the merge distance apart,
+  so running this again on its output changes nothing
+- the defaults below can be overridden from the command line, e.g.
+  python dedup_structures.py --distance 5
+  python dedup_structures.py --structures structures_hospitals.csv --distance 20
+
+- input:     - structures csv file with required columns lat,lon # see example input files (structures_households.csv)
+
+- output:    - structures csv file with the same columns, without the merged structures (by default the input file)
+'''
+
+import argparse
+import logging
+
+import numpy as np
+
+import pandas as pd
+
+import grid_dedup
+
+
+# structures closer than the merge distance (in m) are duplicates; small enough not to merge adjacent buildings
+dedup_distance = 2
+
+structures_csv = "structures_households.csv"
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Merge duplicate structures (within a distance of each other) of a structures csv file")
+    parser.add_argument("--structures", default = structures_csv, help = "structures csv file with columns lat,lon")
+    parser.add_argument("--distance", type = float, default = dedup_distance, help = "merge distance (in m)")
+    parser.add_argument("--output", default = None, help = "output csv file; the structures csv file by default")
+    args = parser.parse_args()
+
+
+    logging.basicConfig(format='%(message)s', level='INFO')
+
+    output_csv = args.output or args.structures
+
+    logging.info("Reading data...")
+
+    # coordinates are kept exactly as written in the csv
+    records = pd.read_csv(args.structures, float_precision = "round_trip")
+
+    logging.info("Merging structures within " + ("%g" % args.distance) + " m of " + str(len(records)) + " structures...")
+
+    merged_into = grid_dedup.find_duplicates(records.lon.values, records.lat.values, args.distance)
+    kept = merged_into == np.arange(len(records))
+
+    records[kept].to_csv(output_csv, index = False, encoding = "utf-8")
+
+    logging.info(str(len(records) - int(kept.sum())) + " duplicate structures merged; " + str(int(kept.sum())) + " structures saved to " + output_csv)
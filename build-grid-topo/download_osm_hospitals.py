@@ -1,69 +1,63 @@
 '''
 - Example: extracting hospitals from OSM data within a given (lon, lat) rectangle
-- output both csv and json files; see structures_hospitals.json structures_hospitals.csv for example
-- note that this is a slightly modified version of cache_osm_structures.py for illustration
+- output a csv file; see structures_hospitals.csv for example
+- note that this is a slightly modified version of download_osm_structures.py for illustration: the same single pass download and classification
+  (see grid_tags.py), restricted to the hospital layer
 '''
 
 import logging
 
-import overpass
-import json
 import os
 import matplotlib.pyplot as plt
 
+import grid_overpass
+import grid_tags
+
 log = logging.getLogger(__name__)
 
 
-properties = dict(hospital='["amenity"]["amenity"~"hospital|pharmacy|doctors"]',
-                  school='["amenity"]["amenity"="school"]',
-                  building='["building"]["building"!="no"]',
+# extract hospital buildings with a health facility type; can change to extract hospitals of different types (e.g. outposts, clinics, etc.)
+# this works for the example geography but may need to be modified for other OSM locales
+# (e.g. '["amenity"]["amenity"~"hospital|pharmacy|doctors"]' to also extract pharmacies and doctors; see the health_care layer of download_osm_structures.py)
+properties = dict(hospital='["amenity"="hospital"]["health_facility:type"]',
                   )
 
+# output csv file of each layer; the type column is the health_facility:type tag (see grid_tags.layer_type_tags)
+layer_files = dict(hospital="structures_hospitals.csv",
+                   )
+
 
-def query(bbox, feature, properties, mode='skel'):
+def query(bbox, properties):
     """
     :param bbox: bounding box: SWNE
-    :param properties: query filter for feature
-    :param mode: ids (brief: ids only); skel (concise: ids/children/coordinates); meta (verbose: tags/changes/etc.)
-    :param feature: type type of query feature (node, way, rel)
+    :param properties: dict of layer to its query filter
+    :return: union query of the nodes and ways of all layers; an element meeting several filters is output once
+    body = tags and coordinates of the nodes
+    tags center = tags and center of bounding box of the ways
     qt (quadtile) = order for faster results
-    center = add center of bounding box
     """
-    suffix = '' if feature == 'node' else 'center qt'
-    return '%s%s%s;out %s %s;' % (feature, bbox, properties, mode, suffix)
+    nodes = ''.join('node%s%s;' % (bbox, properties[label]) for label in sorted(properties))
+    ways = ''.join('way%s%s;' % (bbox, properties[label]) for label in sorted(properties))
+    return '(%s);out body qt;(%s);out tags center qt;' % (nodes, ways)
 
 
-def get_lon_lat(element, type):
-    lon, lat = None, None
-    location = element.get('center', None) if type == 'way' else element
-    try:
-        lon, lat = location['lon'], location['lat']
-    except (TypeError, KeyError):
-        log.debug('Unable to get lat/lon from %s', element)
-    return lon, lat
+def plot_locations(label, ax, **kwargs):
 
+    # read from the csv file of the layer (see grid_overpass.save_layers_csv); id, lat and lon are never quoted
+    with open(os.path.join(output_path, layer_files[label])) as s_f:
+        next(s_f)
+        lonlats = [(float(lon), float(lat)) for id, lat, lon in (line.split(',', 3)[:3] for line in s_f)]
 
-def plot_locations(label, ax, **kwargs):
+    log.info('%d %s', len(lonlats), label)
+    ax.scatter(*(list(zip(*lonlats)) or ([], [])), label=label, **kwargs)
+
+
+def get_locations():
+    """
+    :return: the downloaded tiles of the union query of all layers (see grid_overpass.download_tiles); elements are streamed from the tile cache by grid_overpass.iter_elements
+    """
+    return grid_overpass.download_tiles(bbox, lambda tile_bbox: query(tile_bbox, properties), cache_dir, tile_level, overpass_url, num_workers)
 
-    for type in ['node', 'way']:
-        elements = api.Get(query(bbox, type, properties[label]), responseformat='json')['elements']
-        log.info('%s: %d %s', type, len(elements), label)
-        lonlats = zip(*[get_lon_lat(e, type) for e in elements])
-        if not lonlats:
-            lonlats = [], []
-        ax.scatter(*lonlats, label=label, **kwargs)
-        
-
-def get_locations(label):
-    
-    locations = {}
-    
-    for type in ['node', 'way']:    
-        locations[type] = api.Get(query(bbox, type, properties[label]), responseformat='json')['elements']
-    
-    
-    return locations
-             
 
 if __name__ == '__main__':
 
@@ -73,107 +67,54 @@ if __name__ == '__main__':
     '''
     query OSM for buildings data; need to only do once per data set/area
     '''
-    
+
     #lat lon bounding box fo Grand'anse and Sud in Haiti (change as needed)
 
     #Grand'anse and Sud
-    
+
     x_min = -74.584151
     x_max = -73.784895
     y_min = 18.016106
     y_max = 18.699085
-    
+
     bbox = (y_min, x_min, y_max, x_max)
 
+    # compiled tag rules of the layers; each element is classified once against all of them
+    rules = grid_tags.compile_rules(properties)
+
     logging.info("Downloading data...")
-    
-    api = overpass.API()
- 
-    structures = {}
-    #structures["building"] = get_locations('building')
-    #structures["school"] = get_locations('school')
-    structures["hospital"] = get_locations('hospital')
-    
-    
-    # save as json
-    with open(os.path.join(output_path, "structures_hospitals.json"), "w") as s_f:
-        json.dump(structures, s_f, indent = 3)
+
+    # Overpass endpoint (e.g. a mirror, or a local stand-in Overpass server for testing)
+    overpass_url = grid_overpass.overpass_url
+
+    # on-disk cache of the tile responses; cached tiles are not downloaded again, so an interrupted download resumes (delete it to refresh the data)
+    cache_dir = os.path.join(output_path, "overpass_cache")
+
+    # number of quadtile splits of the bounding box (4^tile_level tiles) and max number of concurrent requests
+    tile_level = 3
+    num_workers = 2
+
+    tiles = get_locations()
 
     logging.info("Download complete.")
-    logging.info("Data saved to structures_hospitals.json")
-    
 
-        
-        
     '''
-    can comment the above query code and only work w/ local json once the data is downloaded
-    '''    
-    #with open(os.path.join(output_path, "structures_hospitals.json"), "r") as s_f:
-    #    structures = json.load(s_f)
-    
-    # extract hospital buildings; can change to extract hospitals of different types (e.g. outposts, clinics, etc.)
-    # this works for the example geography but may need to be modified for other OSM locales
-    # not necessarily the most efficient extraction way; just an example
-
-    # extract hospitals from OSM nodes
-    buildings = "id,lat,lon,type\n"
-    for node in structures["hospital"]["node"]:
-        if "lat" in node and "lon" in node:
-            if "tags" in node:
-                if "amenity" in node["tags"]:
-                    if "hospital" == node["tags"]["amenity"]:
-                        type = "hospital"
-                        if "health_facility:type" in node["tags"]:
-                            type = node["tags"]["health_facility:type"]
-                            buildings += str(node["id"]) + ","
-                            buildings += str(node["lat"]) + ","
-                            buildings += str(node["lon"]) + ","
-                            buildings += type + "\n"
-
-            
-    # extract hospitals from OSM ways
-    for way in structures["hospital"]["way"]:
-        if "center" in way:
-            if "tags" in way:
-                if "amenity" in way["tags"]:
-                    if "hospital" == way["tags"]["amenity"]:
-                        type = "hospital"
-                        if "health_facility:type" in way["tags"]:
-                            print node["tags"]["name"]
-                            type = way["tags"]["health_facility:type"]
-                            buildings += str(way["id"]) + ","
-                            buildings += str(way["center"]["lat"]) + ","
-                            buildings += str(way["center"]["lon"]) + ","
-                            buildings += type + "\n"
-                                
-            
-        elif "lat" in way and "lon" in way:
-            if "tags" in way:
-                if "amenity" in way["tags"]:
-                    if "hospital" == way["tags"]["amenity"]:
-                        type = "hospital"
-                        if "health_facility:type" in way["tags"]:
-                            print node["tags"]["name"]
-                            type = way["tags"]["health_facility:type"]
-                            buildings += str(way["id"]) + ","
-                            buildings += str(way["lat"]) + ","
-                            buildings += str(way["lon"]) + ","
-                            buildings += type + "\n"
-                
-    with open(os.path.join(output_path, "structures_hospitals.csv"), "w") as s_f:
-        s_f.write(buildings)
-    
-    logging.info("Data saved to structures_hospitals.csv")
- 
+    the tiles are downloaded only once per data set/area; rerunning reads them from the tile cache (cache_dir)
+    '''
+
+    # rows are streamed from the tile cache and written one at a time
+    num_rows = grid_overpass.save_layers_csv(dict((label, os.path.join(output_path, layer_file)) for label, layer_file in layer_files.items()),
+                                             grid_overpass.iter_elements(bbox, tiles), rules)
+
+    logging.info(str(num_rows["hospital"]) + " hospitals saved to structures_hospitals.csv")
+
 
     logging.info("Plotting hospitals")
     f, ax = plt.subplots(1, 1, figsize=(12, 8), num="Grand'Anse structures")
 
-    #plot_locations('building', ax=ax, color='k', s=0.3, alpha=0.5)
-    #plot_locations('school', ax=ax, color='navy', marker='^', s=100)
     plot_locations('hospital', ax=ax, color='firebrick', marker='+', s=100, lw=4)
 
     ax.set(xlim=(bbox[1], bbox[3]), ylim=(bbox[0], bbox[2]), aspect='equal')
     f.set_tight_layout(True)
-    
+
     plt.show()
@@ -0,0 +1,74 @@
+'''
+- extract buildings (nodes and way centers), hospitals (amenity hospital with a health facility type), other health care (pharmacies, doctors) and schools within a given (lon, lat) rectangle from a local
+  Open Street Map extract (.osm.pbf or .osm.xml file, e.g. a country extract from download.geofabrik.de), instead of querying the Overpass API
+  (see download_osm_structures.py and download_osm_hospitals.py); no network, repeatable for a given extract
+- the blocks of an .osm.pbf file are decoded in parallel in a process pool (see grid_osm.py)
+- all layers are extracted in a single pass over the file, each element being classified once by the Overpass QL tag filters of the layers
+  (grid_tags.layer_filters, the properties of download_osm_structures.py); layers can be added or changed in properties below
+
+- input:     - .osm.pbf (or .osm.xml) file
+
+- output:    - csv file of buildings with columns id,lat,lon (structures_households.csv; as downloaded by download_osm_structures.py)
+             - csv file of hospitals with columns id,lat,lon,type (structures_hospitals.csv; as downloaded by download_osm_hospitals.py);
+               type is the health_facility:type tag
+             - csv file of pharmacies and doctors with columns id,lat,lon,type (structures_health_care.csv); type is the healthcare tag if any, or else the amenity tag
+             - csv file of schools with columns id,lat,lon,type (structures_schools.csv); type is the school tag if any, or else the amenity tag
+'''
+
+import os
+import logging
+
+import grid_osm
+import grid_tags
+
+
+# local Open Street Map extract (change as needed)
+osm_file = "haiti-latest.osm.pbf"
+
+# number of worker processes decoding the .osm.pbf blocks
+num_processes = 4
+
+# Overpass QL tag filter of each layer (change or add as needed; see grid_tags.py)
+properties = grid_tags.layer_filters
+
+# output csv file of each layer; layers with types (see grid_tags.layer_type_tags) get a type column
+layer_files = {
+                "building": "structures_households.csv",
+                "hospital": "structures_hospitals.csv",
+                "health_care": "structures_health_care.csv",
+                "school": "structures_schools.csv"
+            }
+
+output_path = "."
+
+
+#lat lon bounding box fo Grand'anse and Sud in Haiti (change as needed); None to extract the whole file
+
+x_min = -74.584151
+x_max = -73.784895
+y_min = 18.016106
+y_max = 18.699085
+
+bbox = (y_min, x_min, y_max, x_max)
+
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(format='%(message)s', level='INFO')
+
+    logging.info("Extracting structures from " + osm_file + "...")
+
+    rules = grid_tags.compile_rules(dict((layer, properties[layer]) for layer in layer_files))
+
+    layers = grid_osm.read_osm_file(osm_file, rules, bbox, num_processes)
+
+    for layer, layer_file in sorted(layer_files.items()):
+
+        records = layers[layer]
+        if layer not in grid_tags.layer_type_tags:
+            records = records.drop("type", axis = 1)
+
+        records.to_csv(os.path.join(output_path, layer_file), index = False, encoding = "utf-8")
+
+        logging.info(str(len(records)) + " " + layer + " structures saved to " + layer_file)
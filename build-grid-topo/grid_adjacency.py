@@ -0,0 +1,142 @@
+'''
+- array-based construction of the local grid graph adjacency (see build_grid_topo.py and its variants)
+- each kept cell is keyed by an integer derived from its (idx_x, idx_y) histogram coordinates; the neighbors of all cells within migration_radius hops
+  are found offset by offset (a stencil of (dx, dy) offsets) via sorted key look-ups, instead of per cell string keyed dict look-ups
+- edge weights are vincenty distances (in km) between cell centroids; they are read from a per grid (row, dx, dy) distance kernel (see grid_geodesy.py),
+  so geodesic work scales with the number of grid rows times the stencil size rather than with the number of edges
+
+- output:    - arrays of edge sources, destinations and weights, where sources/destinations are positions in the kept cells arrays (i.e. node labels)
+             - optionally, the json adjacency list representation (compatible with dtk-tools spatial workflow) # see example output files (gridded_households_adj_list.json)
+'''
+
+import numpy as np
+
+from grid_geodesy import DistanceKernel
+
+
+def get_stencil(migration_radius):
+    """
+    :param migration_radius: neighborhood radius in hops (1 hop is the adjacent 8 cells on the grid; 2 hops is the adjacent 24 cells, etc.)
+    :return: arrays dx, dy of all (2*migration_radius + 1)^2 neighbor offsets, including the cell itself (0, 0)
+    """
+    offsets = np.arange(-migration_radius, migration_radius + 1)
+    dx, dy = np.meshgrid(offsets, offsets, indexing = 'ij')
+
+    return dx.ravel(), dy.ravel()
+
+
+def get_cell_keys(idx_x, idx_y, num_cells_y):
+    """
+    :param idx_x: array of cell indices along the x axis (histogram first axis)
+    :param idx_y: array of cell indices along the y axis (histogram second axis)
+    :param num_cells_y: number of cells along the y axis
+    :return: array of unique integer cell keys
+    """
+    return np.asarray(idx_x, dtype = np.int64) * num_cells_y + np.asarray(idx_y, dtype = np.int64)
+
+
+def find_neighbors(idx_x, idx_y, num_cells_x, num_cells_y, migration_radius, stencil = None):
+    """
+    :param idx_x: array of kept cells indices along the x axis
+    :param idx_y: array of kept cells indices along the y axis
+    :param num_cells_x: number of grid cells along the x axis
+    :param num_cells_y: number of grid cells along the y axis
+    :param migration_radius: neighborhood radius in hops
+    :param stencil: optional arrays dx, dy of neighbor offsets (e.g. of hexagonal cells; see grid_hex.py); defaults to get_stencil(migration_radius)
+    :return: arrays src, dst, dx, dy of all pairs of kept cells within migration_radius hops (including self-loops)
+             ordered by source cell and then by stencil offset (i.e. the order of the original per-cell neighbor scan);
+             src and dst are positions in idx_x/idx_y, dx/dy the offset from source to destination cell
+    """
+
+    idx_x = np.asarray(idx_x, dtype = np.int64)
+    idx_y = np.asarray(idx_y, dtype = np.int64)
+
+    keys = get_cell_keys(idx_x, idx_y, num_cells_y)
+    order = np.argsort(keys, kind = 'mergesort')
+    sorted_keys = keys[order]
+
+    srcs = []
+    dsts = []
+    offset_idxs = []
+
+    stencil_dx, stencil_dy = get_stencil(migration_radius) if stencil is None else stencil
+
+    for k, (dx, dy) in enumerate(zip(stencil_dx, stencil_dy)):
+
+        neigh_x = idx_x + dx
+        neigh_y = idx_y + dy
+
+        # drop candidates falling off the grid; otherwise their keys would alias cells in adjacent columns
+        on_grid = np.flatnonzero((neigh_x >= 0) & (neigh_x < num_cells_x) & (neigh_y >= 0) & (neigh_y < num_cells_y))
+        if len(on_grid) == 0 or len(sorted_keys) == 0:
+            continue
+
+        neigh_keys = get_cell_keys(neigh_x[on_grid], neigh_y[on_grid], num_cells_y)
+
+        # check if neighbor cells exist on the grid (e.g. their household density is sufficiently high)
+        pos = np.searchsorted(sorted_keys, neigh_keys)
+        pos[pos == len(sorted_keys)] = 0
+        found = sorted_keys[pos] == neigh_keys
+
+        srcs.append(on_grid[found])
+        dsts.append(order[pos[found]])
+        offset_idxs.append(np.repeat(k, found.sum()))
+
+    if not srcs:
+        empty = np.zeros(0, dtype = np.int64)
+        return empty, empty, empty, empty
+
+    src = np.concatenate(srcs)
+    dst = np.concatenate(dsts)
+    offset_idx = np.concatenate(offset_idxs)
+
+    ordering = np.lexsort((offset_idx, src))
+
+    return src[ordering], dst[ordering], stencil_dx[offset_idx[ordering]], stencil_dy[offset_idx[ordering]]
+
+
+def build_adjacency(idx_x, idx_y, x_mid, y_mid, migration_radius, kernel = None):
+    """
+    :param idx_x: array of kept cells indices along the x axis
+    :param idx_y: array of kept cells indices along the y axis
+    :param x_mid: array of cell centroids longitudes along the x axis
+    :param y_mid: array of cell centroids latitudes along the y axis
+    :param migration_radius: neighborhood radius in hops
+    :param kernel: optional DistanceKernel of the grid (e.g. shared across builds on the same grid); built from x_mid, y_mid if not provided
+    :return: arrays src, dst, w of the local grid graph edges; w is the centroid to centroid distance in km
+    """
+
+    src, dst, dx, dy = find_neighbors(idx_x, idx_y, len(x_mid), len(y_mid), migration_radius)
+
+    if kernel is None:
+        kernel = DistanceKernel.from_axes(x_mid, y_mid)
+    kernel.fill(migration_radius)
+
+    idx_y = np.asarray(idx_y, dtype = np.int64)
+
+    w = kernel.lookup(idx_y[src], dx, dy)
+
+    return src, dst, w
+
+
+def to_adj_list(src, dst, w, num_nodes, node_labels = None):
+    """
+    :param src: array of edge source node positions
+    :param dst: array of edge destination node positions
+    :param w: array of edge weights
+    :param num_nodes: number of nodes; every node gets an adjacency entry even if it has no edges
+    :param node_labels: optional list of node labels by position; defaults to str(position)
+    :return: dict of node label to dict of neighbor node label to weight (i.e. the json adjacency list)
+    """
+
+    if node_labels is None:
+        node_labels = [str(i) for i in range(num_nodes)]
+
+    adj_list = {}
+    for node_label in node_labels:
+        adj_list[node_label] = {}
+
+    for s, d, weight in zip(np.asarray(src).tolist(), np.asarray(dst).tolist(), np.asarray(w).tolist()):
+        adj_list[node_labels[s]][node_labels[d]] = weight
+
+    return adj_list
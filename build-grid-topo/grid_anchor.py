@@ -0,0 +1,147 @@
+'''
+- globally anchored grid: the cells are those of a single global grid with a fixed origin (lon, lat) = (-180, -90) and a fixed resolution (in arc-seconds),
+  rather than of a grid fit to the extent of the binned structures; grids of any two runs with the same resolution are aligned,
+  whatever their input structures or bounding boxes
+- each cell has a deterministic integer cell id derived from its global indices: (global idx_x << 32) | global idx_y
+- later stages key per cell caches on the cell ids (column cell_id of pop_gridded.csv) and skip cells already processed in previous runs
+  (e.g. grid_elevations_google_api.py, ../cluster-grid-topo/cluster_grid_cells.py, ../sims-grid-topo/input/grid_topo_larval_habitats.py)
+
+- cell cache file format (json): {"meta": {...}, "cells": {"<cell_id>": {"lat": ..., "lon": ..., "value": ...}}}
+  cached cell centroids are checked on look up, so that a cache filled at another resolution is not reused by mistake
+'''
+
+import os
+import json
+import math
+
+import numpy as np
+
+
+# origin (lon, lat) of the global grid
+grid_origin = (-180.0, -90.0)
+
+# cell ids pack the global y index in the lower bits
+cell_id_y_bits = 32
+
+# tolerance (in degrees) when matching cached cell centroids
+centroid_tolerance = 1e-7
+
+
+def get_resolution_arcsec(cell_size, lat, precision = 0.01):
+    """
+    :param cell_size: approximate cell side (in m)
+    :param lat: latitude at which cells should be approximately square (e.g. that of the area of interest)
+    :param precision: the resolution is rounded to this many arc-seconds, so that it is easy to keep fixed across runs
+    :return: resolution (x, y) in arc-seconds along longitude and latitude
+    """
+
+    # ~30.87m per arc-second of latitude (mean earth radius)
+    m_per_arcsec = 6371008.8 * math.pi / (180 * 3600.0)
+
+    res_y = cell_size / m_per_arcsec
+    res_x = res_y / math.cos(math.radians(lat))
+
+    return round(res_x / precision) * precision, round(res_y / precision) * precision
+
+
+def get_anchored_edges(bbox, resolution_arcsec):
+    """
+    :param bbox: bounding box (x_min, x_max, y_min, y_max)
+    :param resolution_arcsec: resolution (x, y) in arc-seconds
+    :return: arrays xedges, yedges of the cells of the global grid covering the bounding box
+    """
+
+    x_min, x_max, y_min, y_max = bbox
+
+    edges = []
+    for (smin, smax), origin, res in (((x_min, x_max), grid_origin[0], resolution_arcsec[0]), ((y_min, y_max), grid_origin[1], resolution_arcsec[1])):
+
+        step = res / 3600.0
+
+        first = int(np.floor((smin - origin) / step))
+        last = int(np.floor((smax - origin) / step))
+
+        # edges are always computed from global indices, so that the same cell has the same edges in every run
+        edges.append(origin + np.arange(first, last + 2) * step)
+
+    return edges[0], edges[1]
+
+
+def get_global_origin_indices(xedges, yedges, resolution_arcsec):
+    """
+    :return: global indices of the first cell of anchored edges (e.g. returned by get_anchored_edges) along x and y
+    """
+
+    return int(round((xedges[0] - grid_origin[0]) * 3600.0 / resolution_arcsec[0])), int(round((yedges[0] - grid_origin[1]) * 3600.0 / resolution_arcsec[1]))
+
+
+def get_cell_ids(idx_x, idx_y, xedges, yedges, resolution_arcsec):
+    """
+    :param idx_x: array of cell indices along the x axis (local to the anchored edges)
+    :param idx_y: array of cell indices along the y axis (local to the anchored edges)
+    :return: array of int64 global cell ids
+    """
+
+    global_x0, global_y0 = get_global_origin_indices(xedges, yedges, resolution_arcsec)
+
+    global_x = np.asarray(idx_x, dtype = np.int64) + global_x0
+    global_y = np.asarray(idx_y, dtype = np.int64) + global_y0
+
+    return (global_x << cell_id_y_bits) | global_y
+
+
+def get_global_indices(cell_ids):
+    """
+    :return: arrays of global x and y indices of the given cell ids
+    """
+
+    cell_ids = np.asarray(cell_ids, dtype = np.int64)
+
+    return cell_ids >> cell_id_y_bits, cell_ids & ((1 << cell_id_y_bits) - 1)
+
+
+def load_cell_cache(cache_path, meta = None):
+    """
+    :param cache_path: cell cache json file
+    :param meta: dict of parameters the cached values depend on; the cache is discarded if they differ from the cached ones
+    :return: dict of cell id (int) to cache entry
+    """
+
+    if not os.path.exists(cache_path):
+        return {}
+
+    with open(cache_path, "r") as c_f:
+        cache = json.load(c_f)
+
+    if cache.get("meta", {}) != (meta or {}):
+        return {}
+
+    return dict((int(cell_id), entry) for cell_id, entry in cache["cells"].items())
+
+
+def get_cached_value(cells, cell_id, lat, lon):
+    """
+    :return: the cached value of a cell; None if the cell is not cached or its cached centroid differs
+    """
+
+    entry = cells.get(int(cell_id))
+
+    if entry is None or abs(entry["lat"] - lat) > centroid_tolerance or abs(entry["lon"] - lon) > centroid_tolerance:
+        return None
+
+    return entry["value"]
+
+
+def set_cached_value(cells, cell_id, lat, lon, value):
+    cells[int(cell_id)] = {"lat": float(lat), "lon": float(lon), "value": value}
+
+
+def save_cell_cache(cache_path, cells, meta = None):
+    """
+    :param cache_path: cell cache json file
+    :param cells: dict of cell id to cache entry (see set_cached_value)
+    :param meta: dict of parameters the cached values depend on
+    """
+
+    with open(cache_path, "w") as c_f:
+        json.dump({"meta": meta or {}, "cells": dict((str(cell_id), entry) for cell_id, entry in cells.items())}, c_f)
@@ -0,0 +1,257 @@
+'''
+- binning of structures (e.g. households) into grid cells, shared by the build_grid_topo scripts
+- streaming (out-of-core) mode: the structures csv is read in chunks of rows, each chunk is filtered by the bounding box and its (weighted) counts
+  are accumulated into a histogram with fixed edges; peak memory is bounded by the chunk size rather than the size of the csv
+- the fixed edges are computed the same way np.histogram2d computes them from the filtered points (two passes over the csv: extent, then counts),
+  so the result is the same as binning all points at once
+- sparse mode: only occupied cells are produced, as sorted integer cell keys (idx_x * num_cells_y + idx_y) and their (weighted) counts;
+  cell indices are obtained by floor division (corrected against the histogram edges, so that cells match np.histogram2d) and reduced with unique/bincount;
+  no dense num_cells_x x num_cells_y histogram or meshgrids are allocated, so memory scales with the number of structures rather than the bounding box area
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def get_bbox_mask(lons, lats, bbox):
+    """
+    :param lons: array of longitudes
+    :param lats: array of latitudes
+    :param bbox: bounding box (x_min, x_max, y_min, y_max); bounds are exclusive as in the build scripts
+    :return: boolean array; True for points strictly within the bounding box
+    """
+    x_min, x_max, y_min, y_max = bbox
+
+    return (lons > x_min) & (lons < x_max) & (lats > y_min) & (lats < y_max)
+
+
+def read_points_chunks(csv_path, bbox, columns = ("lon", "lat"), chunk_size = 1000000):
+    """
+    :param csv_path: structures csv file with required columns lat,lon
+    :param bbox: bounding box (x_min, x_max, y_min, y_max)
+    :param columns: columns to read; the first two must be lon, lat
+    :param chunk_size: number of csv rows per chunk
+    :return: generator of 2d arrays with the requested columns of structures within the bounding box, one per chunk
+    """
+
+    columns = list(columns)
+
+    for chunk in pd.read_csv(csv_path, usecols = columns, chunksize = chunk_size):
+        points = chunk[columns].values.astype(np.float64)
+        in_bbox = get_bbox_mask(points[:, 0], points[:, 1], bbox)
+
+        yield points[in_bbox]
+
+
+def get_histogram_edges(x_range, y_range, num_cells_x, num_cells_y):
+    """
+    :param x_range: (min, max) of the binned points longitudes
+    :param y_range: (min, max) of the binned points latitudes
+    :return: arrays xedges, yedges; equal to the edges np.histogram2d derives from points with the given extent
+    """
+
+    edges = []
+    for (smin, smax), num_cells in ((x_range, num_cells_x), (y_range, num_cells_y)):
+
+        smin = float(smin)
+        smax = float(smax)
+
+        # same handling of a degenerate extent as numpy
+        if smin == smax:
+            smin = smin - 0.5
+            smax = smax + 0.5
+
+        edges.append(np.linspace(smin, smax, num_cells + 1))
+
+    return edges[0], edges[1]
+
+
+def get_points_extent_chunked(csv_path, bbox, chunk_size = 1000000):
+    """
+    :return: (x_min, x_max), (y_min, y_max) of the structures within the bounding box; None if there are no such structures
+    """
+
+    x_range = None
+    y_range = None
+
+    for points in read_points_chunks(csv_path, bbox, chunk_size = chunk_size):
+        if len(points) == 0:
+            continue
+
+        chunk_min = points.min(axis = 0)
+        chunk_max = points.max(axis = 0)
+
+        if x_range is None:
+            x_range = (chunk_min[0], chunk_max[0])
+            y_range = (chunk_min[1], chunk_max[1])
+        else:
+            x_range = (min(x_range[0], chunk_min[0]), max(x_range[1], chunk_max[0]))
+            y_range = (min(y_range[0], chunk_min[1]), max(y_range[1], chunk_max[1]))
+
+    if x_range is None:
+        return None
+
+    return x_range, y_range
+
+
+def get_chunked_edges(csv_path, bbox, num_cells_x, num_cells_y, chunk_size = 1000000, edges = None):
+    """
+    :return: xedges, yedges; the given fixed edges, or else the edges np.histogram2d would derive from the structures within the bounding box
+    """
+
+    if edges is not None:
+        return edges
+
+    extent = get_points_extent_chunked(csv_path, bbox, chunk_size)
+    if extent is None:
+        raise ValueError("No structures within the bounding box in " + csv_path)
+
+    return get_histogram_edges(extent[0], extent[1], num_cells_x, num_cells_y)
+
+
+def histogram2d_chunked(csv_path, bbox, num_cells_x, num_cells_y, chunk_size = 1000000, weight_column = None, default_weight = None, edges = None):
+    """
+    streaming equivalent of np.histogram2d(lons, lats, bins = [num_cells_x, num_cells_y], weights = ...) over the structures within the bounding box
+
+    :param csv_path: structures csv file with required columns lat,lon
+    :param bbox: bounding box (x_min, x_max, y_min, y_max)
+    :param num_cells_x: number of grid cells along the x axis
+    :param num_cells_y: number of grid cells along the y axis
+    :param chunk_size: number of csv rows per chunk
+    :param weight_column: optional column with per structure weights (e.g. pop)
+    :param default_weight: optional constant weight per structure if weight_column is not given (e.g. avg_structure_size)
+    :param edges: optional fixed (xedges, yedges) (e.g. of an anchored grid; see grid_anchor.py); the extent pass over the csv is skipped if given
+    :return: H, xedges, yedges as returned by np.histogram2d
+    """
+
+    xedges, yedges = get_chunked_edges(csv_path, bbox, num_cells_x, num_cells_y, chunk_size, edges)
+
+    H = np.zeros((len(xedges) - 1, len(yedges) - 1))
+
+    columns = ["lon", "lat"] if weight_column is None else ["lon", "lat", weight_column]
+
+    for points in read_points_chunks(csv_path, bbox, columns, chunk_size):
+        if len(points) == 0:
+            continue
+
+        weights = get_chunk_weights(points, weight_column, default_weight)
+
+        H += np.histogram2d(points[:, 0], points[:, 1], bins = [xedges, yedges], weights = weights)[0]
+
+    return H, xedges, yedges
+
+
+def get_cell_indices(values, edges):
+    """
+    :param values: array of point coordinates along one axis
+    :param edges: array of (uniformly spaced) cell edges along the axis, e.g. as returned by get_histogram_edges
+    :return: array of cell indices; bins are half open except for the last one, as in np.histogram2d; -1 for values outside the edges
+    """
+
+    num_cells = len(edges) - 1
+    step = (edges[-1] - edges[0]) / float(num_cells)
+
+    idxs = np.floor((values - edges[0]) / step).astype(np.int64)
+    np.clip(idxs, 0, num_cells - 1, out = idxs)
+
+    # floor division may be off by one cell next to edges due to rounding; correct against the edges themselves
+    idxs -= values < edges[idxs]
+    np.clip(idxs, 0, num_cells - 1, out = idxs)
+    idxs += (values >= edges[idxs + 1]) & (idxs < num_cells - 1)
+
+    idxs[(values < edges[0]) | (values > edges[-1])] = -1
+
+    return idxs
+
+
+def sparse_histogram2d(lons, lats, xedges, yedges, weights = None):
+    """
+    sparse equivalent of np.histogram2d(lons, lats, bins = [xedges, yedges], weights = weights)
+
+    :return: arrays of sorted occupied cell keys (idx_x * num_cells_y + idx_y) and of their (weighted) counts
+    """
+
+    num_cells_y = len(yedges) - 1
+
+    idx_x = get_cell_indices(lons, xedges)
+    idx_y = get_cell_indices(lats, yedges)
+
+    in_grid = (idx_x >= 0) & (idx_y >= 0)
+    keys = idx_x[in_grid] * num_cells_y + idx_y[in_grid]
+
+    cell_keys, inverse = np.unique(keys, return_inverse = True)
+    cell_counts = np.bincount(inverse, weights = None if weights is None else np.asarray(weights, dtype = np.float64)[in_grid], minlength = len(cell_keys)).astype(np.float64)
+
+    return cell_keys, cell_counts
+
+
+def merge_sparse_histograms(cell_keys_list, cell_counts_list):
+    """
+    :return: arrays of sorted cell keys and counts summed over a collection of sparse histograms on the same grid
+    """
+
+    if not cell_keys_list:
+        return np.zeros(0, dtype = np.int64), np.zeros(0)
+
+    cell_keys, inverse = np.unique(np.concatenate(cell_keys_list), return_inverse = True)
+    cell_counts = np.bincount(inverse, weights = np.concatenate(cell_counts_list), minlength = len(cell_keys))
+
+    return cell_keys, cell_counts
+
+
+def sparse_histogram2d_chunked(csv_path, bbox, num_cells_x, num_cells_y, chunk_size = 1000000, weight_column = None, default_weight = None, edges = None):
+    """
+    streaming sparse histogram; see histogram2d_chunked for parameters
+
+    :return: arrays of sorted occupied cell keys and counts, xedges, yedges
+    """
+
+    xedges, yedges = get_chunked_edges(csv_path, bbox, num_cells_x, num_cells_y, chunk_size, edges)
+
+    columns = ["lon", "lat"] if weight_column is None else ["lon", "lat", weight_column]
+
+    cell_keys = np.zeros(0, dtype = np.int64)
+    cell_counts = np.zeros(0)
+
+    for points in read_points_chunks(csv_path, bbox, columns, chunk_size):
+        if len(points) == 0:
+            continue
+
+        weights = get_chunk_weights(points, weight_column, default_weight)
+
+        # merge as we go so that memory is bounded by the chunk size and the number of occupied cells
+        chunk_keys, chunk_counts = sparse_histogram2d(points[:, 0], points[:, 1], xedges, yedges, weights)
+        cell_keys, cell_counts = merge_sparse_histograms([cell_keys, chunk_keys], [cell_counts, chunk_counts])
+
+    return cell_keys, cell_counts, xedges, yedges
+
+
+def get_chunk_weights(points, weight_column = None, default_weight = None):
+    """
+    :return: array of per structure weights of a chunk read by read_points_chunks (or None for unweighted counts)
+    """
+
+    if weight_column is not None:
+        return points[:, 2]
+    elif default_weight is not None:
+        return np.ones(len(points)) * default_weight
+
+    return None
+
+
+def get_cell_centroids(idx_x, idx_y, xedges, yedges):
+    """
+    :return: arrays of longitudes, latitudes of the centroids of the given cells
+    """
+
+    idx_x = np.asarray(idx_x, dtype = np.int64)
+    idx_y = np.asarray(idx_y, dtype = np.int64)
+
+    return (xedges[idx_x + 1] + xedges[idx_x]) / 2, (yedges[idx_y + 1] + yedges[idx_y]) / 2
+
+
+def get_csv_columns(csv_path):
+    """
+    :return: list of the columns in the header of a csv file
+    """
+    return list(pd.read_csv(csv_path, nrows = 0).columns)
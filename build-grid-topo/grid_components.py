@@ -0,0 +1,170 @@
+'''
+- connected component pruning of the filtered (kept) grid cells at build time (see prune_components in build_grid_topo.py and build_grid_topo_structs.py),
+  before any graph is built, so that isolated pockets of cells do not end up as barely interacting nodes (or need augmenting edges later on, e.g. in generate_hfcas.py)
+- two kept cells are connected if they are within migration_radius hops of each other (i.e. neighbors in the grid graph; see grid_adjacency.get_stencil)
+- components are labeled in one image labeling pass (scipy.ndimage.label) over the mask of the kept cells: each cell is dilated into a
+  migration_radius x migration_radius box anchored at the cell, so that the boxes of two cells touch (8-connectivity) exactly if the cells are
+  within migration_radius hops of each other
+- components with fewer cells or lower (weighted) count than the given limits are pruned:
+---- drop: their cells are removed
+---- merge: their cells are removed and their counts are added to the nearest cell of a kept component
+---- bridge: their cells are kept and connected to the nearest cell of a kept component with an additional edge (both directions; vincenty distance weight)
+'''
+
+import numpy as np
+
+import pandas as pd
+
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+from grid_geodesy import vincenty_km
+
+
+# columns of the pruned components report, in order
+report_columns = ["component", "num_cells", "count", "lat", "lon", "action", "nearest_lat", "nearest_lon", "distance_km"]
+
+
+def label_components(idx_x, idx_y, migration_radius):
+    """
+    :param idx_x: array of kept cells indices along the x axis
+    :param idx_y: array of kept cells indices along the y axis
+    :param migration_radius: neighborhood radius in hops
+    :return: array of the component label (0 to number of components - 1) of each cell, and the number of components
+    """
+
+    idx_x = np.asarray(idx_x, dtype = np.int64)
+    idx_y = np.asarray(idx_y, dtype = np.int64)
+
+    if len(idx_x) == 0:
+        return np.zeros(0, dtype = np.int64), 0
+
+    # no neighbors within 0 hops: every cell is its own component
+    if migration_radius < 1:
+        return np.arange(len(idx_x), dtype = np.int64), len(idx_x)
+
+    # mask of the kept cells over their extent
+    local_x = idx_x - idx_x.min()
+    local_y = idx_y - idx_y.min()
+
+    mask = np.zeros((local_x.max() + migration_radius, local_y.max() + migration_radius), dtype = bool)
+    mask[local_x, local_y] = True
+
+    # dilate each cell into a box of migration_radius x migration_radius cells anchored at the cell (separably along x and y)
+    dilated = mask.copy()
+    for d in range(1, migration_radius):
+        dilated[d:, :] |= mask[:-d, :]
+
+    mask = dilated.copy()
+    for d in range(1, migration_radius):
+        dilated[:, d:] |= mask[:, :-d]
+
+    labels, num_components = ndimage.label(dilated, structure = np.ones((3, 3), dtype = bool))
+
+    # relabel in order of the first cell of each component
+    cell_labels = labels[local_x, local_y]
+    unique_labels, first, component_labels = np.unique(cell_labels, return_index = True, return_inverse = True)
+    ordering = np.argsort(first)
+
+    relabel = np.zeros(len(unique_labels), dtype = np.int64)
+    relabel[ordering] = np.arange(len(unique_labels))
+
+    return relabel[component_labels.ravel()], len(unique_labels)
+
+
+def find_nearest_cells(idx_x, idx_y, component_labels, pruned):
+    """
+    :param idx_x: array of cells indices along the x axis
+    :param idx_y: array of cells indices along the y axis
+    :param component_labels: array of the component label of each cell (see label_components)
+    :param pruned: boolean array of whether each component is pruned
+    :return: arrays of the position of the cell of each pruned component nearest to a kept component, and of the nearest kept cell (positions in idx_x/idx_y),
+             ordered by pruned component label
+    """
+
+    cell_pruned = pruned[component_labels]
+    kept_cells = np.flatnonzero(np.logical_not(cell_pruned))
+    pruned_cells = np.flatnonzero(cell_pruned)
+
+    # nearest kept cell of each pruned cell, in grid cell units (cells are ~square)
+    tree = cKDTree(np.column_stack((idx_x[kept_cells], idx_y[kept_cells])).astype(np.float64))
+    distances, nearest = tree.query(np.column_stack((idx_x[pruned_cells], idx_y[pruned_cells])).astype(np.float64))
+
+    # pruned cell nearest to a kept cell within each pruned component
+    ordering = np.lexsort((distances, component_labels[pruned_cells]))
+    first = np.unique(component_labels[pruned_cells][ordering], return_index = True)[1]
+
+    return pruned_cells[ordering][first], kept_cells[nearest[ordering][first]]
+
+
+def prune_components(idx_x, idx_y, counts, x_mid, y_mid, migration_radius, min_cells, min_count, action):
+    """
+    :param idx_x: array of kept cells indices along the x axis
+    :param idx_y: array of kept cells indices along the y axis
+    :param counts: array of (weighted) counts of the kept cells (e.g. number of households)
+    :param x_mid: array of cell centroids longitudes along the x axis
+    :param y_mid: array of cell centroids latitudes along the y axis
+    :param migration_radius: neighborhood radius in hops
+    :param min_cells: components with fewer cells are pruned
+    :param min_count: components with lower total count are pruned
+    :param action: "drop", "merge" or "bridge" (see above)
+    :return: boolean array of the cells that remain, array of their counts, arrays src, dst, w of the bridge edges (positions in the remaining cells;
+             empty unless bridging) and pandas DataFrame report of the pruned components (see report_columns)
+    """
+
+    if action not in ("drop", "merge", "bridge"):
+        raise ValueError("Unknown component pruning action " + str(action) + "; use drop, merge or bridge")
+
+    idx_x = np.asarray(idx_x, dtype = np.int64)
+    idx_y = np.asarray(idx_y, dtype = np.int64)
+    counts = np.asarray(counts, dtype = np.float64)
+
+    component_labels, num_components = label_components(idx_x, idx_y, migration_radius)
+
+    component_cells = np.bincount(component_labels, minlength = num_components)
+    component_counts = np.bincount(component_labels, weights = counts, minlength = num_components)
+
+    pruned = (component_cells < min_cells) | (component_counts < min_count)
+
+    no_edges = (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0))
+
+    # nothing to prune, or nothing to attach pruned components to
+    if not pruned.any() or pruned.all():
+        return np.ones(len(idx_x), dtype = bool), counts, no_edges[0], no_edges[1], no_edges[2], pd.DataFrame([], columns = report_columns)
+
+    pruned_components = np.flatnonzero(pruned)
+    pruned_cells, nearest_cells = find_nearest_cells(idx_x, idx_y, component_labels, pruned)
+
+    distances = vincenty_km(y_mid[idx_y[pruned_cells]], x_mid[idx_x[pruned_cells]], y_mid[idx_y[nearest_cells]], x_mid[idx_x[nearest_cells]])
+
+    # component centroids (count weighted, or plain if the count is 0)
+    cell_weights = np.where(component_counts[component_labels] > 0, counts, 1.0)
+    component_weights = np.bincount(component_labels, weights = cell_weights, minlength = num_components)
+    component_lats = np.bincount(component_labels, weights = cell_weights * y_mid[idx_y], minlength = num_components) / component_weights
+    component_lons = np.bincount(component_labels, weights = cell_weights * x_mid[idx_x], minlength = num_components) / component_weights
+
+    report = pd.DataFrame({
+                            "component": pruned_components,
+                            "num_cells": component_cells[pruned_components],
+                            "count": component_counts[pruned_components],
+                            "lat": component_lats[pruned_components],
+                            "lon": component_lons[pruned_components],
+                            "action": action,
+                            "nearest_lat": y_mid[idx_y[nearest_cells]],
+                            "nearest_lon": x_mid[idx_x[nearest_cells]],
+                            "distance_km": distances
+                        }, columns = report_columns)
+
+    if action == "bridge":
+        src = np.concatenate((pruned_cells, nearest_cells))
+        dst = np.concatenate((nearest_cells, pruned_cells))
+
+        return np.ones(len(idx_x), dtype = bool), counts, src, dst, np.concatenate((distances, distances)), report
+
+    kept = np.logical_not(pruned[component_labels])
+    counts = counts.copy()
+
+    if action == "merge":
+        np.add.at(counts, nearest_cells, component_counts[pruned_components])
+
+    return kept, counts[kept], no_edges[0], no_edges[1], no_edges[2], report
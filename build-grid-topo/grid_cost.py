@@ -0,0 +1,243 @@
+'''
+- simulation cost prediction of a grid topo (see ../sims-grid-topo/input/predict_sim_cost.py) and search of the grid configuration for a target number of nodes
+  or a memory budget (see tune_grid_topo.py), before submitting (long queued) multi-core DTK runs
+- the cost of each core is modeled as linear in the nodes, population (simulated individuals), migration links (directed edges to other nodes) and
+  cut migration links (links to nodes on other cores) of the core:
+---- memory_mb = base + per node + per individual + per migration link (e.g. vector populations and habitats per node, individuals, migration tables)
+---- timestep_s = base + per node + per individual + per migration link + per cut link (communication of migrating individuals between cores)
+- the run memory is the sum over cores and the per timestep runtime is the one of the slowest core
+- the coefficients are fitted (non negative least squares) to a calibration table of past runs (sim_cost_calibration.csv), one row per run with its
+  grid and number of cores and the measured memory per core and runtime per timestep; the cores of a calibration run are assumed balanced
+- the table ships without runs; until measured runs are appended there is no cost model (see load_cost_model) and only the grid stats are reported
+'''
+
+import os
+
+import numpy as np
+
+import pandas as pd
+
+from scipy.optimize import nnls
+
+import grid_sweep
+
+
+# default calibration table, next to this module
+calibration_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sim_cost_calibration.csv")
+
+# per core cost terms, in order; the coefficients of the fitted model follow this order
+cost_terms = ["base", "nodes", "pop", "links", "cut_links"]
+
+# cost terms that do not apply to memory
+memory_excluded_terms = ["cut_links"]
+
+# columns of the per core cost prediction, in order
+core_cost_columns = ["core", "num_nodes", "pop", "links", "cut_links", "memory_mb", "timestep_s"]
+
+
+def get_grid_stats(pops, indptr, indices):
+    """
+    :param pops: array of node populations
+    :param indptr: CSR row pointers of the grid graph (see grid_graph.load_csr); both edge directions
+    :param indices: CSR column indices of the grid graph
+    :return: dict of the number of nodes, population, max node population, number of migration links (directed edges, no self-loops)
+             and mean and max migration fan-out (links per node)
+    """
+
+    src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    fan_out = np.bincount(src[src != np.asarray(indices)], minlength = len(pops))
+
+    return {
+                "num_nodes": len(pops),
+                "pop": float(np.sum(pops)),
+                "max_node_pop": float(np.max(pops)) if len(pops) else 0.0,
+                "num_links": int(fan_out.sum()),
+                "mean_fan_out": float(fan_out.mean()) if len(pops) else 0.0,
+                "max_fan_out": int(fan_out.max()) if len(pops) else 0
+            }
+
+
+def get_core_features(num_nodes, pop, links, cut_links):
+    """
+    :return: 2d array of the cost terms (see cost_terms) of each core (or of each balanced core of each calibration run)
+    """
+
+    num_nodes, pop, links, cut_links = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype = np.float64)) for v in (num_nodes, pop, links, cut_links)])
+
+    return np.column_stack((np.ones(len(num_nodes)), num_nodes, pop, links, cut_links))
+
+
+def fit_cost_model(calibration):
+    """
+    :param calibration: pandas DataFrame of past runs with columns num_cores,num_nodes,pop,num_links,cut_links,memory_mb_per_core,timestep_s
+    :return: dict of the non negative coefficients (in the order of cost_terms) of the memory (memory_mb) and runtime (timestep_s) models
+    """
+
+    num_cores = calibration.num_cores.values.astype(np.float64)
+
+    # each core of a calibration run gets an equal share of the run
+    features = get_core_features(calibration.num_nodes.values / num_cores, calibration["pop"].values / num_cores, calibration.num_links.values / num_cores, calibration.cut_links.values / num_cores)
+
+    memory_terms = [i for i, term in enumerate(cost_terms) if term not in memory_excluded_terms]
+
+    memory_coefs = np.zeros(len(cost_terms))
+    memory_coefs[memory_terms] = nnls(features[:, memory_terms], calibration.memory_mb_per_core.values.astype(np.float64))[0]
+
+    timestep_coefs = nnls(features, calibration.timestep_s.values.astype(np.float64))[0]
+
+    return {"memory_mb": memory_coefs, "timestep_s": timestep_coefs}
+
+
+def load_cost_model(csv_path = calibration_csv):
+    """
+    :return: cost model fitted to a calibration table csv (see fit_cost_model), or None if the table has no runs (e.g. the bundled table); lines starting with # are comments
+    """
+
+    calibration = pd.read_csv(csv_path, comment = '#')
+
+    if len(calibration) == 0:
+        return None
+
+    # the coefficients of fewer runs than cost terms are not determined
+    if len(calibration) < len(cost_terms):
+        raise ValueError("The calibration table " + csv_path + " has " + str(len(calibration)) + " runs; at least " + str(len(cost_terms)) +
+                         " measured runs (e.g. of different grid configurations and numbers of cores) are needed to fit the cost model")
+
+    return fit_cost_model(calibration)
+
+
+def predict_core_costs(model, parts, pops, indptr, indices, num_cores):
+    """
+    :param model: cost model (see fit_cost_model)
+    :param parts: array of the core of each node (e.g. grid_partition.recursive_bisection or a load balance file)
+    :param pops: array of node populations
+    :param indptr: CSR row pointers of the grid graph; both edge directions
+    :param indices: CSR column indices of the grid graph
+    :param num_cores: number of cores
+    :return: pandas DataFrame of the predicted cost of each core (see core_cost_columns)
+    """
+
+    parts = np.asarray(parts, dtype = np.int64)
+    indices = np.asarray(indices, dtype = np.int64)
+
+    src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    link = src != indices
+    cut = link & (parts[src] != parts[indices])
+
+    core_nodes = np.bincount(parts, minlength = num_cores)
+    core_pops = np.bincount(parts, weights = np.asarray(pops, dtype = np.float64), minlength = num_cores)
+    core_links = np.bincount(parts[src[link]], minlength = num_cores)
+    core_cut_links = np.bincount(parts[src[cut]], minlength = num_cores)
+
+    features = get_core_features(core_nodes, core_pops, core_links, core_cut_links)
+
+    return pd.DataFrame({
+                            "core": np.arange(num_cores),
+                            "num_nodes": core_nodes,
+                            "pop": core_pops,
+                            "links": core_links,
+                            "cut_links": core_cut_links,
+                            "memory_mb": features.dot(model["memory_mb"]),
+                            "timestep_s": features.dot(model["timestep_s"])
+                        }, columns = core_cost_columns)
+
+
+def predict_balanced_cost(model, num_nodes, pop, num_links, num_cores, cut_links = 0):
+    """
+    :param num_nodes: array (or scalar) of numbers of nodes
+    :param pop: array (or scalar) of populations
+    :param num_links: array (or scalar) of numbers of migration links (directed edges, no self-loops)
+    :param cut_links: array (or scalar) of numbers of cut migration links; unknown without a partition (e.g. in grid configuration sweeps), 0 by default
+    :return: arrays of the predicted memory per core (MB), total memory (MB) and runtime per timestep (s), assuming perfectly balanced cores
+    """
+
+    features = get_core_features(np.asarray(num_nodes, dtype = np.float64) / num_cores, np.asarray(pop, dtype = np.float64) / num_cores,
+                                 np.asarray(num_links, dtype = np.float64) / num_cores, np.asarray(cut_links, dtype = np.float64) / num_cores)
+
+    memory_mb_per_core = features.dot(model["memory_mb"])
+
+    return memory_mb_per_core, memory_mb_per_core * num_cores, features.dot(model["timestep_s"])
+
+
+def add_cost_predictions(report, model, num_cores):
+    """
+    :param report: sweep report (see grid_sweep.report_columns); num_edges are undirected
+    :param model: cost model (see fit_cost_model), or None to leave the cost columns empty
+    :return: the report with additional columns memory_mb_per_core, memory_mb and timestep_s (balanced cores, no cut links)
+    """
+
+    if model is None:
+        memory_mb_per_core = memory_mb = timestep_s = np.nan
+    else:
+        memory_mb_per_core, memory_mb, timestep_s = predict_balanced_cost(model, report.num_nodes.values, report["pop"].values, 2 * report.num_edges.values, num_cores)
+
+    report = report.copy()
+    report["memory_mb_per_core"] = memory_mb_per_core
+    report["memory_mb"] = memory_mb
+    report["timestep_s"] = timestep_s
+
+    return report
+
+
+def select_config(report, target_nodes = None, memory_budget_mb = None):
+    """
+    :param report: sweep report with cost predictions (see add_cost_predictions)
+    :param target_nodes: optional target number of nodes
+    :param memory_budget_mb: optional max memory per core (MB)
+    :return: index (in report) of the selected configuration; among the configurations within the memory budget (all if no budget),
+             the one closest to the target number of nodes, or else the finest one (smallest cell size, then largest population kept); None if none is within budget
+    """
+
+    candidates = report if memory_budget_mb is None else report[report.memory_mb_per_core <= memory_budget_mb]
+
+    if len(candidates) == 0:
+        return None
+
+    if target_nodes is not None:
+        return candidates.assign(miss = np.abs(candidates.num_nodes - target_nodes)).sort_values(["miss", "pop"], ascending = [True, False]).index[0]
+
+    return candidates.sort_values(["cell_size", "pop"], ascending = [True, False]).index[0]
+
+
+def tune_grid(points, bbox, cell_sizes, thresholds, migration_radius, model, num_cores, target_nodes = None, memory_budget_mb = None,
+              num_processes = 1, pop_per_count = 1, num_refinements = 4):
+    """
+    :param points: (lons, lats, weights) of the structures within the bounding box (see grid_sweep.load_points)
+    :param cell_sizes: list of candidate cell sizes (in m)
+    :param thresholds: list of candidate cell thresholds
+    :param migration_radius: neighborhood radius in hops
+    :param model: cost model (see fit_cost_model); None for the grid stats only (no memory budget)
+    :param num_refinements: number of cell size bisections per threshold between the candidate cell sizes around the target (number of nodes or memory budget)
+    :return: sweep report of all evaluated configurations with cost predictions (see add_cost_predictions) and the index of the selected one (see select_config)
+    """
+
+    report = add_cost_predictions(grid_sweep.run_sweep(points, bbox, cell_sizes, thresholds, [migration_radius], num_processes, pop_per_count), model, num_cores)
+
+    # the number of nodes (and memory) decrease with the cell size; bisect the cell sizes bracketing the target
+    if target_nodes is not None or memory_budget_mb is not None:
+
+        for threshold in thresholds:
+
+            for r in range(num_refinements):
+
+                rows = report[report.threshold == threshold].sort_values("cell_size")
+
+                if target_nodes is not None:
+                    above = rows.num_nodes.values > target_nodes
+                else:
+                    above = rows.memory_mb_per_core.values > memory_budget_mb
+
+                crossings = np.flatnonzero(above[:-1] & np.logical_not(above[1:]))
+                if len(crossings) == 0:
+                    break
+
+                low, high = rows.cell_size.values[crossings[0]], rows.cell_size.values[crossings[0] + 1]
+                if high - low <= 1:
+                    break
+
+                refined = grid_sweep.run_sweep(points, bbox, [(low + high) // 2], [threshold], [migration_radius], 1, pop_per_count)
+                report = pd.concat([report, add_cost_predictions(refined, model, num_cores)], ignore_index = True)
+
+    report = report.sort_values(["threshold", "cell_size"]).reset_index(drop = True)
+
+    return report, select_config(report, target_nodes, memory_budget_mb)
@@ -0,0 +1,160 @@
+'''
+- removal of duplicate structures (e.g. the same building as an OSM node and as the center of a way, or near duplicate points of overlapping imports)
+  before gridding (see dedup_structures.py); each duplicate would otherwise be counted in its grid cell and inflate the cell population
+- points are projected on a local equirectangular plane around the median longitude (meters; the longitude scale follows the latitude of each point)
+  and snapped to a spatial hash of square buckets, so that points within the merge distance are in the same or in one of the 8 adjacent buckets;
+  the projection stretches distances away from the median longitude (by up to |lon - lon0| * |sin(lat)|, in radians) and the sphere differs from the
+  ellipsoid, so the buckets are widened accordingly (see get_bucket_size)
+- buckets are looked up in hash tables (pandas factorize and Index.get_indexer) rather than by sorting all points, so the stage is linear in the number of points
+  (e.g. tens of millions of structures of a country extract):
+---- points without any other point in their 3 x 3 block of buckets (most of them) are kept without any distance computation
+---- the remaining (candidate) points are grouped by bucket and paired with the points of their 3 x 3 block of buckets (a few per point);
+     the pairs within the merge distance (vincenty distance, see grid_geodesy.py) are merged
+- merging is greedy in input order: a point is merged into the first kept point within the merge distance, so kept points are more than the merge distance
+  apart and deduplicating a deduplicated file changes nothing
+'''
+
+import numpy as np
+
+import pandas as pd
+
+from grid_geodesy import vincenty_km
+
+
+# mean earth radius (in m)
+earth_radius_m = 6371008.8
+
+# max ratio of a distance on the sphere of mean radius to the WGS-84 distance, over short distances (meridian radius of curvature at the equator), with some slack
+ellipsoid_margin = 1.01
+
+
+def get_plane_coordinates(lons, lats, lon0):
+    """
+    :param lon0: longitude of the origin of the plane (e.g. the median longitude of the points)
+    :return: arrays x, y of the points on a local equirectangular plane (in m)
+    """
+
+    lats = np.radians(np.asarray(lats, dtype = np.float64))
+    lons = np.radians(np.asarray(lons, dtype = np.float64) - lon0)
+
+    return earth_radius_m * lons * np.cos(lats), earth_radius_m * lats
+
+
+def get_bucket_size(lons, lats, lon0, distance):
+    """
+    :return: bucket side (in m) such that points within the merge distance are at most one bucket apart on the plane (see get_plane_coordinates);
+             between nearby points, x differs by the east-west distance plus up to |lon - lon0| * |sin(lat)| (in radians) times the north-south distance
+    """
+
+    shear = np.max(np.abs(np.radians(np.asarray(lons, dtype = np.float64) - lon0)) * np.abs(np.sin(np.radians(np.asarray(lats, dtype = np.float64)))))
+
+    return distance * (1 + shear) * ellipsoid_margin
+
+
+def get_bucket_keys(x, y, bucket_size):
+    """
+    :param bucket_size: bucket side (in m; see get_bucket_size)
+    :return: array of the integer bucket key of each point and the key offset of one bucket along x (the key offset along y is 1);
+             buckets are shifted by one so that the keys of the adjacent buckets of all points are distinct and non negative
+    """
+
+    idx_x = np.floor(x / bucket_size).astype(np.int64)
+    idx_y = np.floor(y / bucket_size).astype(np.int64)
+
+    idx_x -= idx_x.min() - 1
+    idx_y -= idx_y.min() - 1
+
+    num_buckets_y = int(idx_y.max()) + 2
+
+    return idx_x * num_buckets_y + idx_y, num_buckets_y
+
+
+def find_duplicates(lons, lats, distance):
+    """
+    :param lons: array of longitudes
+    :param lats: array of latitudes
+    :param distance: merge distance (in m)
+    :return: array of the index of the point each point is merged into (its own index if kept); points with missing coordinates are kept
+    """
+
+    lons = np.asarray(lons, dtype = np.float64)
+    lats = np.asarray(lats, dtype = np.float64)
+
+    merged_into = np.arange(len(lons))
+
+    located = np.flatnonzero(np.isfinite(lons) & np.isfinite(lats))
+    if len(located) < 2 or distance <= 0:
+        return merged_into
+
+    lons, lats = lons[located], lats[located]
+
+    lon0 = np.median(lons)
+    x, y = get_plane_coordinates(lons, lats, lon0)
+
+    bucket_size = get_bucket_size(lons, lats, lon0, distance)
+    keys, step_x = get_bucket_keys(x, y, bucket_size)
+
+    codes, bucket_keys = pd.factorize(keys)
+    bucket_counts = np.bincount(codes)
+    buckets = pd.Index(bucket_keys)
+
+    # half of the adjacent buckets; each pair of adjacent buckets is found once, from its first bucket
+    offsets = [step_x - 1, step_x, step_x + 1, 1]
+    lookups = [buckets.get_indexer(bucket_keys + offset) for offset in offsets]
+
+    # number of points in the 3 x 3 block of buckets around each bucket
+    block_counts = bucket_counts.copy()
+    for pos in lookups:
+        found = np.flatnonzero(pos >= 0)
+        block_counts[found] += bucket_counts[pos[found]]
+        block_counts[pos[found]] += bucket_counts[found]
+
+    # points with another point nearby; all points of the buckets around a candidate are candidates too
+    candidates = np.flatnonzero(block_counts[codes] > 1)
+    if len(candidates) == 0:
+        return merged_into
+
+    # candidates grouped by bucket (positions in the located points)
+    order = candidates[np.argsort(codes[candidates], kind = 'mergesort')]
+    order_codes = codes[order]
+    bucket_starts = np.zeros(len(bucket_keys), dtype = np.int64)
+    firsts = np.flatnonzero(np.r_[True, order_codes[1:] != order_codes[:-1]])
+    bucket_starts[order_codes[firsts]] = firsts
+
+    srcs = []
+    dsts = []
+
+    for pos in [np.arange(len(bucket_keys))] + lookups:
+
+        # all points of the (same or adjacent) bucket of each candidate
+        pos = pos[order_codes]
+        found = pos >= 0
+        src, pos = order[found], pos[found]
+
+        num_pairs = bucket_counts[pos]
+        ranks = np.arange(num_pairs.sum()) - np.repeat(np.cumsum(num_pairs) - num_pairs, num_pairs)
+        src = np.repeat(src, num_pairs)
+        dst = order[np.repeat(bucket_starts[pos], num_pairs) + ranks]
+
+        # pairs within the merge distance, ordered by input position (pairs within a bucket are found twice); the plane distance is only a pre-filter
+        near = np.flatnonzero((src != dst) & ((x[src] - x[dst]) ** 2 + (y[src] - y[dst]) ** 2 <= bucket_size ** 2))
+        close = near[1000. * vincenty_km(lats[src[near]], lons[src[near]], lats[dst[near]], lons[dst[near]]) <= distance]
+        src, dst = np.minimum(src[close], dst[close]), np.maximum(src[close], dst[close])
+
+        srcs.append(src)
+        dsts.append(dst)
+
+    src = np.concatenate(srcs)
+    dst = np.concatenate(dsts)
+
+    # greedy merge in input order: the kept state of src (< dst) is final when dst is reached
+    pairs = np.lexsort((src, dst))
+
+    merged = list(range(len(located)))
+    for i, j in zip(src[pairs].tolist(), dst[pairs].tolist()):
+        if merged[j] == j and merged[i] == i:
+            merged[j] = i
+
+    merged_into[located] = located[np.array(merged, dtype = np.int64)]
+
+    return merged_into
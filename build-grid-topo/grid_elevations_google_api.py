@@ -1,8 +1,9 @@
 '''
 - get the elevations for a collection of lat, lon points via Google map API
 - in the case of the grid opo, the points are the centroids of grid cells
-- input:     - csv w/ required columns lat,lon
+- input:     - csv w/ required columns lat,lon; optional column cell_id (anchored grid; see grid_anchor.py)
 - output:    - csv w/ appended column google_alt
+             - if the input has column cell_id: cache of elevations by cell id (e.g. cell_google_alts_cache.json); cells cached in previous runs are not requested again
 '''
 
 import logging
@@ -11,6 +12,8 @@ import numpy as np
 import simplejson, urllib, json
 import requests
 
+import grid_anchor
+
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 
@@ -20,6 +23,9 @@ google_locs_req_batch = {}
 node_records_google_alts = {}
 num_rows_left = 0
 
+# cache of elevations keyed by the stable cell ids of an anchored grid (see grid_anchor.py)
+google_alts_cache = "cell_google_alts_cache.json"
+
 def get_google_alt(row):
     
     global google_locs_req_batch
@@ -68,9 +74,43 @@ the limits should be sufficient at least for a few dozen thousands of locations
 
 node_records = pd.read_csv('pop_gridded.csv')
 
-num_rows_left = len(node_records.index)
+cache_by_cell_id = 'cell_id' in node_records.columns
+
+if cache_by_cell_id:
+    
+    # skip cells whose elevations were requested in previous runs
+    cached_cells = grid_anchor.load_cell_cache(google_alts_cache)
+    
+    uncached = []
+    for node_label, cell_id, lat, lon in zip(node_records['node_label'], node_records['cell_id'], node_records['lat'], node_records['lon']):
+        google_alt = grid_anchor.get_cached_value(cached_cells, cell_id, lat, lon)
+        if google_alt is None:
+            uncached.append(True)
+        else:
+            node_records_google_alts[node_label] = google_alt
+            uncached.append(False)
+    
+    request_records = node_records[np.array(uncached, dtype = bool)]
+    
+    logging.info("Reusing cached elevations of " + str(len(node_records.index) - len(request_records.index)) + " cells")
+    
+else:
+    request_records = node_records
+
+num_rows_left = len(request_records.index)
+
+if num_rows_left > 0:
+    request_records.apply(get_google_alt, axis = 1)
 
-node_records.apply(get_google_alt, axis = 1)
+if cache_by_cell_id:
+    
+    for node_label, cell_id, lat, lon in zip(request_records['node_label'], request_records['cell_id'], request_records['lat'], request_records['lon']):
+        if node_records_google_alts[node_label] != 'NaN':
+            grid_anchor.set_cached_value(cached_cells, cell_id, lat, lon, node_records_google_alts[node_label])
+    
+    grid_anchor.save_cell_cache(google_alts_cache, cached_cells)
+    
+    logging.info("Cell elevations cached in " + google_alts_cache)
 
 google_alts = []
 
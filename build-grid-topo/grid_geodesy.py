@@ -0,0 +1,245 @@
+'''
+- geodesic distance helpers shared by the grid topo scripts
+- vincenty_km is an array version of geopy's vincenty (WGS-84) distance; it follows geopy's iteration and convergence
+  criteria so that grid edge weights match the ones obtained via vincenty((lat_src, lon_src), (lat_dst, lon_dst)).km
+'''
+
+import numpy as np
+
+
+# WGS-84 ellipsoid (major axis in km, minor axis in km, flattening); same values as geopy's ELLIPSOIDS['WGS-84']
+WGS84 = (6378.137, 6356.7523142, 1 / 298.257223563)
+
+# max number of vincenty iterations (geopy default)
+vincenty_iterations = 20
+
+
+def vincenty_km(lat_src, lon_src, lat_dst, lon_dst, iterations = vincenty_iterations):
+    """
+    :param lat_src: array (or scalar) of source latitudes in degrees
+    :param lon_src: array (or scalar) of source longitudes in degrees
+    :param lat_dst: array (or scalar) of destination latitudes in degrees
+    :param lon_dst: array (or scalar) of destination longitudes in degrees
+    :param iterations: max number of iterations before failing to converge
+    :return: array of distances in km (broadcast shape of the inputs)
+    """
+
+    lat_src, lon_src, lat_dst, lon_dst = np.broadcast_arrays(*[np.radians(np.asarray(v, dtype = np.float64)) for v in (lat_src, lon_src, lat_dst, lon_dst)])
+
+    # iterate on flat arrays (scalar inputs included); the distances are reshaped to the broadcast shape
+    shape = lat_src.shape
+    lat_src, lon_src, lat_dst, lon_dst = [np.ravel(v) for v in (lat_src, lon_src, lat_dst, lon_dst)]
+
+    major, minor, f = WGS84
+
+    delta_lng = lon_dst - lon_src
+
+    reduced_lat_src = np.arctan((1 - f) * np.tan(lat_src))
+    reduced_lat_dst = np.arctan((1 - f) * np.tan(lat_dst))
+
+    sin_reduced_src, cos_reduced_src = np.sin(reduced_lat_src), np.cos(reduced_lat_src)
+    sin_reduced_dst, cos_reduced_dst = np.sin(reduced_lat_dst), np.cos(reduced_lat_dst)
+
+    lambda_lng = delta_lng.copy()
+
+    sin_sigma = np.zeros(delta_lng.shape)
+    cos_sigma = np.zeros(delta_lng.shape)
+    sigma = np.zeros(delta_lng.shape)
+    cos_sq_alpha = np.zeros(delta_lng.shape)
+    cos2_sigma_m = np.zeros(delta_lng.shape)
+
+    # pairs still iterating; coincident pairs drop out with distance 0 as in geopy
+    active = np.ones(delta_lng.shape, dtype = bool)
+    coincident = np.zeros(delta_lng.shape, dtype = bool)
+
+    i = 0
+    while active.any():
+
+        if i > iterations:
+            raise ValueError("Vincenty formula failed to converge!")
+        i += 1
+
+        l = lambda_lng[active]
+        s1, c1 = sin_reduced_src[active], cos_reduced_src[active]
+        s2, c2 = sin_reduced_dst[active], cos_reduced_dst[active]
+
+        sin_l, cos_l = np.sin(l), np.cos(l)
+
+        ss = np.sqrt((c2 * sin_l) ** 2 + (c1 * s2 - s1 * c2 * cos_l) ** 2)
+
+        same = ss == 0
+        ss_safe = np.where(same, 1.0, ss)
+
+        cs = s1 * s2 + c1 * c2 * cos_l
+        sg = np.arctan2(ss, cs)
+
+        sin_alpha = c1 * c2 * sin_l / ss_safe
+        csa = 1 - sin_alpha ** 2
+
+        # equatorial lines have cos_sq_alpha == 0
+        csa_safe = np.where(csa != 0, csa, 1.0)
+        c2sm = np.where(csa != 0, cs - 2 * (s1 * s2 / csa_safe), 0.0)
+
+        C = f / 16. * csa * (4 + f * (4 - 3 * csa))
+
+        l_next = delta_lng[active] + (1 - C) * f * sin_alpha * (sg + C * ss * (c2sm + C * cs * (-1 + 2 * c2sm ** 2)))
+
+        sin_sigma[active] = ss
+        cos_sigma[active] = cs
+        sigma[active] = sg
+        cos_sq_alpha[active] = csa
+        cos2_sigma_m[active] = c2sm
+        lambda_lng[active] = l_next
+
+        coincident[active] = same
+        active[active] = np.logical_and(np.abs(l_next - l) > 10e-12, np.logical_not(same))
+
+    u_sq = cos_sq_alpha * (major ** 2 - minor ** 2) / minor ** 2
+
+    A = 1 + u_sq / 16384. * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+
+    delta_sigma = B * sin_sigma * (cos2_sigma_m + B / 4. * (cos_sigma * (-1 + 2 * cos2_sigma_m ** 2) - B / 6. * cos2_sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos2_sigma_m ** 2)))
+
+    s = minor * A * (sigma - delta_sigma)
+    s[coincident] = 0.0
+
+    return s.reshape(shape)
+
+
+class DistanceKernel(object):
+    '''
+    cache of centroid to centroid distances on a regular lat/lon grid
+
+    on a regular grid the distance between a cell and its (dx, dy) neighbor only depends on the cell's row (i.e. its latitude band) and the offset,
+    so distances are computed once per (row, dx, dy) rather than once per edge:
+    - fill(radius) computes a dense table for all rows and all offsets within radius hops (i.e. the migration stencil)
+    - lookup(rows, dx, dy) reads distances from the table and computes (and caches) any offsets outside of it on demand
+    '''
+
+    def __init__(self, lat_origin, lat_step, lon_step, num_rows):
+        """
+        :param lat_origin: latitude of the centroids in row 0
+        :param lat_step: latitude difference between the centroids of adjacent rows
+        :param lon_step: longitude difference between the centroids of adjacent columns
+        :param num_rows: number of rows in the grid
+        """
+        self.lat_origin = lat_origin
+        self.lat_step = lat_step
+        self.lon_step = lon_step
+        self.num_rows = num_rows
+
+        self.radius = -1
+        self.table = np.zeros((num_rows, 0, 0))
+        self.cache = {}
+
+
+    @classmethod
+    def from_axes(cls, x_mid, y_mid):
+        """
+        :param x_mid: array of cell centroids longitudes along the x axis (e.g. histogram2d bin midpoints)
+        :param y_mid: array of cell centroids latitudes along the y axis
+        """
+        lon_step = (x_mid[-1] - x_mid[0]) / (len(x_mid) - 1.0) if len(x_mid) > 1 else 0.0
+        lat_step = (y_mid[-1] - y_mid[0]) / (len(y_mid) - 1.0) if len(y_mid) > 1 else 0.0
+
+        return cls(y_mid[0], lat_step, lon_step, len(y_mid))
+
+
+    @classmethod
+    def from_centroids(cls, lons, lats, tolerance = 1e-3):
+        """
+        infer the regular grid spanned by a collection of cell centroids (e.g. the lon, lat columns of pop_gridded.csv)
+
+        :param lons: array of cell centroids longitudes
+        :param lats: array of cell centroids latitudes
+        :param tolerance: max allowed deviation of a centroid from the inferred grid, as a fraction of the cell size
+        :return: kernel and the arrays of inferred (column, row) indices of each centroid
+        """
+
+        _, lon_step, cols = _infer_axis(np.asarray(lons, dtype = np.float64), tolerance)
+        lat_origin, lat_step, rows = _infer_axis(np.asarray(lats, dtype = np.float64), tolerance)
+
+        kernel = cls(lat_origin, lat_step, lon_step, int(rows.max()) + 1 if len(rows) else 0)
+
+        return kernel, cols, rows
+
+
+    def fill(self, radius):
+        """
+        compute the dense (row, dx, dy) distance table for all offsets within radius hops
+
+        :param radius: stencil radius in hops (e.g. migration_radius)
+        """
+
+        if radius <= self.radius:
+            return
+
+        offsets = np.arange(-radius, radius + 1)
+        rows = np.arange(self.num_rows)
+
+        rows_grid, dx_grid, dy_grid = np.meshgrid(rows, offsets, offsets, indexing = 'ij')
+
+        lat_src = self.lat_origin + rows_grid * self.lat_step
+        lat_dst = self.lat_origin + (rows_grid + dy_grid) * self.lat_step
+
+        self.table = vincenty_km(lat_src, 0.0, lat_dst, dx_grid * self.lon_step)
+        self.radius = radius
+
+
+    def lookup(self, rows, dx, dy):
+        """
+        :param rows: array of source cells rows
+        :param dx: array of column offsets from source to destination cells
+        :param dy: array of row offsets from source to destination cells
+        :return: array of distances in km
+        """
+
+        rows, dx, dy = np.broadcast_arrays(*[np.asarray(v, dtype = np.int64) for v in (rows, dx, dy)])
+
+        dists = np.empty(rows.shape)
+
+        in_table = (np.abs(dx) <= self.radius) & (np.abs(dy) <= self.radius)
+        r = self.radius
+        dists[in_table] = self.table[rows[in_table], dx[in_table] + r, dy[in_table] + r]
+
+        not_in_table = np.logical_not(in_table)
+        if not_in_table.any():
+            keys = list(zip(rows[not_in_table].tolist(), dx[not_in_table].tolist(), dy[not_in_table].tolist()))
+
+            missing = [key for key in set(keys) if key not in self.cache]
+            if missing:
+                m_rows, m_dx, m_dy = [np.array(v, dtype = np.int64) for v in zip(*missing)]
+                m_dists = vincenty_km(self.lat_origin + m_rows * self.lat_step, 0.0, self.lat_origin + (m_rows + m_dy) * self.lat_step, m_dx * self.lon_step)
+                self.cache.update(zip(missing, m_dists.tolist()))
+
+            dists[not_in_table] = [self.cache[key] for key in keys]
+
+        return dists
+
+
+def _infer_axis(values, tolerance):
+    """
+    :param values: array of centroid coordinates along one axis
+    :param tolerance: max allowed deviation from the inferred axis as a fraction of the step
+    :return: origin, step and integer index of each value along the axis
+    """
+
+    if len(values) == 0:
+        return 0.0, 0.0, np.zeros(0, dtype = np.int64)
+
+    unique_values = np.unique(values)
+    origin = unique_values[0]
+
+    if len(unique_values) == 1:
+        return origin, 0.0, np.zeros(len(values), dtype = np.int64)
+
+    # adjacent columns (rows) are a step apart; refine the estimate over the whole span to limit the effect of rounding (e.g. csv round trips)
+    step = np.diff(unique_values).min()
+    step = (unique_values[-1] - origin) / np.round((unique_values[-1] - origin) / step)
+
+    idxs = np.round((values - origin) / step)
+    if np.abs(values - origin - idxs * step).max() > tolerance * step:
+        raise ValueError("Centroids do not lie on a regular grid.")
+
+    return origin, step, idxs.astype(np.int64)
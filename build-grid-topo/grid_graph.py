@@ -0,0 +1,191 @@
+'''
+- compact binary storage of the grid graph (an alternative to the json adjacency list, e.g. gridded_households_adj_list.json)
+- the graph is stored in CSR (compressed sparse row) form: indptr (num_nodes + 1), indices (num_edges; int32), weights (num_edges; float32) and node_labels (num_nodes)
+- optionally only one direction of each edge is stored (src < dst); self-loops and reverse edges are restored on load
+- storage layouts:
+---- .npz file (e.g. gridded_households_adj_graph.npz); uncompressed, so that loading is a plain read
+---- directory of .npy files (indptr.npy, indices.npy, weights.npy, node_labels.npy, meta.json); memory-mappable (see load_csr(mmap = True))
+
+- the arrays can be wrapped in scipy.sparse.csr_matrix((weights, indices, indptr)) for use with scipy.sparse.csgraph
+'''
+
+import os
+import json
+
+import numpy as np
+
+
+def to_csr(src, dst, w, num_nodes, single_direction = False):
+    """
+    :param src: array of edge source node positions
+    :param dst: array of edge destination node positions
+    :param w: array of edge weights
+    :param num_nodes: number of nodes
+    :param single_direction: only keep edges with src < dst (i.e. drop self-loops and reverse edges of an undirected graph)
+    :return: arrays indptr, indices, weights
+    """
+
+    src = np.asarray(src, dtype = np.int64)
+    dst = np.asarray(dst, dtype = np.int64)
+    w = np.asarray(w, dtype = np.float32)
+
+    if single_direction:
+        keep = src < dst
+        src, dst, w = src[keep], dst[keep], w[keep]
+
+    # stable sort keeps the per source edge order (e.g. stencil order)
+    order = np.argsort(src, kind = 'mergesort')
+
+    indptr = np.zeros(num_nodes + 1, dtype = np.int64)
+    np.cumsum(np.bincount(src, minlength = num_nodes), out = indptr[1:])
+
+    return indptr, dst[order].astype(np.int32), w[order]
+
+
+def from_csr(indptr, indices, weights):
+    """
+    :return: arrays src, dst, w of the graph edges
+    """
+    src = np.repeat(np.arange(len(indptr) - 1, dtype = np.int64), np.diff(indptr))
+
+    return src, np.asarray(indices, dtype = np.int64), np.asarray(weights)
+
+
+def get_subgraph(src, dst, w, nodes, num_nodes):
+    """
+    :param src: array of edge source node positions
+    :param dst: array of edge destination node positions
+    :param w: array of edge weights
+    :param nodes: sorted array of the positions of the subgraph nodes
+    :param num_nodes: number of nodes of the graph
+    :return: arrays src, dst, w of the edges between the subgraph nodes, with positions in nodes (edge order is kept)
+    """
+
+    node_pos = np.repeat(-1, num_nodes)
+    node_pos[nodes] = np.arange(len(nodes))
+
+    src_pos = node_pos[src]
+    dst_pos = node_pos[dst]
+    inside = (src_pos >= 0) & (dst_pos >= 0)
+
+    return src_pos[inside], dst_pos[inside], np.asarray(w)[inside]
+
+
+def expand_single_direction(indptr, indices, weights, self_loops = True):
+    """
+    restore both directions of each edge (and zero weight self-loops) of a graph stored with single_direction = True
+
+    :return: arrays indptr, indices, weights
+    """
+    src, dst, w = from_csr(indptr, indices, weights)
+    num_nodes = len(indptr) - 1
+
+    all_src = [src, dst]
+    all_dst = [dst, src]
+    all_w = [w, w]
+
+    if self_loops:
+        nodes = np.arange(num_nodes, dtype = np.int64)
+        all_src.append(nodes)
+        all_dst.append(nodes)
+        all_w.append(np.zeros(num_nodes, dtype = np.float32))
+
+    return to_csr(np.concatenate(all_src), np.concatenate(all_dst), np.concatenate(all_w), num_nodes)
+
+
+def save_csr(path, indptr, indices, weights, node_labels = None, single_direction = False, self_loops = True):
+    """
+    :param path: .npz file path or directory path (raw memory-mappable layout)
+    :param indptr: CSR row pointers
+    :param indices: CSR column indices (destination node positions)
+    :param weights: CSR edge weights
+    :param node_labels: optional array of integer node labels by position; defaults to positions
+    :param single_direction: whether only one direction of each edge is stored
+    :param self_loops: whether the full graph has a (zero weight) self-loop at each node; used to restore single direction graphs
+    """
+
+    if node_labels is None:
+        node_labels = np.arange(len(indptr) - 1, dtype = np.int64)
+
+    arrays = {
+                "indptr": np.asarray(indptr, dtype = np.int64),
+                "indices": np.asarray(indices, dtype = np.int32),
+                "weights": np.asarray(weights, dtype = np.float32),
+                "node_labels": np.asarray(node_labels, dtype = np.int64)
+              }
+
+    meta = {"single_direction": bool(single_direction), "self_loops": bool(self_loops)}
+
+    if path.endswith(".npz"):
+        np.savez(path, meta = np.array(json.dumps(meta)), **arrays)
+    else:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), array)
+        with open(os.path.join(path, "meta.json"), "w") as m_f:
+            json.dump(meta, m_f)
+
+
+def load_csr(path, full = True, mmap = False):
+    """
+    :param path: .npz file path or directory path (see save_csr)
+    :param full: restore both edge directions and self-loops if the graph was stored in single direction mode
+    :param mmap: memory-map the arrays instead of reading them (directory layout only)
+    :return: arrays indptr, indices, weights, node_labels
+    """
+
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            indptr, indices, weights, node_labels = [data[name] for name in ("indptr", "indices", "weights", "node_labels")]
+    else:
+        with open(os.path.join(path, "meta.json"), "r") as m_f:
+            meta = json.load(m_f)
+        mmap_mode = 'r' if mmap else None
+        indptr, indices, weights, node_labels = [np.load(os.path.join(path, name + ".npy"), mmap_mode = mmap_mode) for name in ("indptr", "indices", "weights", "node_labels")]
+
+    if full and meta["single_direction"]:
+        indptr, indices, weights = expand_single_direction(indptr, indices, weights, meta["self_loops"])
+
+    return indptr, indices, weights, node_labels
+
+
+def csr_to_adj_list(indptr, indices, weights, node_labels):
+    """
+    :return: dict of node label to dict of neighbor node label to weight, with string labels (i.e. same as json.load of the json adjacency list)
+    """
+
+    labels = [str(node_label) for node_label in np.asarray(node_labels).tolist()]
+    indptr = np.asarray(indptr).tolist()
+    indices = np.asarray(indices).tolist()
+    weights = np.asarray(weights, dtype = np.float64).tolist()
+
+    adj_list = {}
+    for i, node_label in enumerate(labels):
+        adj_list[node_label] = dict((labels[j], w) for j, w in zip(indices[indptr[i]:indptr[i + 1]], weights[indptr[i]:indptr[i + 1]]))
+
+    return adj_list
+
+
+def get_node_graph(adj_list, node_labels):
+    """
+    :param adj_list: dict of node label to dict of neighbor node label to weight (e.g. json.load of the json adjacency list or csr_to_adj_list)
+    :param node_labels: list of node labels in the order of the graph nodes (e.g. of the records of pop_gridded.csv)
+    :return: arrays indptr, indices, weights of the graph over the given nodes, in their order; edges to nodes that are not given are dropped
+    """
+
+    node_pos = dict((str(node_label), i) for i, node_label in enumerate(node_labels))
+
+    src = []
+    dst = []
+    w = []
+    for node_label, neighbors in adj_list.items():
+        if node_label in node_pos:
+            for neighbor, weight in neighbors.items():
+                if neighbor in node_pos:
+                    src.append(node_pos[node_label])
+                    dst.append(node_pos[neighbor])
+                    w.append(weight)
+
+    return to_csr(src, dst, w, len(node_labels))
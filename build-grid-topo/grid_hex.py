@@ -0,0 +1,211 @@
+'''
+- hexagonal tessellation of the grid (see build_grid_topo_hex.py), as an alternative to the square histogram2d cells
+- coordinates are projected on a local equirectangular plane around the bounding box (km per degree of longitude at the box center latitude,
+  km per degree of latitude along the box center meridian; both from vincenty distances), which is accurate at the scale of a commune or departement
+- cells are pointy top hexagons of the same area as a square cell of side cell_size (i.e. neighbor cell centers are ~1.075 * cell_size apart),
+  identified by their axial coordinates (q, r); points are assigned to cells all at once by rounding their fractional axial coordinates (cube rounding)
+- axial coordinates are shifted to non negative indices (idx_q, idx_r) over the axial ranges of the bounding box, and keyed as idx_q * num_cells_r + idx_r
+  like the (idx_x, idx_y) square cells, so the sorted key look-ups of grid_adjacency.find_neighbors apply with a hexagonal stencil
+- migration_radius is in hex rings: 1 connects the 6 cells sharing a face, 2 adds the next ring of 12 cells, etc. (3 * r * (r + 1) neighbors instead of
+  (2 * r + 1)^2 - 1 on the square grid, i.e. ~25-30% fewer edges), and the neighbors of a ring are (approximately) equidistant
+- edge weights are vincenty distances (in km) between cell centers; the distance only depends on the source row (r) and the offset, so it is computed
+  once per (row, offset) as in grid_geodesy.DistanceKernel
+'''
+
+import numpy as np
+
+import grid_adjacency
+import grid_binning
+
+from grid_geodesy import vincenty_km
+
+
+# center to center spacing of hexagons of the same area as a unit square: sqrt(2 / sqrt(3))
+hex_spacing_factor = np.sqrt(2 / np.sqrt(3))
+
+
+def get_hex_stencil(migration_radius):
+    """
+    :param migration_radius: neighborhood radius in hex rings (1 is the adjacent 6 cells; 2 is the adjacent 18 cells, etc.)
+    :return: arrays dq, dr of all 3 * migration_radius * (migration_radius + 1) + 1 axial neighbor offsets, including the cell itself (0, 0)
+    """
+
+    offsets = np.arange(-migration_radius, migration_radius + 1)
+    dq, dr = np.meshgrid(offsets, offsets, indexing = 'ij')
+    dq, dr = dq.ravel(), dr.ravel()
+
+    within = np.abs(dq + dr) <= migration_radius
+
+    return dq[within], dr[within]
+
+
+def round_axial(qf, rf):
+    """
+    :param qf: array of fractional axial q coordinates
+    :param rf: array of fractional axial r coordinates
+    :return: arrays of the axial coordinates q, r of the hexagons containing the points (cube coordinates rounding)
+    """
+
+    xf, zf = np.asarray(qf, dtype = np.float64), np.asarray(rf, dtype = np.float64)
+    yf = -xf - zf
+
+    x, y, z = np.round(xf), np.round(yf), np.round(zf)
+    dx, dy, dz = np.abs(x - xf), np.abs(y - yf), np.abs(z - zf)
+
+    # the coordinate with the largest rounding error is restored from the other two (x + y + z = 0)
+    fix_x = (dx > dy) & (dx > dz)
+    fix_z = np.logical_not(fix_x) & (dz >= dy)
+
+    x = np.where(fix_x, -y - z, x)
+    z = np.where(fix_z, -x - y, z)
+
+    return x.astype(np.int64), z.astype(np.int64)
+
+
+class HexGrid(object):
+    """
+    hexagonal grid over a bounding box; see above
+    """
+
+    def __init__(self, bbox, cell_size):
+        """
+        :param bbox: bounding box (x_min, x_max, y_min, y_max)
+        :param cell_size: side (in m) of the square cell of the same area as a hexagon
+        """
+
+        x_min, x_max, y_min, y_max = bbox
+
+        self.bbox = bbox
+        self.cell_size = cell_size
+
+        # local projection origin and scales (km per degree)
+        self.lon0 = x_min
+        self.lat0 = y_min
+        self.km_per_lon = float(vincenty_km((y_min + y_max)/2, x_min, (y_min + y_max)/2, x_max)) / (x_max - x_min)
+        self.km_per_lat = float(vincenty_km(y_min, (x_min + x_max)/2, y_max, (x_min + x_max)/2)) / (y_max - y_min)
+
+        # center to center spacing and circumradius (in km)
+        self.spacing = hex_spacing_factor * cell_size / 1000.
+        self.radius = self.spacing / np.sqrt(3)
+
+        # axial ranges of the bounding box; extremes of the (linear) axial coordinates are at the box corners
+        corner_q, corner_r = self.get_fractional_axial(np.array([x_min, x_max, x_min, x_max]), np.array([y_min, y_min, y_max, y_max]))
+
+        self.q_min = int(np.floor(corner_q.min())) - 1
+        self.r_min = int(np.floor(corner_r.min())) - 1
+
+        self.num_cells_q = int(np.ceil(corner_q.max())) + 1 - self.q_min + 1
+        self.num_cells_r = int(np.ceil(corner_r.max())) + 1 - self.r_min + 1
+
+
+    def get_fractional_axial(self, lons, lats):
+        """
+        :return: arrays of the fractional axial coordinates q, r of the points
+        """
+
+        x = (np.asarray(lons, dtype = np.float64) - self.lon0) * self.km_per_lon
+        y = (np.asarray(lats, dtype = np.float64) - self.lat0) * self.km_per_lat
+
+        return (x * np.sqrt(3)/3 - y/3) / self.radius, (y * 2/3.) / self.radius
+
+
+    def get_cell_indices(self, lons, lats):
+        """
+        :return: arrays of cell indices idx_q, idx_r (shifted axial coordinates) of the hexagons containing the points
+        """
+
+        q, r = round_axial(*self.get_fractional_axial(lons, lats))
+
+        return q - self.q_min, r - self.r_min
+
+
+    def get_cell_keys(self, idx_q, idx_r):
+        """
+        :return: array of integer cell keys (idx_q * num_cells_r + idx_r)
+        """
+        return grid_adjacency.get_cell_keys(idx_q, idx_r, self.num_cells_r)
+
+
+    def get_centroids(self, idx_q, idx_r):
+        """
+        :return: arrays of longitudes, latitudes of the centers of the given cells
+        """
+
+        q = np.asarray(idx_q, dtype = np.float64) + self.q_min
+        r = np.asarray(idx_r, dtype = np.float64) + self.r_min
+
+        x = self.radius * np.sqrt(3) * (q + r/2)
+        y = self.radius * 1.5 * r
+
+        return self.lon0 + x / self.km_per_lon, self.lat0 + y / self.km_per_lat
+
+
+    def sparse_histogram(self, lons, lats, weights = None):
+        """
+        hexagonal equivalent of grid_binning.sparse_histogram2d
+
+        :return: arrays of sorted occupied cell keys (idx_q * num_cells_r + idx_r) and of their (weighted) counts
+        """
+
+        keys = self.get_cell_keys(*self.get_cell_indices(lons, lats))
+
+        cell_keys, inverse = np.unique(keys, return_inverse = True)
+        cell_counts = np.bincount(inverse.ravel(), weights = None if weights is None else np.asarray(weights, dtype = np.float64), minlength = len(cell_keys)).astype(np.float64)
+
+        return cell_keys, cell_counts
+
+
+    def sparse_histogram_chunked(self, csv_path, chunk_size = 1000000, weight_column = None, default_weight = None):
+        """
+        out-of-core sparse_histogram of the structures within the grid bounding box, reading the csv in chunks (see grid_binning.read_points_chunks)
+
+        :return: arrays of sorted occupied cell keys and counts
+        """
+
+        columns = ("lon", "lat") if weight_column is None else ("lon", "lat", weight_column)
+
+        cell_keys_list = []
+        cell_counts_list = []
+
+        for points in grid_binning.read_points_chunks(csv_path, self.bbox, columns, chunk_size):
+
+            cell_keys, cell_counts = self.sparse_histogram(points[:,0], points[:,1], grid_binning.get_chunk_weights(points, weight_column, default_weight))
+
+            cell_keys_list.append(cell_keys)
+            cell_counts_list.append(cell_counts)
+
+        return grid_binning.merge_sparse_histograms(cell_keys_list, cell_counts_list)
+
+
+    def build_adjacency(self, idx_q, idx_r, migration_radius):
+        """
+        :param idx_q: array of kept cells indices idx_q
+        :param idx_r: array of kept cells indices idx_r
+        :param migration_radius: neighborhood radius in hex rings
+        :return: arrays src, dst, w of the hexagonal grid graph edges (including zero weight self-loops, as grid_adjacency.build_adjacency);
+                 w is the center to center distance in km
+        """
+
+        dq, dr = get_hex_stencil(migration_radius)
+
+        src, dst, edge_dq, edge_dr = grid_adjacency.find_neighbors(idx_q, idx_r, self.num_cells_q, self.num_cells_r, migration_radius, stencil = (dq, dr))
+
+        idx_r = np.asarray(idx_r, dtype = np.int64)
+
+        # one distance per (source row, offset); the offset is keyed by its position in the stencil box
+        side = 2 * migration_radius + 1
+        edge_kernel_keys = idx_r[src] * side * side + (edge_dq + migration_radius) * side + (edge_dr + migration_radius)
+
+        kernel_keys, inverse = np.unique(edge_kernel_keys, return_inverse = True)
+
+        kernel_r = kernel_keys // (side * side)
+        kernel_dq = (kernel_keys % (side * side)) // side - migration_radius
+        kernel_dr = kernel_keys % side - migration_radius
+
+        # distances from the cell at idx_q = migration_radius of each row (any idx_q gives the same distances)
+        src_lons, src_lats = self.get_centroids(np.repeat(migration_radius, len(kernel_keys)), kernel_r)
+        dst_lons, dst_lats = self.get_centroids(migration_radius + kernel_dq, kernel_r + kernel_dr)
+
+        kernel_w = vincenty_km(src_lats, src_lons, dst_lats, dst_lons)
+
+        return src, dst, kernel_w[inverse.ravel()]
@@ -0,0 +1,176 @@
+'''
+- incremental grid rebuild (see incremental_state in build_grid_topo.py): the kept cells (nodes), their counts, stable node labels and the grid graph edges of a build
+  are persisted in a state file; a later build on a changed structures csv (e.g. newly enumerated households, a refreshed OSM extract) is diffed against it
+- only the affected cells and their stencil neighborhoods are updated: edges of removed nodes are dropped and edges of added nodes are built
+  from the added cells and their kept neighbors within migration_radius hops; all other edges are carried over from the state
+- node labels of cells kept in both builds are preserved; added cells get new labels (labels of removed cells are not reused)
+- requires an anchored grid (see grid_anchor.py) with the same bounding box, so that cells and edge weights do not move between builds
+
+- change set (json, e.g. gridded_households_changes.json); nodes by label, edges as in the json adjacency list (both directions and self-loops):
+  {"nodes": {"added": [...], "removed": [...], "modified": [...]}, "edges": {"added": [[src, dst, w], ...], "removed": [[src, dst], ...]}}
+  modified nodes are kept in both builds with a different (weighted) count; their attributes are in the new nodes csv
+'''
+
+import os
+import json
+
+import numpy as np
+
+import grid_adjacency
+
+
+def load_state(state_path, meta):
+    """
+    :param state_path: state file (.npz) written by save_state
+    :param meta: dict of the build parameters (e.g. resolution, bounding box, threshold, migration radius); must equal the ones of the state
+    :return: dict of state arrays; None if there is no state file yet
+    """
+
+    if not os.path.exists(state_path):
+        return None
+
+    with np.load(state_path) as data:
+        state = dict((name, data[name]) for name in data.files)
+
+    state_meta = json.loads(str(state.pop("meta")))
+    if state_meta != json.loads(json.dumps(meta)):
+        raise ValueError("Build parameters " + str(meta) + " differ from those of the grid state " + str(state_meta) + " in " + state_path + "; remove it for a full rebuild")
+
+    return state
+
+
+def save_state(state_path, meta, node_keys, node_counts, node_labels, next_label, src, dst, w):
+    """
+    :param state_path: state file (.npz)
+    :param meta: dict of the build parameters
+    :param node_keys: sorted cell keys (idx_x * num_cells_y + idx_y) of the nodes
+    :param node_counts: (weighted) counts of the nodes
+    :param node_labels: integer node labels
+    :param next_label: first label available to new nodes
+    :param src: array of edge source node positions
+    :param dst: array of edge destination node positions
+    :param w: array of edge weights (distances in km)
+    """
+
+    np.savez(state_path, meta = np.array(json.dumps(meta)),
+             node_keys = np.asarray(node_keys, dtype = np.int64), node_counts = np.asarray(node_counts, dtype = np.float64), node_labels = np.asarray(node_labels, dtype = np.int64),
+             next_label = np.array(next_label, dtype = np.int64),
+             src = np.asarray(src, dtype = np.int64), dst = np.asarray(dst, dtype = np.int64), w = np.asarray(w, dtype = np.float64))
+
+
+def match_keys(keys, sorted_keys):
+    """
+    :return: array of positions of keys in sorted_keys and boolean array of whether each key was found
+    """
+
+    pos = np.searchsorted(sorted_keys, keys)
+    pos[pos == len(sorted_keys)] = 0
+
+    found = sorted_keys[pos] == keys if len(sorted_keys) else np.zeros(len(keys), dtype = bool)
+
+    return pos, found
+
+
+def get_stencil_neighborhood(keys, sorted_keys, num_cells_x, num_cells_y, migration_radius):
+    """
+    :param keys: cell keys
+    :param sorted_keys: sorted cell keys of all kept cells
+    :return: sorted positions in sorted_keys of the kept cells within migration_radius hops of any of the given cells
+    """
+
+    keys = np.asarray(keys, dtype = np.int64)
+    idx_x = keys // num_cells_y
+    idx_y = keys % num_cells_y
+
+    neighborhood = []
+
+    stencil_dx, stencil_dy = grid_adjacency.get_stencil(migration_radius)
+
+    for dx, dy in zip(stencil_dx, stencil_dy):
+
+        neigh_x = idx_x + dx
+        neigh_y = idx_y + dy
+
+        on_grid = (neigh_x >= 0) & (neigh_x < num_cells_x) & (neigh_y >= 0) & (neigh_y < num_cells_y)
+
+        pos, found = match_keys(grid_adjacency.get_cell_keys(neigh_x[on_grid], neigh_y[on_grid], num_cells_y), sorted_keys)
+        neighborhood.append(pos[found])
+
+    return np.unique(np.concatenate(neighborhood)) if neighborhood else np.zeros(0, dtype = np.int64)
+
+
+def update_grid(state, node_keys, node_counts, x_mid, y_mid, migration_radius):
+    """
+    :param state: previous build state (see load_state)
+    :param node_keys: sorted cell keys of the nodes of the new build
+    :param node_counts: (weighted) counts of the nodes of the new build
+    :param x_mid: array of cell centroids longitudes along the x axis
+    :param y_mid: array of cell centroids latitudes along the y axis
+    :param migration_radius: neighborhood radius in hops
+    :return: node labels, next available label, arrays src, dst, w of the grid graph edges (as grid_adjacency.build_adjacency) and the change set dict
+    """
+
+    node_keys = np.asarray(node_keys, dtype = np.int64)
+    node_counts = np.asarray(node_counts, dtype = np.float64)
+
+    num_nodes = len(node_keys)
+    num_cells_y = len(y_mid)
+
+    old_keys = state["node_keys"]
+    old_labels = state["node_labels"]
+
+    # nodes kept in both builds keep their labels
+    old_pos, kept = match_keys(node_keys, old_keys)
+    new_pos, old_kept = match_keys(old_keys, node_keys)
+
+    added = np.flatnonzero(np.logical_not(kept))
+    removed = np.flatnonzero(np.logical_not(old_kept))
+    kept_nodes = np.flatnonzero(kept)
+    modified = kept_nodes[state["node_counts"][old_pos[kept_nodes]] != node_counts[kept_nodes]]
+
+    next_label = int(state["next_label"])
+
+    node_labels = np.zeros(num_nodes, dtype = np.int64)
+    node_labels[kept] = old_labels[old_pos[kept]]
+    node_labels[added] = next_label + np.arange(len(added))
+    next_label += len(added)
+
+    # carry over the edges between nodes kept in both builds
+    old_src, old_dst, old_w = state["src"], state["dst"], state["w"]
+
+    carried = old_kept[old_src] & old_kept[old_dst]
+    dropped = np.logical_not(carried)
+
+    # build the edges of added nodes from the added cells and their stencil neighborhood
+    neighborhood = get_stencil_neighborhood(node_keys[added], node_keys, len(x_mid), num_cells_y, migration_radius)
+
+    nb_src, nb_dst, nb_w = grid_adjacency.build_adjacency(node_keys[neighborhood] // num_cells_y, node_keys[neighborhood] % num_cells_y, x_mid, y_mid, migration_radius)
+
+    is_added = np.zeros(num_nodes, dtype = bool)
+    is_added[added] = True
+
+    nb_src = neighborhood[nb_src]
+    nb_dst = neighborhood[nb_dst]
+    touching = is_added[nb_src] | is_added[nb_dst]
+
+    src = np.concatenate([new_pos[old_src[carried]], nb_src[touching]])
+    dst = np.concatenate([new_pos[old_dst[carried]], nb_dst[touching]])
+    w = np.concatenate([old_w[carried], nb_w[touching]])
+
+    # neighbors are ordered by cell key (i.e. stencil order), as in a full build
+    ordering = np.lexsort((dst, src))
+    src, dst, w = src[ordering], dst[ordering], w[ordering]
+
+    changes = {
+                "nodes": {
+                            "added": node_labels[added].tolist(),
+                            "removed": old_labels[removed].tolist(),
+                            "modified": node_labels[modified].tolist()
+                        },
+                "edges": {
+                            "added": [[s, d, weight] for s, d, weight in zip(node_labels[nb_src[touching]].tolist(), node_labels[nb_dst[touching]].tolist(), nb_w[touching].tolist())],
+                            "removed": [[s, d] for s, d in zip(old_labels[old_src[dropped]].tolist(), old_labels[old_dst[dropped]].tolist())]
+                        }
+              }
+
+    return node_labels, next_label, src, dst, w, changes
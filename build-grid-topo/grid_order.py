@@ -0,0 +1,125 @@
+'''
+- space-filling curve ordering of the grid nodes (see node_order in the build scripts)
+- by default nodes are labeled in (idx_x, idx_y) order, i.e. column by column over the grid, so cells next to each other along x end up a whole column
+  of nodes apart in the node arrays, the json adjacency list, the graph CSR rows and the DTK node list
+- ordering the kept cells along a Hilbert (or Morton, i.e. Z-order) curve of their grid indices keeps nearby cells at nearby node labels:
+---- graph algorithms over the node arrays (e.g. ../health-seeking/generate_hfcas.py) touch fewer distinct memory regions per neighborhood
+---- any contiguous range of node labels is a spatially compact patch, e.g. when the nodes are split into num_cores chunks (see ../sims-grid-topo)
+- Hilbert curves have no jumps (consecutive cells of a full grid always share a face); Morton keys are cheaper (bit interleaving) but jump between quadrants
+'''
+
+import numpy as np
+
+
+# supported curves
+node_orders = ("hilbert", "morton")
+
+
+def get_curve_bits(idx_x, idx_y):
+    """
+    :return: number of bits per axis of the smallest 2^bits x 2^bits curve covering the cell indices
+    """
+
+    max_idx = int(max(np.max(idx_x), np.max(idx_y))) if len(idx_x) else 0
+
+    bits = 1
+    while (1 << bits) <= max_idx:
+        bits += 1
+
+    return bits
+
+
+def get_morton_keys(idx_x, idx_y, num_bits):
+    """
+    :param idx_x: array of cell indices along the x axis
+    :param idx_y: array of cell indices along the y axis
+    :param num_bits: number of bits per axis (see get_curve_bits)
+    :return: array of Morton (Z-order) keys; interleaved bits of idx_x and idx_y
+    """
+
+    idx_x = np.asarray(idx_x, dtype = np.int64)
+    idx_y = np.asarray(idx_y, dtype = np.int64)
+
+    keys = np.zeros(len(idx_x), dtype = np.int64)
+
+    for b in range(num_bits):
+        keys |= ((idx_x >> b) & 1) << (2*b + 1)
+        keys |= ((idx_y >> b) & 1) << (2*b)
+
+    return keys
+
+
+def get_hilbert_keys(idx_x, idx_y, num_bits):
+    """
+    :param idx_x: array of cell indices along the x axis
+    :param idx_y: array of cell indices along the y axis
+    :param num_bits: number of bits per axis (see get_curve_bits)
+    :return: array of distances along the Hilbert curve of order num_bits
+    """
+
+    x = np.array(idx_x, dtype = np.int64)
+    y = np.array(idx_y, dtype = np.int64)
+
+    n = 1 << num_bits
+    keys = np.zeros(len(x), dtype = np.int64)
+
+    s = n >> 1
+    while s > 0:
+
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+
+        keys += s * s * ((3 * rx) ^ ry)
+
+        # rotate the quadrant, so that the curve within it starts and ends next to the adjacent quadrants
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+
+        s >>= 1
+
+    return keys
+
+
+def get_node_order(idx_x, idx_y, node_order):
+    """
+    :param idx_x: array of kept cells indices along the x axis
+    :param idx_y: array of kept cells indices along the y axis
+    :param node_order: "hilbert" or "morton"
+    :return: array of positions in idx_x/idx_y ordered along the curve
+    """
+
+    if node_order not in node_orders:
+        raise ValueError("Unknown node order " + str(node_order) + "; use hilbert or morton")
+
+    num_bits = get_curve_bits(idx_x, idx_y)
+
+    if node_order == "hilbert":
+        keys = get_hilbert_keys(idx_x, idx_y, num_bits)
+    else:
+        keys = get_morton_keys(idx_x, idx_y, num_bits)
+
+    return np.argsort(keys, kind = 'mergesort')
+
+
+def reorder_edges(src, dst, w, ordering):
+    """
+    :param src: array of edge source node positions (before reordering)
+    :param dst: array of edge destination node positions
+    :param w: array of edge weights
+    :param ordering: array of the old positions of the nodes in their new order (see get_node_order)
+    :return: arrays src, dst, w of the edges with new node positions, ordered by new source (the per source edge order is kept)
+    """
+
+    new_pos = np.zeros(len(ordering), dtype = np.int64)
+    new_pos[ordering] = np.arange(len(ordering))
+
+    src = new_pos[np.asarray(src, dtype = np.int64)]
+    dst = new_pos[np.asarray(dst, dtype = np.int64)]
+
+    edge_order = np.argsort(src, kind = 'mergesort')
+
+    return src[edge_order], dst[edge_order], np.asarray(w)[edge_order]
@@ -0,0 +1,601 @@
+'''
+- offline extraction of structures (e.g. buildings, hospitals) from a local Open Street Map extract (.osm.pbf or .osm.xml file, e.g. a country extract from download.geofabrik.de),
+  instead of live Overpass queries (see extract_osm_structures.py); no network, and repeatable for a given extract
+- elements are classified into layers by the Overpass QL tag filters of download_osm_structures.py, compiled into a rule table (see grid_tags.py);
+  nodes are located at their coordinates and ways at the center of the bounding box of their nodes (as Overpass "out center")
+- .osm.pbf files are sequences of independently compressed blocks (of about 8000 elements); the blocks are decoded in parallel in a process pool, in two passes:
+---- the first pass decodes the tags of the nodes and ways of all blocks and keeps the elements of the layers (and the node references of the kept ways)
+---- the second pass decodes the node blocks only, looking up the locations of the nodes referenced by the kept ways; way centers are then computed at once
+- the protocol buffers messages of the blocks are decoded by a minimal decoder; packed arrays (delta coded node ids, coordinates and tags of dense nodes)
+  are decoded with numpy
+- .osm.xml files are streamed (iterparse) in the calling process, in the same two passes
+'''
+
+import zlib
+import itertools
+import struct
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+import pandas as pd
+
+import grid_tags
+
+
+# columns of the extracted layers, in order
+layer_columns = ["id", "lat", "lon", "type"]
+
+# OSM file and settings shared by the worker processes (see init_osm_worker)
+osm_state = {}
+
+
+def read_varint(buf, pos):
+    """
+    :param buf: bytearray
+    :return: value of the (unsigned) varint at pos in buf, and the position after it
+    """
+
+    result = 0
+    shift = 0
+
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def to_int64(value):
+    """
+    :return: signed value of a protocol buffers int64 varint
+    """
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_zigzag(value):
+    """
+    :return: signed value of a protocol buffers sint64 (zigzag coded) varint
+    """
+    return (value >> 1) ^ -(value & 1)
+
+
+def iter_fields(buf, pos, end):
+    """
+    :param buf: bytearray of protocol buffers messages
+    :return: generator of (field number, value) of the fields of the message in buf[pos:end]; varints as unsigned integers, length delimited fields
+             (strings, sub-messages, packed arrays) as their (start, end) in buf, fixed size fields as None
+    """
+
+    while pos < end:
+
+        key, pos = read_varint(buf, pos)
+        wire_type = key & 7
+
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 2:
+            size, pos = read_varint(buf, pos)
+            value = (pos, pos + size)
+            pos += size
+        elif wire_type == 1:
+            value = None
+            pos += 8
+        elif wire_type == 5:
+            value = None
+            pos += 4
+        else:
+            raise ValueError("Unsupported protocol buffers wire type " + str(wire_type))
+
+        yield key >> 3, value
+
+
+def get_packed_varints(buf, span, signed = False):
+    """
+    :param span: (start, end) of a packed array of varints in buf
+    :param signed: zigzag coded (sint32, sint64) varints
+    :return: int64 array of the values
+    """
+
+    data = np.frombuffer(buf, dtype = np.uint8, count = span[1] - span[0], offset = span[0])
+
+    if len(data) == 0:
+        return np.zeros(0, dtype = np.int64)
+
+    # each value ends with a byte < 0x80; its 7 bit groups are little endian
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((data & 0x7f).astype(np.uint64) << shifts.astype(np.uint64), starts)
+
+    if signed:
+        return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+    return values.astype(np.int64)
+
+
+def get_packed_list(buf, span):
+    """
+    :return: list of the (unsigned) values of a short packed array of varints (e.g. the tag keys of a way); faster than numpy for a few values
+    """
+
+    values = []
+
+    pos, end = span
+    while pos < end:
+        value, pos = read_varint(buf, pos)
+        values.append(value)
+
+    return values
+
+
+def get_delta_list(buf, span):
+    """
+    :return: list of the values of a short packed array of delta coded sint64 varints (e.g. the node refs of a way)
+    """
+
+    values = []
+
+    value = 0
+    for delta in get_packed_list(buf, span):
+        value += from_zigzag(delta)
+        values.append(value)
+
+    return values
+
+
+def get_blobs(osm_file):
+    """
+    :param osm_file: .osm.pbf file
+    :return: list of (offset, size) of the data blobs (OSMData) of the file
+    """
+
+    blobs = []
+
+    with open(osm_file, "rb") as o_f:
+
+        offset = 0
+
+        while True:
+
+            header_size = o_f.read(4)
+            if len(header_size) < 4:
+                break
+
+            header_size = struct.unpack(">I", header_size)[0]
+            header = bytearray(o_f.read(header_size))
+
+            blob_type = None
+            blob_size = 0
+            for field, value in iter_fields(header, 0, len(header)):
+                if field == 1:
+                    blob_type = bytes(header[value[0]:value[1]]).decode("utf-8")
+                elif field == 3:
+                    blob_size = value
+
+            offset += 4 + header_size
+
+            if blob_type == "OSMData":
+                blobs.append((offset, blob_size))
+
+            o_f.seek(blob_size, 1)
+            offset += blob_size
+
+    return blobs
+
+
+def read_blob(osm_file, blob):
+    """
+    :param osm_file: open .osm.pbf file
+    :param blob: (offset, size) of a data blob
+    :return: bytearray of the uncompressed block (a PrimitiveBlock message)
+    """
+
+    osm_file.seek(blob[0])
+    data = bytearray(osm_file.read(blob[1]))
+
+    for field, value in iter_fields(data, 0, len(data)):
+
+        if field == 1: # raw
+            return data[value[0]:value[1]]
+
+        if field == 3: # zlib
+            return bytearray(zlib.decompress(bytes(data[value[0]:value[1]])))
+
+        if field == 4: # lzma
+            import lzma
+            return bytearray(lzma.decompress(bytes(data[value[0]:value[1]])))
+
+        if field in (5, 6, 7):
+            raise ValueError("Unsupported .osm.pbf blob compression (bzip2, lz4 or zstd); recompress the file with zlib (e.g. osmium cat)")
+
+    raise ValueError("Empty .osm.pbf blob")
+
+
+def get_block_parts(buf):
+    """
+    :return: string table, list of the (start, end) of the primitive groups, and (granularity, lat offset, lon offset) of a PrimitiveBlock
+    """
+
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset = 100, 0, 0
+
+    for field, value in iter_fields(buf, 0, len(buf)):
+        if field == 1:
+            strings = [bytes(buf[s[0]:s[1]]).decode("utf-8") for f, s in iter_fields(buf, value[0], value[1])]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = to_int64(value)
+        elif field == 20:
+            lon_offset = to_int64(value)
+
+    return strings, groups, (granularity, lat_offset, lon_offset)
+
+
+def get_coordinates(raw, offset, granularity):
+    """
+    :return: coordinates (in degrees) of raw block coordinates, rounded to the block precision (7 decimals by default, as in Overpass responses)
+    """
+    return np.round(1e-9 * (offset + granularity * np.asarray(raw, dtype = np.float64)), 9 - len(str(granularity)) + 1)
+
+
+def in_bbox(bbox, lat, lon):
+    """
+    :param bbox: bounding box: SWNE (as in download_osm_structures.py), or None
+    :return: True (or boolean array) if the location is within the bounding box
+    """
+
+    if bbox is None:
+        return True
+
+    return (lat >= bbox[0]) & (lat <= bbox[2]) & (lon >= bbox[1]) & (lon <= bbox[3])
+
+
+def init_osm_worker(state):
+    osm_state.clear()
+    osm_state.update(state)
+    osm_state["file"] = open(state["osm_file"], "rb")
+
+
+def scan_block(blob):
+    """
+    first pass: decode a block and keep the elements of the layers; a process pool worker
+
+    :param blob: (offset, size) of a data blob of the file in osm_state
+    :return: whether the block has nodes, list of (layer, id, lat, lon, type) of the kept nodes (within the bounding box) and list of (layer, id, list of node refs, type) of the kept ways
+    """
+
+    rules = osm_state["rules"]
+    bbox = osm_state["bbox"]
+
+    buf = read_blob(osm_state["file"], blob)
+    strings, groups, (granularity, lat_offset, lon_offset) = get_block_parts(buf)
+
+    # string table indices of the keys of the rules; elements without any of these keys are not in any layer
+    key_ids = np.array([i for i, s in enumerate(strings) if s in rules["keys"]], dtype = np.int64)
+
+    has_nodes = False
+    nodes = []
+    ways = []
+
+    for group in groups:
+        for field, value in iter_fields(buf, group[0], group[1]):
+
+            if field == 1: # node
+
+                has_nodes = True
+
+                node_id, keys, vals, lat, lon = 0, [], [], 0, 0
+                for node_field, node_value in iter_fields(buf, value[0], value[1]):
+                    if node_field == 1:
+                        node_id = from_zigzag(node_value)
+                    elif node_field == 2:
+                        keys = get_packed_list(buf, node_value)
+                    elif node_field == 3:
+                        vals = get_packed_list(buf, node_value)
+                    elif node_field == 8:
+                        lat = from_zigzag(node_value)
+                    elif node_field == 9:
+                        lon = from_zigzag(node_value)
+
+                if not any(strings[k] in rules["keys"] for k in keys):
+                    continue
+
+                lat = float(get_coordinates([lat], lat_offset, granularity)[0])
+                lon = float(get_coordinates([lon], lon_offset, granularity)[0])
+
+                if in_bbox(bbox, lat, lon):
+                    tags = dict((strings[k], strings[v]) for k, v in zip(keys, vals))
+                    nodes.extend((layer, node_id, lat, lon, element_type) for layer, element_type in grid_tags.classify(tags, rules))
+
+            elif field == 2: # dense nodes
+
+                has_nodes = True
+
+                spans = dict(iter_fields(buf, value[0], value[1]))
+                if 10 not in spans:
+                    continue
+
+                # tags of all nodes: (key, value)* 0 per node
+                keys_vals = get_packed_varints(buf, spans[10])
+
+                ends = np.flatnonzero(keys_vals == 0)
+                starts = np.concatenate(([0], ends[:-1] + 1))
+
+                node_index = np.repeat(np.arange(len(ends)), ends - starts + 1)
+                is_key = ((np.arange(len(keys_vals)) - starts[node_index]) % 2 == 0) & (keys_vals != 0)
+
+                candidates = np.unique(node_index[is_key & np.in1d(keys_vals, key_ids)])
+                if len(candidates) == 0:
+                    continue
+
+                ids = np.cumsum(get_packed_varints(buf, spans[1], signed = True))
+                lats = get_coordinates(np.cumsum(get_packed_varints(buf, spans[8], signed = True)), lat_offset, granularity)
+                lons = get_coordinates(np.cumsum(get_packed_varints(buf, spans[9], signed = True)), lon_offset, granularity)
+
+                if bbox is not None:
+                    candidates = candidates[in_bbox(bbox, lats[candidates], lons[candidates])]
+
+                for i in candidates.tolist():
+                    kv = keys_vals[starts[i]:ends[i]].tolist()
+                    tags = dict((strings[k], strings[v]) for k, v in zip(kv[0::2], kv[1::2]))
+                    nodes.extend((layer, int(ids[i]), float(lats[i]), float(lons[i]), element_type) for layer, element_type in grid_tags.classify(tags, rules))
+
+            elif field == 3: # way
+
+                way_id, keys, vals, refs = 0, [], [], None
+                for way_field, way_value in iter_fields(buf, value[0], value[1]):
+                    if way_field == 1:
+                        way_id = to_int64(way_value)
+                    elif way_field == 2:
+                        keys = get_packed_list(buf, way_value)
+                    elif way_field == 3:
+                        vals = get_packed_list(buf, way_value)
+                    elif way_field == 8:
+                        refs = way_value
+
+                if refs is None or not any(strings[k] in rules["keys"] for k in keys):
+                    continue
+
+                tags = dict((strings[k], strings[v]) for k, v in zip(keys, vals))
+                way_layers = grid_tags.classify(tags, rules)
+
+                if way_layers:
+                    refs = get_delta_list(buf, refs)
+                    ways.extend((layer, way_id, refs, element_type) for layer, element_type in way_layers)
+
+    return has_nodes, nodes, ways
+
+
+def locate_block(blob):
+    """
+    second pass: decode the nodes of a block and keep the ones referenced by the kept ways (osm_state refs, sorted); a process pool worker
+
+    :return: arrays of ids, lats and lons of the referenced nodes of the block
+    """
+
+    refs = osm_state["refs"]
+
+    buf = read_blob(osm_state["file"], blob)
+    strings, groups, (granularity, lat_offset, lon_offset) = get_block_parts(buf)
+
+    ids, lats, lons = [], [], []
+
+    for group in groups:
+        for field, value in iter_fields(buf, group[0], group[1]):
+
+            if field == 1: # node
+                spans = dict(iter_fields(buf, value[0], value[1]))
+                ids.append([from_zigzag(spans.get(1, 0))])
+                lats.append([from_zigzag(spans.get(8, 0))])
+                lons.append([from_zigzag(spans.get(9, 0))])
+
+            elif field == 2: # dense nodes
+                spans = dict(iter_fields(buf, value[0], value[1]))
+                if 1 in spans:
+                    ids.append(np.cumsum(get_packed_varints(buf, spans[1], signed = True)))
+                    lats.append(np.cumsum(get_packed_varints(buf, spans[8], signed = True)))
+                    lons.append(np.cumsum(get_packed_varints(buf, spans[9], signed = True)))
+
+    if not ids:
+        return np.zeros(0, dtype = np.int64), np.zeros(0), np.zeros(0)
+
+    ids = np.concatenate(ids).astype(np.int64)
+    lats = np.concatenate(lats)
+    lons = np.concatenate(lons)
+
+    positions = np.minimum(np.searchsorted(refs, ids), max(len(refs) - 1, 0))
+    referenced = (refs[positions] == ids) if len(refs) else np.zeros(len(ids), dtype = bool)
+
+    return ids[referenced], get_coordinates(lats[referenced], lat_offset, granularity), get_coordinates(lons[referenced], lon_offset, granularity)
+
+
+def map_blocks(func, blobs, state, num_processes):
+    """
+    :return: list of the results of func (scan_block or locate_block) on the blobs, in file order
+    """
+
+    if num_processes > 1 and len(blobs) > 1:
+
+        pool = multiprocessing.Pool(processes = num_processes, initializer = init_osm_worker, initargs = (state,))
+        try:
+            results = pool.map(func, blobs, chunksize = max(1, len(blobs) // (8 * num_processes)))
+        finally:
+            pool.close()
+            pool.join()
+
+    else:
+        init_osm_worker(state)
+        try:
+            results = [func(blob) for blob in blobs]
+        finally:
+            osm_state["file"].close()
+
+    return results
+
+
+def get_way_centers(ways, node_ids, node_lats, node_lons):
+    """
+    :param ways: list of (layer, id, list of node refs, type) of ways
+    :param node_ids: sorted array of node ids
+    :return: arrays of the lats and lons of the centers of the bounding boxes of the ways' located nodes; nan if none of its nodes is located
+    """
+
+    if not ways:
+        return np.zeros(0), np.zeros(0)
+
+    lengths = np.array([len(way[2]) for way in ways], dtype = np.int64)
+    refs = np.fromiter(itertools.chain.from_iterable(way[2] for way in ways), dtype = np.int64, count = int(lengths.sum()))
+
+    positions = np.minimum(np.searchsorted(node_ids, refs), max(len(node_ids) - 1, 0))
+    located = (node_ids[positions] == refs) if len(node_ids) else np.zeros(len(refs), dtype = bool)
+
+    ref_lats = np.where(located, node_lats[positions] if len(node_ids) else np.nan, np.nan)
+    ref_lons = np.where(located, node_lons[positions] if len(node_ids) else np.nan, np.nan)
+
+    # ways without refs have no center
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    has_refs = lengths > 0
+
+    lats = np.full(len(ways), np.nan)
+    lons = np.full(len(ways), np.nan)
+
+    if has_refs.any():
+        starts = starts[has_refs]
+        lats[has_refs] = (np.fmin.reduceat(ref_lats, starts) + np.fmax.reduceat(ref_lats, starts)) / 2.
+        lons[has_refs] = (np.fmin.reduceat(ref_lons, starts) + np.fmax.reduceat(ref_lons, starts)) / 2.
+
+    return lats, lons
+
+
+def get_layer_records(rules, nodes, ways, way_lats, way_lons, bbox):
+    """
+    :return: dict of layer to pandas DataFrame of its elements (see layer_columns): the nodes, then the located ways (within the bounding box)
+    """
+
+    keep = np.logical_not(np.isnan(way_lats)) & in_bbox(bbox, np.nan_to_num(way_lats), np.nan_to_num(way_lons)) if len(ways) else np.zeros(0, dtype = bool)
+
+    records = {}
+
+    for layer, conditions, type_tags in rules["layers"]:
+
+        layer_nodes = [(node_id, lat, lon, element_type) for node_layer, node_id, lat, lon, element_type in nodes if node_layer == layer]
+        layer_ways = [(way[1], way_lats[i], way_lons[i], way[3]) for i, way in enumerate(ways) if way[0] == layer and keep[i]]
+
+        records[layer] = pd.DataFrame(layer_nodes + layer_ways, columns = layer_columns)
+
+    return records
+
+
+def read_pbf(osm_file, rules, bbox = None, num_processes = 1):
+    """
+    :param osm_file: .osm.pbf file
+    :param rules: rule table of the layers (see grid_tags.compile_rules)
+    :param bbox: optional bounding box: SWNE; nodes and way centers outside of it are dropped
+    :param num_processes: number of worker processes decoding the blocks
+    :return: dict of layer to pandas DataFrame of its elements (see layer_columns), in file order (nodes, then ways)
+    """
+
+    blobs = get_blobs(osm_file)
+
+    state = {"osm_file": osm_file, "rules": rules, "bbox": bbox}
+
+    nodes, ways, node_blobs = [], [], []
+    for blob, (has_nodes, block_nodes, block_ways) in zip(blobs, map_blocks(scan_block, blobs, state, num_processes)):
+        nodes.extend(block_nodes)
+        ways.extend(block_ways)
+        if has_nodes:
+            node_blobs.append(blob)
+
+    state["refs"] = np.unique(np.fromiter(itertools.chain.from_iterable(way[2] for way in ways), dtype = np.int64))
+
+    located = map_blocks(locate_block, node_blobs, state, num_processes) if ways else []
+
+    node_ids = np.concatenate([np.zeros(0, dtype = np.int64)] + [block[0] for block in located])
+    node_lats = np.concatenate([np.zeros(0)] + [block[1] for block in located])
+    node_lons = np.concatenate([np.zeros(0)] + [block[2] for block in located])
+
+    ordering = np.argsort(node_ids, kind = 'mergesort')
+    way_lats, way_lons = get_way_centers(ways, node_ids[ordering], node_lats[ordering], node_lons[ordering])
+
+    return get_layer_records(rules, nodes, ways, way_lats, way_lons, bbox)
+
+
+def iter_xml_elements(osm_file, tags):
+    """
+    :param tags: xml tags of the elements to stream (e.g. node, way)
+    :return: generator of the elements of an .osm.xml file; each element is cleared once the next one is read
+    """
+
+    context = ET.iterparse(osm_file, events = ("start", "end"))
+    event, root = next(context)
+
+    for event, element in context:
+        if event == "end" and element.tag in ("node", "way", "relation"):
+            if element.tag in tags:
+                yield element
+            root.clear()
+
+
+def read_xml(osm_file, rules, bbox = None):
+    """
+    :param osm_file: .osm.xml file
+    :return: dict of layer to pandas DataFrame of its elements (see layer_columns), in file order (nodes, then ways); see read_pbf
+    """
+
+    nodes, ways = [], []
+
+    for element in iter_xml_elements(osm_file, ("node", "way")):
+
+        tags = dict((tag.get("k"), tag.get("v")) for tag in element.iter("tag"))
+        if not tags:
+            continue
+
+        element_layers = grid_tags.classify(tags, rules)
+        if not element_layers:
+            continue
+
+        if element.tag == "node":
+            lat, lon = float(element.get("lat")), float(element.get("lon"))
+            if in_bbox(bbox, lat, lon):
+                nodes.extend((layer, int(element.get("id")), lat, lon, element_type) for layer, element_type in element_layers)
+        else:
+            refs = [int(nd.get("ref")) for nd in element.iter("nd")]
+            ways.extend((layer, int(element.get("id")), refs, element_type) for layer, element_type in element_layers)
+
+    refs = set(itertools.chain.from_iterable(way[2] for way in ways))
+
+    node_ids, node_lats, node_lons = [], [], []
+    if refs:
+        for element in iter_xml_elements(osm_file, ("node",)):
+            node_id = int(element.get("id"))
+            if node_id in refs:
+                node_ids.append(node_id)
+                node_lats.append(float(element.get("lat")))
+                node_lons.append(float(element.get("lon")))
+
+    node_ids = np.array(node_ids, dtype = np.int64)
+    ordering = np.argsort(node_ids, kind = 'mergesort')
+    way_lats, way_lons = get_way_centers(ways, node_ids[ordering], np.array(node_lats)[ordering], np.array(node_lons)[ordering])
+
+    return get_layer_records(rules, nodes, ways, way_lats, way_lons, bbox)
+
+
+def read_osm_file(osm_file, rules, bbox = None, num_processes = 1):
+    """
+    :param osm_file: .osm.pbf or .osm.xml (or .osm) file
+    :return: dict of layer to pandas DataFrame of its elements (see layer_columns); see read_pbf
+    """
+
+    if osm_file.endswith(".pbf"):
+        return read_pbf(osm_file, rules, bbox, num_processes)
+
+    return read_xml(osm_file, rules, bbox)
@@ -0,0 +1,442 @@
+'''
+- tiled, concurrent download of Open Street Map elements from an Overpass API endpoint (see download_osm_structures.py and download_osm_hospitals.py)
+- the bounding box is split into 4^tile_level quadtiles (quadkey order, i.e. nearby tiles are queried together); each tile is queried separately,
+  so that a failed or timed out request only costs one tile and no single query hits the Overpass element or memory limits
+- tiles are fetched concurrently by a bounded pool of threads sharing one pooled http session (keep-alive connections); requests rejected by a busy
+  endpoint (e.g. http 429 too many requests, 504 gateway timeout) or failing on the connection are retried with exponential backoff
+- each tile response is stored in a content-addressed on-disk cache: the file name is the sha1 of the query text (e.g. overpass_cache/3f/3f2a...json);
+  cached tiles are never requested again, so an interrupted download resumes where it stopped and plotting reads from the cache;
+  responses are written to a temporary file and then renamed, so that an interrupted run never leaves a partial tile in the cache
+- elements found in several tiles (e.g. nodes on tile borders, ways crossing tile borders) are kept once
+- elements are streamed from the cached tiles by an incremental json parser, one element at a time, and written one row at a time to the structures csv
+  file(s), so that memory stays constant however large the download (see iter_elements, save_layers_csv)
+- all layers (e.g. buildings, hospitals, schools) can be downloaded by one union query per tile; each element is then classified once into its layers
+  and written to the csv file of each layer (see save_layers_csv, grid_tags.py)
+- the endpoint is configurable (overpass_url), e.g. a local stand-in Overpass server for testing or a mirror
+'''
+
+import io
+import os
+import re
+import json
+import time
+import logging
+import hashlib
+import tempfile
+import multiprocessing.pool
+
+import requests
+
+import grid_tags
+
+
+# public Overpass API endpoint
+overpass_url = "https://overpass-api.de/api/interpreter"
+
+# http statuses of a busy or overloaded endpoint; the request is retried
+retry_statuses = (429, 500, 502, 503, 504)
+
+# separators between the elements of a json array
+json_separators = re.compile(r"[\s,]*")
+
+
+def get_quadtiles(bbox, tile_level):
+    """
+    :param bbox: bounding box: SWNE (as in download_osm_structures.py)
+    :param tile_level: number of quadtile splits; 4^tile_level tiles
+    :return: list of (quadkey, tile bounding box SWNE) of the tiles, in quadkey order; quadkey digits are 0 (SW), 1 (SE), 2 (NW), 3 (NE)
+    """
+
+    tiles = [("", tuple(bbox))]
+
+    for level in range(tile_level):
+
+        split_tiles = []
+        for quadkey, (s, w, n, e) in tiles:
+
+            lat_mid = (s + n) / 2.0
+            lon_mid = (w + e) / 2.0
+
+            split_tiles.append((quadkey + "0", (s, w, lat_mid, lon_mid)))
+            split_tiles.append((quadkey + "1", (s, lon_mid, lat_mid, e)))
+            split_tiles.append((quadkey + "2", (lat_mid, w, n, lon_mid)))
+            split_tiles.append((quadkey + "3", (lat_mid, lon_mid, n, e)))
+
+        tiles = split_tiles
+
+    return tiles
+
+
+def get_tile_query(query, timeout = 180):
+    """
+    :param query: Overpass QL query (e.g. download_osm_structures.query)
+    :param timeout: server side query timeout (in s)
+    :return: full Overpass QL query text requesting a json response
+    """
+    return "[out:json][timeout:%d];%s" % (timeout, query)
+
+
+def get_cache_path(cache_dir, query_text):
+    """
+    :return: cache file path of the response to a query: cache_dir/<first 2 hex digits>/<sha1 of the query text>.json
+    """
+
+    key = hashlib.sha1(query_text.encode("utf-8")).hexdigest()
+
+    return os.path.join(cache_dir, key[:2], key + ".json")
+
+
+def check_response(content):
+    """
+    :param content: Overpass json response (bytes)
+    :return: the parsed response; raises ValueError if it is not valid json or the query failed on the server (e.g. timed out or ran out of memory)
+    """
+
+    response = json.loads(content.decode("utf-8"))
+
+    if "elements" not in response:
+        raise ValueError("Overpass response without elements")
+
+    # a query failing on the server is still answered with http 200 and a partial response; the remark tells
+    if "runtime error" in response.get("remark", ""):
+        raise ValueError("Overpass " + response["remark"])
+
+    return response
+
+
+def write_cache(path, content):
+    """
+    write a response to the cache; the tile only appears in the cache once fully written
+    """
+
+    cache_subdir = os.path.dirname(path)
+    if not os.path.exists(cache_subdir):
+        try:
+            os.makedirs(cache_subdir)
+        except OSError:
+            # created by another thread in between
+            if not os.path.isdir(cache_subdir):
+                raise
+
+    tmp_fd, tmp_path = tempfile.mkstemp(suffix = ".tmp", dir = cache_subdir)
+    with os.fdopen(tmp_fd, "wb") as c_f:
+        c_f.write(content)
+
+    if hasattr(os, "replace"):
+        os.replace(tmp_path, path)
+    else:
+        os.rename(tmp_path, path)
+
+
+def create_session(num_workers):
+    """
+    :return: http session with a connection pool of num_workers keep-alive connections (shared by the download threads)
+    """
+
+    session = requests.Session()
+
+    adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = num_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def get_retry_delay(attempt, backoff, max_backoff, retry_after = None):
+    """
+    :return: delay (in s) before a retry: the server's Retry-After (in s) if given, otherwise backoff * 2^attempt; at most max_backoff
+    """
+
+    delay = backoff * 2 ** attempt
+
+    if retry_after is not None:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            pass
+
+    return min(delay, max_backoff)
+
+
+def fetch_query(session, url, query_text, max_retries = 5, backoff = 2.0, max_backoff = 120.0, request_timeout = 300):
+    """
+    :param session: http session (see create_session)
+    :param url: Overpass endpoint (see overpass_url)
+    :param query_text: full Overpass QL query text (see get_tile_query)
+    :param max_retries: max number of retries of a failed request
+    :param backoff: delay (in s) before the first retry; doubled on each retry
+    :param request_timeout: http connection and read timeout (in s)
+    :return: response content (bytes); raises the last error if all retries fail
+    """
+
+    for attempt in range(max_retries + 1):
+
+        retry_after = None
+
+        try:
+            response = session.post(url, data = {"data": query_text}, timeout = request_timeout)
+
+            if response.status_code in retry_statuses:
+                retry_after = response.headers.get("Retry-After")
+                raise requests.exceptions.HTTPError("http " + str(response.status_code) + " from " + url)
+
+            response.raise_for_status()
+
+            check_response(response.content)
+
+            return response.content
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.HTTPError, ValueError) as e:
+
+            # client errors (e.g. http 400 on a malformed query) are not retried
+            if isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code not in retry_statuses:
+                raise
+
+            if attempt == max_retries:
+                raise
+
+            delay = get_retry_delay(attempt, backoff, max_backoff, retry_after)
+            logging.info("Overpass request failed (" + str(e) + "); retrying in " + str(delay) + " s")
+            time.sleep(delay)
+
+
+def fetch_tiles(query_texts, cache_dir, url = overpass_url, num_workers = 2, max_retries = 5, backoff = 2.0):
+    """
+    fetch the queries that are not cached yet, num_workers at a time, and cache their responses
+
+    :param query_texts: list of full Overpass QL query texts (see get_tile_query)
+    :param cache_dir: tile cache directory
+    :param num_workers: max number of concurrent requests (the public Overpass endpoint serves a couple of concurrent requests per client)
+    :return: list of the cache paths of the queries
+    """
+
+    paths = [get_cache_path(cache_dir, query_text) for query_text in query_texts]
+
+    # (path, query text) of the tiles not cached yet; identical queries are fetched once
+    missing = list(dict((path, query_text) for query_text, path in zip(query_texts, paths) if not os.path.exists(path)).items())
+
+    if len(missing) < len(query_texts):
+        logging.info(str(len(query_texts) - len(missing)) + " of " + str(len(query_texts)) + " tiles read from the cache " + cache_dir)
+
+    if missing:
+
+        session = create_session(num_workers)
+
+        def fetch_tile(tile):
+            path, query_text = tile
+            write_cache(path, fetch_query(session, url, query_text, max_retries, backoff))
+            return path
+
+        pool = multiprocessing.pool.ThreadPool(min(num_workers, len(missing)))
+
+        try:
+            for i, path in enumerate(pool.imap_unordered(fetch_tile, missing)):
+                logging.info("Downloaded tile " + str(i + 1) + " of " + str(len(missing)))
+        finally:
+            pool.terminate()
+            session.close()
+
+    return paths
+
+
+def download_tiles(bbox, get_query, cache_dir, tile_level = 3, url = overpass_url, num_workers = 2, max_retries = 5, backoff = 2.0, timeout = 180):
+    """
+    :param bbox: bounding box: SWNE
+    :param get_query: function of a tile bounding box (SWNE) returning its Overpass QL query (e.g. lambda tile_bbox: query(tile_bbox, 'way', properties['building']))
+    :param cache_dir: tile cache directory
+    :param tile_level: number of quadtile splits of the bounding box; 4^tile_level tiles
+    :param timeout: server side query timeout of a tile (in s)
+    :return: list of (tile bounding box SWNE, cache path) of the tiles, in quadkey order, once fetched (or found in the cache); see iter_elements
+    """
+
+    tiles = get_quadtiles(bbox, tile_level)
+    query_texts = [get_tile_query(get_query(tile_bbox), timeout) for quadkey, tile_bbox in tiles]
+
+    paths = fetch_tiles(query_texts, cache_dir, url, num_workers, max_retries, backoff)
+
+    return [(tile_bbox, path) for (quadkey, tile_bbox), path in zip(tiles, paths)]
+
+
+def iter_json_elements(path, chunk_size = 1 << 16):
+    """
+    incremental parsing of the top level elements array of an Overpass json response; memory is bounded by chunk_size and the largest element,
+    however large the response
+
+    :param path: Overpass json response file (e.g. a tile in the cache)
+    :param chunk_size: number of characters read at a time
+    :return: generator of the elements (dicts), in file order
+    """
+
+    decoder = json.JSONDecoder()
+
+    with io.open(path, "r", encoding = "utf-8") as j_f:
+
+        # skip the header (version, generator, osm3s) up to the opening bracket of the elements array
+        buf = ""
+        while True:
+            chunk = j_f.read(chunk_size)
+            if not chunk:
+                return
+
+            buf += chunk
+
+            key_pos = buf.find('"elements"')
+            start = buf.find("[", key_pos) if key_pos >= 0 else -1
+            if start >= 0:
+                pos = start + 1
+                break
+
+        while True:
+
+            # skip the separators between elements
+            pos = json_separators.match(buf, pos).end()
+
+            if pos < len(buf) and buf[pos] == "]":
+                return
+
+            element = None
+            if pos < len(buf):
+                try:
+                    element, pos = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    pass
+
+            if element is None:
+
+                # element cut by the end of the buffer; keep its beginning and read on
+                chunk = j_f.read(chunk_size)
+                if not chunk:
+                    raise ValueError("Truncated Overpass response " + path)
+
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+
+            yield element
+
+            if pos > chunk_size:
+                buf = buf[pos:]
+                pos = 0
+
+
+def get_location(element):
+    """
+    :return: (lat, lon) of an element: of a node, or of the center of a way (see query in download_osm_structures.py); (None, None) if unknown
+    """
+
+    location = element.get("center", element)
+
+    if "lat" in location and "lon" in location:
+        return location["lat"], location["lon"]
+
+    return None, None
+
+
+def is_tile_owner(tile_bbox, bbox, lat, lon):
+    """
+    :return: True if the tile owns a location; tiles own their half-open extent [south, north) x [west, east), closed on the north and east borders of the bounding box,
+             and locations outside the bounding box (e.g. centers of ways crossing its border) are owned by the tile of the closest location within it;
+             every location is owned by exactly one tile
+    """
+
+    s, w, n, e = tile_bbox
+
+    lat = min(max(lat, bbox[0]), bbox[2])
+    lon = min(max(lon, bbox[1]), bbox[3])
+
+    return (s <= lat < n or lat == n == bbox[2]) and (w <= lon < e or lon == e == bbox[3])
+
+
+def iter_elements(bbox, tiles):
+    """
+    stream the elements of the tiles (see download_tiles) from the cache, each element once, in tile (quadkey) order
+
+    - an element is found in each tile it intersects (e.g. nodes on tile borders, ways crossing tile borders), but is usually only kept in the tile that owns its location
+      (see is_tile_owner), so that no set of all elements is kept in memory
+    - a way can miss the tile owning its center (e.g. a large L-shaped way whose nodes are all in other tiles); the elements found in tiles that do not own them
+      (only those along the tile borders) are found in a first pass over the tiles, and kept once
+    :return: generator of the elements
+    """
+
+    # (type, id) of the elements found in tiles that do not own them; a single tile holds each element once
+    border_keys = set()
+
+    for tile_bbox, path in (tiles if len(tiles) > 1 else []):
+        for element in iter_json_elements(path):
+            lat, lon = get_location(element)
+            if lat is None or not is_tile_owner(tile_bbox, bbox, lat, lon):
+                border_keys.add((element.get("type"), element["id"]))
+
+    kept_border_keys = set()
+
+    for tile_bbox, path in tiles:
+        for element in iter_json_elements(path):
+
+            key = (element.get("type"), element["id"])
+
+            if key in border_keys:
+                if key in kept_border_keys:
+                    continue
+                kept_border_keys.add(key)
+
+            # otherwise found in a single tile, owning it
+            yield element
+
+
+def to_csv_field(value):
+    """
+    :return: csv field of a value, quoted if needed (e.g. tag values with commas)
+    """
+
+    field = u"" if value is None else u"%s" % value
+
+    if any(c in field for c in u",\"\r\n"):
+        field = u'"' + field.replace(u'"', u'""') + u'"'
+
+    return field
+
+
+def save_layers_csv(layer_files, elements, rules):
+    """
+    classify each element with a known location once (see grid_tags.classify) and write it to the csv file of each of its layers, one row at a time
+    (e.g. structures_households.csv, structures_hospitals.csv); layers with type tags get a type column (id,lat,lon,type), the others id,lat,lon
+
+    :param layer_files: dict of layer to its csv file path; layers of the rules without a file are not written
+    :param elements: iterable of elements (e.g. iter_elements of a union query of all layers)
+    :param rules: rule table of the layers (see grid_tags.compile_rules)
+    :return: dict of layer to number of rows written
+    """
+
+    typed_layers = set(layer for layer, conditions, type_tags in rules["layers"] if type_tags)
+
+    files = {}
+    num_rows = dict((layer, 0) for layer in layer_files)
+
+    try:
+        for layer in sorted(layer_files):
+            files[layer] = io.open(layer_files[layer], "w", encoding = "utf-8")
+            files[layer].write(u"id,lat,lon,type\n" if layer in typed_layers else u"id,lat,lon\n")
+
+        for element in elements:
+
+            lat, lon = get_location(element)
+            if lat is None:
+                continue
+
+            for layer, element_type in grid_tags.classify(element.get("tags"), rules):
+
+                if layer not in files:
+                    continue
+
+                # use OSM id; any different unique id would work
+                if layer in typed_layers:
+                    files[layer].write(u"%s,%s,%s,%s\n" % (element["id"], lat, lon, to_csv_field(element_type)))
+                else:
+                    files[layer].write(u"%s,%s,%s\n" % (element["id"], lat, lon))
+                num_rows[layer] += 1
+
+    finally:
+        for s_f in files.values():
+            s_f.close()
+
+    return num_rows
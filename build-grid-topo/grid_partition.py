@@ -0,0 +1,188 @@
+'''
+- population weighted partitioning of the grid nodes across the cores (MPI ranks) of a multi-core DTK simulation, and the DTK load balance file
+  (see ../sims-grid-topo/input/generate_load_balance.py)
+- the simulation work of a node scales with its population (number of simulated individuals), and individuals migrating along grid graph edges
+  between nodes on different cores are communicated between the cores; a good partition balances population and cuts few edges
+- nodes are partitioned by recursive coordinate bisection (RCB): the nodes of a part are split across the longer extent of the part, at the population
+  weighted position that splits the population in proportion to the numbers of cores on each side, until there is one part per core;
+  the parts are compact patches of the grid, so that most migration edges stay within a core
+- the RCB partition is then refined along the part borders (greedy boundary refinement, as in the refinement phase of multilevel graph partitioning):
+  border nodes move to the neighboring part they have the most edges to, if that reduces the edge cut and keeps every part within a population imbalance limit
+- the load balance file is the legacy DTK binary format: number of nodes (uint32), node ids (uint32 each) and per node fractions (float32 each);
+  DTK places a node on core int(fraction * number of cores)
+'''
+
+import numpy as np
+
+import pandas as pd
+
+
+# columns of the per core partition report, in order
+report_columns = ["core", "num_nodes", "pop", "work_share", "cut_edges", "boundary_nodes"]
+
+
+def recursive_bisection(lons, lats, weights, num_parts):
+    """
+    :param lons: array of node longitudes
+    :param lats: array of node latitudes
+    :param weights: array of node weights (e.g. population)
+    :param num_parts: number of parts (cores)
+    :return: array of the part (0 to num_parts - 1) of each node
+    """
+
+    lons = np.asarray(lons, dtype = np.float64)
+    lats = np.asarray(lats, dtype = np.float64)
+    weights = np.asarray(weights, dtype = np.float64)
+
+    # distances along longitudes shrink with latitude
+    xs = lons * np.cos(np.radians(lats.mean())) if len(lats) else lons
+
+    parts = np.zeros(len(lons), dtype = np.int64)
+
+    # (nodes, first part, number of parts) still to split
+    splits = [(np.arange(len(lons)), 0, num_parts)]
+
+    while splits:
+
+        nodes, first_part, k = splits.pop()
+
+        if k == 1 or len(nodes) == 0:
+            parts[nodes] = first_part
+            continue
+
+        k_low = k // 2
+
+        # split along the longer extent of the nodes
+        x, y = xs[nodes], lats[nodes]
+        coords = x if x.max() - x.min() >= y.max() - y.min() else y
+
+        ordering = np.argsort(coords, kind = 'mergesort')
+        cum_weights = np.cumsum(weights[nodes][ordering])
+
+        # number of nodes on the low side, with the cumulative weight closest to the low side share
+        target = cum_weights[-1] * k_low / float(k)
+        num_low = np.searchsorted(cum_weights, target)
+        if num_low < len(nodes) and cum_weights[num_low] - target < target - (cum_weights[num_low - 1] if num_low > 0 else 0):
+            num_low += 1
+
+        splits.append((nodes[ordering[:num_low]], first_part, k_low))
+        splits.append((nodes[ordering[num_low:]], first_part + k_low, k - k_low))
+
+    return parts
+
+
+def get_boundary_nodes(parts, indptr, indices):
+    """
+    :return: boolean array of the nodes with an edge to a node in another part
+    """
+
+    src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    cut = parts[src] != parts[indices]
+
+    return np.bincount(src[cut], minlength = len(parts)) > 0
+
+
+def refine_partition(parts, indptr, indices, weights, num_parts, max_imbalance = 1.05, num_passes = 4):
+    """
+    :param parts: array of the part of each node (e.g. recursive_bisection)
+    :param indptr: CSR row pointers of the grid graph (see grid_graph.to_csr); both edge directions
+    :param indices: CSR column indices of the grid graph
+    :param weights: array of node weights (e.g. population)
+    :param num_parts: number of parts
+    :param max_imbalance: max ratio of a part weight to the mean part weight; parts already above it (e.g. due to a single heavy node) only lose nodes
+    :param num_passes: max number of passes over the border nodes
+    :return: array of the refined part of each node
+    """
+
+    parts = np.array(parts, dtype = np.int64)
+    weights = np.asarray(weights, dtype = np.float64)
+
+    part_weights = np.bincount(parts, weights = weights, minlength = num_parts)
+    max_part_weight = max_imbalance * weights.sum() / num_parts
+
+    for p in range(num_passes):
+
+        moved = 0
+
+        for node in np.flatnonzero(get_boundary_nodes(parts, indptr, indices)):
+
+            neighbors = indices[indptr[node]:indptr[node + 1]]
+            neighbors = neighbors[neighbors != node]
+
+            part = parts[node]
+
+            links = np.bincount(parts[neighbors], minlength = num_parts)
+            own_links = links[part]
+            links[part] = -1
+
+            target = links.argmax()
+
+            if links[target] > own_links and part_weights[target] + weights[node] <= max_part_weight:
+                parts[node] = target
+                part_weights[part] -= weights[node]
+                part_weights[target] += weights[node]
+                moved += 1
+
+        if moved == 0:
+            break
+
+    return parts
+
+
+def get_partition_report(parts, indptr, indices, weights, num_parts):
+    """
+    :return: pandas DataFrame report of the partition, one row per part (see report_columns): number of nodes, population, share of the total work (population),
+             number of (directed) edges to nodes on other cores and number of nodes with such edges; and the total number of cut (undirected) edges
+    """
+
+    weights = np.asarray(weights, dtype = np.float64)
+
+    src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    cut = parts[src] != parts[indices]
+
+    part_weights = np.bincount(parts, weights = weights, minlength = num_parts)
+
+    report = pd.DataFrame({
+                            "core": np.arange(num_parts),
+                            "num_nodes": np.bincount(parts, minlength = num_parts),
+                            "pop": part_weights,
+                            "work_share": part_weights / max(part_weights.sum(), 1e-12),
+                            "cut_edges": np.bincount(parts[src[cut]], minlength = num_parts),
+                            "boundary_nodes": np.bincount(parts, weights = get_boundary_nodes(parts, indptr, indices), minlength = num_parts).astype(np.int64)
+                        }, columns = report_columns)
+
+    return report, int(cut.sum()) // 2
+
+
+def save_load_balance(path, node_ids, parts, num_parts):
+    """
+    :param path: load balance file path (e.g. Haiti_Grand_Anse_test_loadbalance_24procs.bin)
+    :param node_ids: array of DTK node ids
+    :param parts: array of the part (core) of each node
+    :param num_parts: number of cores
+    """
+
+    node_ids = np.asarray(node_ids, dtype = np.uint32)
+    parts = np.asarray(parts, dtype = np.int64)
+
+    # nodes in core order; each node's fraction is the middle of its core's range, so that int(fraction * num_parts) is robust to float32 rounding
+    ordering = np.lexsort((node_ids, parts))
+    fractions = ((parts[ordering] + 0.5) / num_parts).astype(np.float32)
+
+    with open(path, "wb") as lb_f:
+        np.array([len(node_ids)], dtype = np.uint32).tofile(lb_f)
+        node_ids[ordering].tofile(lb_f)
+        fractions.tofile(lb_f)
+
+
+def load_load_balance(path, num_parts):
+    """
+    :return: arrays of the node ids and of their parts (cores) in a load balance file
+    """
+
+    with open(path, "rb") as lb_f:
+        num_nodes = int(np.fromfile(lb_f, dtype = np.uint32, count = 1)[0])
+        node_ids = np.fromfile(lb_f, dtype = np.uint32, count = num_nodes)
+        fractions = np.fromfile(lb_f, dtype = np.float32, count = num_nodes)
+
+    return node_ids, (fractions * num_parts).astype(np.int64)
@@ -0,0 +1,87 @@
+'''
+- placement of points of interest (POI; e.g. hospitals, schools, markets) on the grid (see poi_layers in build_grid_topo_w_hospitals.py)
+- all POI of a layer are mapped to grid cells at once by binary search of their coordinates in the cell edges (np.searchsorted),
+  with the bins of np.histogram2d (half open, except for the last one), so that POI fall into the same cells as households at the same location
+- a build can place any number of POI layers (csv files with required columns lat,lon,type); each layer is saved labeled by the node of its grid cell
+  (e.g. hospitals_node_labeled.csv), "No cell" for POI outside of the grid or in cells that are not nodes
+'''
+
+import numpy as np
+
+import pandas as pd
+
+
+# node label of POI not within a node
+no_cell_label = "No cell"
+
+
+def load_poi_layer(csv_path, bbox):
+    """
+    :param csv_path: POI csv file with required columns lat,lon,type (e.g. structures_hospitals.csv)
+    :param bbox: bounding box (x_min, x_max, y_min, y_max)
+    :return: pandas DataFrame of the POI records within the bounding box
+    """
+
+    x_min, x_max, y_min, y_max = bbox
+
+    records = pd.read_csv(csv_path)
+
+    return records[(records.lon > x_min) & (records.lon < x_max) & (records.lat > y_min) & (records.lat < y_max)]
+
+
+def get_bin_indices(values, edges):
+    """
+    :param values: array of point coordinates along one axis
+    :param edges: sorted array of cell edges along the axis (need not be uniformly spaced)
+    :return: array of cell indices; bins are half open except for the last one, as in np.histogram2d; -1 for values outside the edges
+    """
+
+    values = np.asarray(values, dtype = np.float64)
+
+    idxs = np.searchsorted(edges, values, 'right') - 1
+
+    # the last edge belongs to the last cell
+    idxs[values == edges[-1]] = len(edges) - 2
+    idxs[(values < edges[0]) | (values > edges[-1])] = -1
+
+    return idxs
+
+
+def place_points(lons, lats, xedges, yedges):
+    """
+    :return: arrays of cell indices along the x and y axis of each point and boolean array of whether the point is within the grid
+    """
+
+    idx_x = get_bin_indices(lons, xedges)
+    idx_y = get_bin_indices(lats, yedges)
+
+    return idx_x, idx_y, (idx_x >= 0) & (idx_y >= 0)
+
+
+def get_poi_node_labels(idx_x, idx_y, placed, node_keys, node_labels, num_cells_y):
+    """
+    :param idx_x: array of POI cell indices along the x axis (see place_points)
+    :param idx_y: array of POI cell indices along the y axis
+    :param placed: boolean array of whether each POI is within the grid
+    :param node_keys: sorted array of the cell keys (idx_x * num_cells_y + idx_y) of the nodes
+    :param node_labels: array of node labels
+    :return: list of the (string) node label of each POI; no_cell_label for POI not within a node
+    """
+
+    poi_keys = np.asarray(idx_x, dtype = np.int64) * num_cells_y + np.asarray(idx_y, dtype = np.int64)
+
+    pos = np.minimum(np.searchsorted(node_keys, poi_keys), max(len(node_keys) - 1, 0))
+    in_node = placed & (node_keys[pos] == poi_keys) if len(node_keys) else np.zeros(len(poi_keys), dtype = bool)
+
+    return [str(node_labels[p]) if in_node[i] else no_cell_label for i, p in enumerate(pos)]
+
+
+def save_poi_layer(csv_path, records, poi_node_labels):
+    """
+    :param csv_path: output csv file (e.g. hospitals_node_labeled.csv) with columns lat,lon,type,node_label
+    :param records: pandas DataFrame of POI records (see load_poi_layer)
+    :param poi_node_labels: node label of each POI (see get_poi_node_labels)
+    """
+
+    labeled = pd.DataFrame({"lat": records.lat.values, "lon": records.lon.values, "type": records.type.values, "node_label": poi_node_labels}, columns = ["lat", "lon", "type", "node_label"])
+    labeled.to_csv(csv_path, index = False)
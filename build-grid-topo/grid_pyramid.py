@@ -0,0 +1,66 @@
+'''
+- multi-resolution grid pyramid: structures are binned once at the finest resolution and coarser levels are obtained by sum-pooling blocks of
+  factor x factor cells of the finest grid (see build_grid_topo_pyramid.py)
+- all levels share the origin of the finest grid, so that each coarse cell is exactly the union of factor x factor finest cells (i.e. levels are aligned)
+- levels are sparse (see grid_binning.sparse_histogram2d): sorted integer cell keys (idx_x * num_cells_y + idx_y) and (weighted) counts of occupied cells
+'''
+
+import numpy as np
+
+
+def get_pyramid_factors(cell_sizes):
+    """
+    :param cell_sizes: list of cell sizes (in m), e.g. [50, 100, 250, 500]
+    :return: finest cell size and list of (cell size, pooling factor) pairs sorted by cell size
+    """
+
+    finest = min(cell_sizes)
+
+    factors = []
+    for cell_size in sorted(set(cell_sizes)):
+        if cell_size % finest != 0:
+            raise ValueError("Pyramid cell size " + str(cell_size) + " is not a multiple of the finest cell size " + str(finest))
+        factors.append((cell_size, int(cell_size // finest)))
+
+    return finest, factors
+
+
+def get_pooled_edges(edges, factor):
+    """
+    :param edges: array of uniformly spaced cell edges of the finest grid along one axis
+    :param factor: pooling factor
+    :return: array of cell edges of the pooled grid along the axis; the last pooled cell may extend beyond the finest grid
+    """
+
+    num_cells = len(edges) - 1
+    num_pooled_cells = int(np.ceil(num_cells / float(factor)))
+    step = (edges[-1] - edges[0]) / float(num_cells)
+
+    # reuse the finest edges where they coincide with pooled edges, so that a factor of 1 reproduces the finest grid exactly
+    fine_idxs = np.arange(num_pooled_cells + 1) * factor
+
+    return np.where(fine_idxs <= num_cells, edges[np.minimum(fine_idxs, num_cells)], edges[0] + fine_idxs * step)
+
+
+def pool_level(cell_keys, cell_counts, xedges, yedges, factor):
+    """
+    :param cell_keys: sorted occupied cell keys of the finest grid
+    :param cell_counts: (weighted) counts of the occupied cells of the finest grid
+    :param xedges: cell edges of the finest grid along the x axis
+    :param yedges: cell edges of the finest grid along the y axis
+    :param factor: pooling factor
+    :return: sorted occupied cell keys, counts, xedges, yedges of the pooled grid
+    """
+
+    num_cells_y = len(yedges) - 1
+
+    pooled_xedges = get_pooled_edges(xedges, factor)
+    pooled_yedges = get_pooled_edges(yedges, factor)
+    pooled_num_cells_y = len(pooled_yedges) - 1
+
+    pooled_keys = (cell_keys // num_cells_y // factor) * pooled_num_cells_y + (cell_keys % num_cells_y) // factor
+
+    pooled_cell_keys, inverse = np.unique(pooled_keys, return_inverse = True)
+    pooled_cell_counts = np.bincount(inverse, weights = cell_counts, minlength = len(pooled_cell_keys))
+
+    return pooled_cell_keys, pooled_cell_counts, pooled_xedges, pooled_yedges
@@ -0,0 +1,213 @@
+'''
+- adaptive quadtree tessellation of the grid (see build_grid_topo_quadtree.py): structures are binned once at the finest (minimum) cell size and
+  coarser levels are obtained by pooling blocks of 2^level x 2^level finest cells, aligned to the finest grid origin (as in grid_pyramid.py)
+- starting from the coarsest level, cells with more (weighted) structures than a split limit are split into their occupied quadrants, down to the
+  finest level; the cells that are not split are the leaves, i.e. the variable resolution cells of the grid (small cells in towns, large cells in sparse areas)
+- leaves are identified by their level and indices (idx_x, idx_y) on the grid of their level; a leaf spans finest cells
+  [idx_x * 2^level, (idx_x + 1) * 2^level) x [idx_y * 2^level, (idx_y + 1) * 2^level)
+- leaves are connected if they share a face (edge); since quadtree cells are aligned, the face of a leaf towards a larger (or equal) neighbor lies
+  within the neighbor's face, so all face neighbors are found by probing the finest cell next to one corner of each face of each leaf;
+  migration_radius > 1 connects leaves within that many face hops; edge weights are vincenty distances between leaf centroids
+'''
+
+import numpy as np
+
+from scipy.sparse import csr_matrix
+
+from grid_geodesy import vincenty_km
+
+
+def get_level_cells(fine_x, fine_y, counts, level, num_cells_y):
+    """
+    :param fine_x: array of occupied finest cell indices along the x axis
+    :param fine_y: array of occupied finest cell indices along the y axis
+    :param counts: array of (weighted) counts of the occupied finest cells
+    :param level: quadtree level (0 is the finest grid)
+    :param num_cells_y: number of finest cells along the y axis (key stride)
+    :return: arrays of the indices along the x and y axis and the pooled counts of the occupied cells of the level, sorted by key
+    """
+
+    keys = (fine_x >> level) * num_cells_y + (fine_y >> level)
+
+    level_keys, inverse = np.unique(keys, return_inverse = True)
+    level_counts = np.bincount(inverse.ravel(), weights = counts, minlength = len(level_keys))
+
+    return level_keys // num_cells_y, level_keys % num_cells_y, level_counts
+
+
+def build_quadtree(cell_keys, cell_counts, num_cells_y, num_levels, split_limit):
+    """
+    :param cell_keys: sorted occupied cell keys (idx_x * num_cells_y + idx_y) of the finest grid (e.g. grid_binning.sparse_histogram2d)
+    :param cell_counts: (weighted) counts of the occupied cells of the finest grid
+    :param num_cells_y: number of finest cells along the y axis
+    :param num_levels: number of quadtree levels; the coarsest cells span 2^(num_levels - 1) finest cells along each axis
+    :param split_limit: cells with a higher (weighted) count are split into their quadrants (unless at the finest level)
+    :return: arrays of the levels, indices along the x and y axis (on the grid of their level) and counts of the leaves,
+             ordered by the finest cell key of their lower left corner
+    """
+
+    cell_keys = np.asarray(cell_keys, dtype = np.int64)
+    cell_counts = np.asarray(cell_counts, dtype = np.float64)
+
+    fine_x = cell_keys // num_cells_y
+    fine_y = cell_keys % num_cells_y
+
+    top = num_levels - 1
+
+    leaf_levels = []
+    leaf_x = []
+    leaf_y = []
+    leaf_counts = []
+
+    # candidate cells of the current level; all occupied cells of the coarsest level
+    cand_x, cand_y, cand_counts = get_level_cells(fine_x, fine_y, cell_counts, top, num_cells_y)
+
+    for level in range(top, -1, -1):
+
+        split = cand_counts > split_limit if level > 0 else np.zeros(len(cand_counts), dtype = bool)
+        leaf = np.logical_not(split)
+
+        leaf_levels.append(np.repeat(level, leaf.sum()))
+        leaf_x.append(cand_x[leaf])
+        leaf_y.append(cand_y[leaf])
+        leaf_counts.append(cand_counts[leaf])
+
+        if level == 0:
+            break
+
+        # the occupied quadrants of the split cells are the candidates of the next level
+        split_keys = cand_x[split] * num_cells_y + cand_y[split]
+
+        child_x, child_y, child_counts = get_level_cells(fine_x, fine_y, cell_counts, level - 1, num_cells_y)
+        parent_keys = (child_x >> 1) * num_cells_y + (child_y >> 1)
+
+        pos = np.minimum(np.searchsorted(split_keys, parent_keys), max(len(split_keys) - 1, 0))
+        in_split = split_keys[pos] == parent_keys if len(split_keys) else np.zeros(len(parent_keys), dtype = bool)
+
+        cand_x, cand_y, cand_counts = child_x[in_split], child_y[in_split], child_counts[in_split]
+
+    leaf_levels = np.concatenate(leaf_levels)
+    leaf_x = np.concatenate(leaf_x)
+    leaf_y = np.concatenate(leaf_y)
+    leaf_counts = np.concatenate(leaf_counts)
+
+    ordering = np.argsort((leaf_x << leaf_levels) * num_cells_y + (leaf_y << leaf_levels), kind = 'mergesort')
+
+    return leaf_levels[ordering], leaf_x[ordering], leaf_y[ordering], leaf_counts[ordering]
+
+
+def get_fine_edges(edges, fine_idxs):
+    """
+    :param edges: array of uniformly spaced cell edges of the finest grid along one axis
+    :param fine_idxs: array of finest edge indices; may extend beyond the finest grid (as the coarse levels of grid_pyramid.get_pooled_edges)
+    :return: array of edge coordinates
+    """
+
+    num_cells = len(edges) - 1
+    step = (edges[-1] - edges[0]) / float(num_cells)
+
+    return np.where(fine_idxs <= num_cells, edges[np.minimum(fine_idxs, num_cells)], edges[0] + fine_idxs * step)
+
+
+def get_leaf_centroids(levels, idx_x, idx_y, xedges, yedges):
+    """
+    :param xedges: cell edges of the finest grid along the x axis
+    :param yedges: cell edges of the finest grid along the y axis
+    :return: arrays of the centroid longitudes and latitudes of the leaves (finest cell centroids for leaves of level 0)
+    """
+
+    x0 = idx_x << levels
+    y0 = idx_y << levels
+    size = 1 << levels
+
+    return (get_fine_edges(xedges, x0) + get_fine_edges(xedges, x0 + size))/2, (get_fine_edges(yedges, y0) + get_fine_edges(yedges, y0 + size))/2
+
+
+def find_face_neighbors(levels, idx_x, idx_y, num_cells_y):
+    """
+    :param levels: array of leaf levels
+    :param idx_x: array of leaf indices along the x axis (on the grid of their level)
+    :param idx_y: array of leaf indices along the y axis (on the grid of their level)
+    :param num_cells_y: number of finest cells along the y axis
+    :return: arrays src, dst of the pairs of leaves sharing a face (both directions, no self-loops), ordered by source and destination
+    """
+
+    levels = np.asarray(levels, dtype = np.int64)
+    idx_x = np.asarray(idx_x, dtype = np.int64)
+    idx_y = np.asarray(idx_y, dtype = np.int64)
+
+    x0 = idx_x << levels
+    y0 = idx_y << levels
+    size = 1 << levels
+
+    # sorted leaf keys of each level, to look up the leaf containing a finest cell
+    level_lookups = []
+    for level in np.unique(levels):
+        leaves = np.flatnonzero(levels == level)
+        keys = idx_x[leaves] * num_cells_y + idx_y[leaves]
+        ordering = np.argsort(keys)
+        level_lookups.append((level, keys[ordering], leaves[ordering]))
+
+    srcs = []
+    dsts = []
+
+    # finest cell next to a corner of the east, west, north and south faces
+    for probe_x, probe_y in ((x0 + size, y0), (x0 - 1, y0), (x0, y0 + size), (x0, y0 - 1)):
+
+        on_grid = np.flatnonzero((probe_x >= 0) & (probe_y >= 0) & (probe_y < num_cells_y))
+
+        for level, keys, leaves in level_lookups:
+
+            # only neighbors at least as large; smaller neighbors find this leaf from their side
+            probing = on_grid[levels[on_grid] <= level]
+            if len(probing) == 0:
+                continue
+
+            probe_keys = (probe_x[probing] >> level) * num_cells_y + (probe_y[probing] >> level)
+
+            pos = np.minimum(np.searchsorted(keys, probe_keys), len(keys) - 1)
+            found = keys[pos] == probe_keys
+
+            srcs.append(probing[found])
+            dsts.append(leaves[pos[found]])
+
+    if not srcs:
+        empty = np.zeros(0, dtype = np.int64)
+        return empty, empty
+
+    src = np.concatenate(srcs + dsts)
+    dst = np.concatenate(dsts + srcs)
+
+    pairs = np.unique(src * len(levels) + dst)
+
+    return pairs // len(levels), pairs % len(levels)
+
+
+def build_quadtree_adjacency(levels, idx_x, idx_y, lons, lats, num_cells_y, migration_radius = 1):
+    """
+    :param lons: array of leaf centroid longitudes (see get_leaf_centroids)
+    :param lats: array of leaf centroid latitudes
+    :param migration_radius: neighborhood radius in face hops between leaves
+    :return: arrays src, dst, w of the leaf graph edges (including zero weight self-loops, as grid_adjacency.build_adjacency), ordered by source and destination;
+             w is the centroid to centroid distance in km
+    """
+
+    num_leaves = len(levels)
+
+    face_src, face_dst = find_face_neighbors(levels, idx_x, idx_y, num_cells_y)
+
+    nodes = np.arange(num_leaves)
+    hop = csr_matrix((np.ones(len(face_src) + num_leaves), (np.concatenate((face_src, nodes)), np.concatenate((face_dst, nodes)))), shape = (num_leaves, num_leaves))
+
+    # leaves within migration_radius face hops
+    reach = hop
+    for i in range(1, migration_radius):
+        reach = reach.dot(hop)
+        reach.data[:] = 1
+
+    reach = reach.tocoo()
+    ordering = np.lexsort((reach.col, reach.row))
+    src = reach.row[ordering].astype(np.int64)
+    dst = reach.col[ordering].astype(np.int64)
+
+    return src, dst, vincenty_km(lats[src], lons[src], lats[dst], lons[dst])
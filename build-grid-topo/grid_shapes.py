@@ -0,0 +1,416 @@
+'''
+- fast geojson shape filter (e.g. of households or grid cells centroids by admin2 communes; see build_grid_topo_filter_by_shape.py)
+- shapes are prepared once: the rings of each (multi)polygon feature are flattened into arrays of edges along with the feature bounding box;
+  prepared shapes are cached on disk (npz) keyed by the hash of the geojson file, so the geojson is only parsed once
+- points are tested in bulk:
+---- bounding box pre-screen: points are sorted by longitude once and the candidates of each feature are the slice within its longitude extent,
+     further screened by latitude
+---- vectorized point-in-polygon (even-odd rule over all rings of a feature, so holes are excluded): candidates are sorted by latitude and
+     each edge only tests the candidates within its latitude band, so the work scales with the number of boundary crossings rather than with
+     the number of points times the number of edges
+- points exactly on a shape boundary may be classified either way (shapely's contains excludes them)
+- scanline rasterization of the features onto a grid (see ShapeIndex.rasterize), without per cell geometry tests; also used for the spatial join
+  of grid cells to the features (e.g. admin2 communes; see ShapeIndex.join_cells and build_grid_topo_by_shape.py), restricted to the rows and
+  centroids of the joined cells:
+---- the intervals of each scanline inside a feature are obtained from the sorted crossings of the scanline with the feature edges (even-odd rule)
+---- centroid coverage: a scanline through each row of cell centroids; the covered cells are the centroids within the intervals
+     (the same cells as testing each centroid with contains)
+---- fractional coverage: several scanlines per row of cells; the fraction of a cell's area inside a feature is the mean over its scanlines of the
+     length of the intervals within the cell (exact along the scanlines, sampled across them), so border cells can be weighted or split
+'''
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+
+class ShapeIndex(object):
+    '''
+    prepared (multi)polygon features of a geojson feature collection for bulk point-in-shape tests
+    '''
+
+    def __init__(self, edges, edge_ptr, bboxes, properties):
+        """
+        :param edges: array (num_edges x 4) of ring edges x0, y0, x1, y1 (lon, lat) of all features
+        :param edge_ptr: array (num_features + 1) of feature offsets into the edges
+        :param bboxes: array (num_features x 4) of feature bounding boxes x_min, x_max, y_min, y_max
+        :param properties: list of feature properties dicts
+        """
+        self.edges = edges
+        self.edge_ptr = edge_ptr
+        self.bboxes = bboxes
+        self.properties = properties
+
+
+    @classmethod
+    def from_features(cls, features):
+        """
+        :param features: list of geojson features with Polygon or MultiPolygon geometries
+        """
+
+        edges = []
+        edge_ptr = [0]
+        bboxes = []
+        properties = []
+
+        for feature in features:
+
+            geometry = feature["geometry"]
+
+            if geometry["type"] == "Polygon":
+                polygons = [geometry["coordinates"]]
+            elif geometry["type"] == "MultiPolygon":
+                polygons = geometry["coordinates"]
+            else:
+                raise ValueError("Unsupported shape geometry type " + str(geometry["type"]))
+
+            feature_edges = []
+            for polygon in polygons:
+                for ring in polygon:
+                    ring = np.asarray(ring, dtype = np.float64)[:, :2]
+                    # close the ring if needed
+                    if len(ring) and (ring[0] != ring[-1]).any():
+                        ring = np.vstack((ring, ring[:1]))
+                    feature_edges.append(np.hstack((ring[:-1], ring[1:])))
+
+            feature_edges = np.vstack(feature_edges) if feature_edges else np.zeros((0, 4))
+
+            edges.append(feature_edges)
+            edge_ptr.append(edge_ptr[-1] + len(feature_edges))
+
+            if len(feature_edges):
+                bboxes.append([feature_edges[:, 0].min(), feature_edges[:, 0].max(), feature_edges[:, 1].min(), feature_edges[:, 1].max()])
+            else:
+                bboxes.append([np.inf, -np.inf, np.inf, -np.inf])
+
+            properties.append(feature.get("properties", {}))
+
+        return cls(np.vstack(edges) if edges else np.zeros((0, 4)), np.array(edge_ptr, dtype = np.int64), np.array(bboxes, dtype = np.float64).reshape(-1, 4), properties)
+
+
+    @classmethod
+    def load(cls, geojson_path, cache_dir = "."):
+        """
+        :param geojson_path: geojson file with a feature collection (e.g. haiti_admin2.geojson)
+        :param cache_dir: directory of the prepared shapes cache (e.g. shapes_<sha1 of the geojson file>.npz); None to disable the cache
+        """
+
+        with open(geojson_path, "rb") as g_f:
+            geojson = g_f.read()
+
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, "shapes_" + hashlib.sha1(geojson).hexdigest() + ".npz")
+
+            if os.path.exists(cache_path):
+                with np.load(cache_path) as cache:
+                    return cls(cache["edges"], cache["edge_ptr"], cache["bboxes"], json.loads(str(cache["properties"])))
+
+        shape_index = cls.from_features(json.loads(geojson.decode("utf-8"))["features"])
+
+        if cache_path is not None:
+            np.savez(cache_path, edges = shape_index.edges, edge_ptr = shape_index.edge_ptr, bboxes = shape_index.bboxes, properties = np.array(json.dumps(shape_index.properties)))
+
+        return shape_index
+
+
+    def select(self, predicate):
+        """
+        :param predicate: function of feature properties, e.g. lambda properties: properties["commune"] == "Jeremie"
+        :return: ShapeIndex of the features whose properties satisfy the predicate
+        """
+
+        selected = [i for i, properties in enumerate(self.properties) if predicate(properties)]
+
+        edges = [self.edges[self.edge_ptr[i]:self.edge_ptr[i + 1]] for i in selected]
+        edge_ptr = np.concatenate(([0], np.cumsum([len(feature_edges) for feature_edges in edges]))).astype(np.int64)
+
+        return ShapeIndex(np.vstack(edges) if edges else np.zeros((0, 4)), edge_ptr, self.bboxes[selected].reshape(-1, 4), [self.properties[i] for i in selected])
+
+
+    def locate(self, lons, lats):
+        """
+        :param lons: array of point longitudes
+        :param lats: array of point latitudes
+        :return: array of the index of the (first) feature containing each point; -1 for points outside of all features
+        """
+
+        lons = np.asarray(lons, dtype = np.float64)
+        lats = np.asarray(lats, dtype = np.float64)
+
+        feature_idxs = np.repeat(-1, len(lons))
+
+        # points sorted by longitude; the bounding box of each feature is a slice of them
+        lon_order = np.argsort(lons, kind = 'mergesort')
+        sorted_lons = lons[lon_order]
+
+        for i, (x_min, x_max, y_min, y_max) in enumerate(self.bboxes):
+
+            candidates = lon_order[np.searchsorted(sorted_lons, x_min, 'left'):np.searchsorted(sorted_lons, x_max, 'right')]
+            candidates = candidates[(lats[candidates] >= y_min) & (lats[candidates] <= y_max) & (feature_idxs[candidates] < 0)]
+
+            if len(candidates) == 0:
+                continue
+
+            inside = points_in_rings(lons[candidates], lats[candidates], self.edges[self.edge_ptr[i]:self.edge_ptr[i + 1]])
+            feature_idxs[candidates[inside]] = i
+
+        return feature_idxs
+
+
+    def contains(self, lons, lats):
+        """
+        :return: boolean array; True for points within the union of the features
+        """
+        return self.locate(lons, lats) >= 0
+
+
+    def rasterize(self, xedges, yedges, fractions = False, subsamples = 8):
+        """
+        :param xedges: array of grid cell edges along the x axis (longitude)
+        :param yedges: array of grid cell edges along the y axis (latitude)
+        :param fractions: compute the fraction of the area of each cell inside each feature instead of the coverage of cells centroids
+        :param subsamples: number of scanlines per row of cells for fractions
+        :return: arrays of cell keys (idx_x * num_cells_y + idx_y), feature indices and covered area fractions (1 for centroid coverage)
+                 of the cells covered by each feature (centroid inside the feature, or with fractions, any part of the cell), ordered by feature and cell key
+        """
+
+        num_cells_x = len(xedges) - 1
+        num_cells_y = len(yedges) - 1
+
+        x_mid = (xedges[1:] + xedges[:-1])/2
+        y_mid = (yedges[1:] + yedges[:-1])/2
+
+        all_keys = []
+        all_feature_idxs = []
+        all_fractions = []
+
+        for i, (x_min, x_max, y_min, y_max) in enumerate(self.bboxes):
+
+            # rows of cells overlapping the feature bounding box
+            row_start = max(np.searchsorted(yedges, y_min, 'right') - 1, 0)
+            row_end = min(np.searchsorted(yedges, y_max, 'left'), num_cells_y)
+
+            if row_end <= row_start or x_max < xedges[0] or x_min > xedges[-1]:
+                continue
+
+            rows = np.arange(row_start, row_end)
+            feature_edges = self.edges[self.edge_ptr[i]:self.edge_ptr[i + 1]]
+
+            if fractions:
+
+                offsets = (np.arange(subsamples) + 0.5) / subsamples
+                scanline_lats = (yedges[rows][:, None] + offsets[None, :] * (yedges[rows + 1] - yedges[rows])[:, None]).ravel()
+
+                scanlines, starts, ends = get_scanline_intervals(feature_edges, scanline_lats)
+
+                # cells overlapped by each interval
+                col_starts = np.maximum(np.searchsorted(xedges, starts, 'right') - 1, 0)
+                col_ends = np.minimum(np.searchsorted(xedges, ends, 'left'), num_cells_x)
+                interval_idxs, cols = get_ragged_ranges(col_starts, col_ends)
+
+                overlaps = np.minimum(ends[interval_idxs], xedges[cols + 1]) - np.maximum(starts[interval_idxs], xedges[cols])
+                cell_keys = cols * num_cells_y + rows[scanlines[interval_idxs] // subsamples]
+
+                keys, inverse = np.unique(cell_keys, return_inverse = True)
+                cell_fractions = np.bincount(inverse, weights = overlaps / (xedges[cols + 1] - xedges[cols]) / subsamples, minlength = len(keys))
+
+                covered = cell_fractions > 0
+                keys = keys[covered]
+                cell_fractions = np.minimum(cell_fractions[covered], 1.0)
+
+            else:
+
+                scanlines, starts, ends = get_scanline_intervals(feature_edges, y_mid[rows])
+
+                # centroids within each interval [start, end)
+                interval_idxs, cols = get_ragged_ranges(np.searchsorted(x_mid, starts, 'left'), np.searchsorted(x_mid, ends, 'left'))
+
+                keys = np.unique(cols * num_cells_y + rows[scanlines[interval_idxs]])
+                cell_fractions = np.ones(len(keys))
+
+            all_keys.append(keys)
+            all_feature_idxs.append(np.repeat(i, len(keys)))
+            all_fractions.append(cell_fractions)
+
+        if not all_keys:
+            return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0)
+
+        return np.concatenate(all_keys).astype(np.int64), np.concatenate(all_feature_idxs).astype(np.int64), np.concatenate(all_fractions)
+
+
+    def get_cell_coverage(self, xedges, yedges, cell_keys, fractions = False, subsamples = 8):
+        """
+        :param cell_keys: array of cell keys (idx_x * num_cells_y + idx_y) of grid cells, e.g. the kept cells of a build
+        :return: array of the fraction of each cell's area covered by the union of the features (see rasterize); with fractions False,
+                 1 for cells whose centroid is within the union of the features and 0 otherwise
+        """
+
+        covered_keys, covered_fractions = get_union_coverage(*self.rasterize(xedges, yedges, fractions, subsamples)[0::2])
+
+        cell_keys = np.asarray(cell_keys, dtype = np.int64)
+        pos = np.minimum(np.searchsorted(covered_keys, cell_keys), max(len(covered_keys) - 1, 0))
+
+        if len(covered_keys) == 0:
+            return np.zeros(len(cell_keys))
+
+        return np.where(covered_keys[pos] == cell_keys, covered_fractions[pos], 0.0)
+
+
+    def join_cells(self, xedges, yedges, cell_keys):
+        """
+        spatial join of grid cells to the features by cell centroid (the same cells as centroid coverage in rasterize); scanlines are only cast through
+        the rows of the given cells within each feature bounding box and only their centroids are looked up in the intervals, so the work scales with
+        the number of given cells (e.g. the kept cells of a build) rather than with the area of the features
+
+        :param cell_keys: array of cell keys (idx_x * num_cells_y + idx_y) of grid cells, e.g. the kept cells of a build
+        :return: array of the index of the (first) feature containing each cell's centroid; -1 for cells outside of all features (as locate)
+        """
+
+        num_cells_y = len(yedges) - 1
+
+        x_mid = (xedges[1:] + xedges[:-1])/2
+        y_mid = (yedges[1:] + yedges[:-1])/2
+
+        cell_keys = np.asarray(cell_keys, dtype = np.int64)
+        rows = cell_keys % num_cells_y
+        lons = x_mid[cell_keys // num_cells_y]
+        lats = y_mid[rows]
+
+        feature_idxs = np.repeat(-1, len(cell_keys))
+
+        # cells sorted by centroid longitude; the bounding box of each feature is a slice of them (as in locate)
+        lon_order = np.argsort(lons, kind = 'mergesort')
+        sorted_lons = lons[lon_order]
+
+        for i, (x_min, x_max, y_min, y_max) in enumerate(self.bboxes):
+
+            candidates = lon_order[np.searchsorted(sorted_lons, x_min, 'left'):np.searchsorted(sorted_lons, x_max, 'right')]
+            candidates = candidates[(lats[candidates] >= y_min) & (lats[candidates] <= y_max) & (feature_idxs[candidates] < 0)]
+
+            if len(candidates) == 0:
+                continue
+
+            # one scanline through each row of candidate cells
+            candidate_rows, scanline_idxs = np.unique(rows[candidates], return_inverse = True)
+            scanlines, starts, ends = get_scanline_intervals(self.edges[self.edge_ptr[i]:self.edge_ptr[i + 1]], y_mid[candidate_rows])
+
+            inside = get_interval_hits(scanline_idxs.ravel(), lons[candidates], scanlines, starts, ends)
+            feature_idxs[candidates[inside]] = i
+
+        return feature_idxs
+
+
+def get_union_coverage(cell_keys, cell_fractions):
+    """
+    :param cell_keys: cell keys returned by ShapeIndex.rasterize
+    :param cell_fractions: covered fractions returned by ShapeIndex.rasterize
+    :return: arrays of sorted cell keys and fractions of their area covered by the union of the features (features are assumed not to overlap)
+    """
+
+    keys, inverse = np.unique(cell_keys, return_inverse = True)
+
+    return keys, np.minimum(np.bincount(inverse, weights = cell_fractions, minlength = len(keys)), 1.0)
+
+
+def get_ragged_ranges(starts, ends):
+    """
+    :return: arrays of range indices and values of the concatenated integer ranges [start, end) (empty ranges are skipped)
+    """
+
+    counts = np.maximum(np.asarray(ends, dtype = np.int64) - np.asarray(starts, dtype = np.int64), 0)
+
+    range_idxs = np.repeat(np.arange(len(counts)), counts)
+    values = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(np.asarray(starts, dtype = np.int64), counts)
+
+    return range_idxs, values
+
+
+def get_scanline_intervals(edges, scanline_lats):
+    """
+    :param edges: array (num_edges x 4) of ring edges x0, y0, x1, y1 of a feature
+    :param scanline_lats: sorted array of scanline latitudes
+    :return: arrays of scanline indices, starts and ends (longitudes) of the intervals of the scanlines inside the feature (even-odd rule),
+             ordered by scanline and start
+    """
+
+    edge_y_min = np.minimum(edges[:, 1], edges[:, 3])
+    edge_y_max = np.maximum(edges[:, 1], edges[:, 3])
+
+    # scanlines within each edge's half open latitude band [y_min, y_max), as in points_in_rings; each ring is thus crossed an even number of times
+    edge_idxs, scanlines = get_ragged_ranges(np.searchsorted(scanline_lats, edge_y_min, 'left'), np.searchsorted(scanline_lats, edge_y_max, 'left'))
+
+    x0, y0, x1, y1 = [edges[edge_idxs, k] for k in range(4)]
+    crossing_lons = x0 + (scanline_lats[scanlines] - y0) * (x1 - x0) / (y1 - y0)
+
+    ordering = np.lexsort((crossing_lons, scanlines))
+    scanlines = scanlines[ordering]
+    crossing_lons = crossing_lons[ordering]
+
+    return scanlines[0::2], crossing_lons[0::2], crossing_lons[1::2]
+
+
+def get_interval_hits(scanline_idxs, lons, scanlines, starts, ends):
+    """
+    :param scanline_idxs: array of the scanline index of each point
+    :param lons: array of point longitudes
+    :param scanlines: array of scanline indices of the intervals, ordered by scanline and start (see get_scanline_intervals)
+    :param starts: array of interval starts (longitudes)
+    :param ends: array of interval ends (longitudes)
+    :return: boolean array; True for points within an interval [start, end) of their scanline
+    """
+
+    # interval starts and points merged in (scanline, longitude) order, starts first at equal longitudes; the intervals of a scanline are disjoint,
+    # so the last start before a point is the only interval of its scanline that may contain it
+    is_point = np.concatenate((np.zeros(len(starts), dtype = bool), np.ones(len(lons), dtype = bool)))
+    ordering = np.lexsort((is_point, np.concatenate((starts, lons)), np.concatenate((scanlines, scanline_idxs))))
+
+    last_starts = np.cumsum(np.logical_not(is_point[ordering])) - 1
+    points = is_point[ordering]
+    point_idxs, interval_idxs = ordering[points] - len(starts), last_starts[points]
+
+    found = interval_idxs >= 0
+    point_idxs, interval_idxs = point_idxs[found], interval_idxs[found]
+
+    hits = np.zeros(len(lons), dtype = bool)
+    hits[point_idxs] = (scanlines[interval_idxs] == scanline_idxs[point_idxs]) & (lons[point_idxs] < ends[interval_idxs])
+
+    return hits
+
+
+def points_in_rings(lons, lats, edges):
+    """
+    :param lons: array of point longitudes
+    :param lats: array of point latitudes
+    :param edges: array (num_edges x 4) of ring edges x0, y0, x1, y1 of a feature
+    :return: boolean array; True for points inside the feature (even-odd rule over all its rings)
+    """
+
+    inside = np.zeros(len(lons), dtype = bool)
+
+    lat_order = np.argsort(lats, kind = 'mergesort')
+    sorted_lats = lats[lat_order]
+
+    edge_y_min = np.minimum(edges[:, 1], edges[:, 3])
+    edge_y_max = np.maximum(edges[:, 1], edges[:, 3])
+
+    # points within each edge's half open latitude band [y_min, y_max); horizontal edges have empty bands
+    band_starts = np.searchsorted(sorted_lats, edge_y_min, 'left')
+    band_ends = np.searchsorted(sorted_lats, edge_y_max, 'left')
+
+    for (x0, y0, x1, y1), start, end in zip(edges.tolist(), band_starts.tolist(), band_ends.tolist()):
+
+        if start == end:
+            continue
+
+        band = lat_order[start:end]
+
+        # longitude where the edge crosses each point's latitude; a ray cast east of the point crosses the edge if the point is west of it
+        crossing_lons = x0 + (lats[band] - y0) * (x1 - x0) / (y1 - y0)
+        crossed = band[lons[band] < crossing_lons]
+
+        inside[crossed] = np.logical_not(inside[crossed])
+
+    return inside
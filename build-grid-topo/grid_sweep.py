@@ -0,0 +1,220 @@
+'''
+- parameter sweep over grid topo configurations (cell size, cell threshold, migration radius) on a single load of the structures (see sweep_grid_topo.py)
+- the structures are read once; each worker process bins them once per cell size (sparse; see grid_binning.py) and reuses the binned grid
+  and its distance kernel (see grid_geodesy.py) for all thresholds and migration radii of that cell size
+- each configuration is summarized by its number of nodes, total population kept, number of edges (pairs of distinct neighbor nodes)
+  and number of connected components of the grid graph; optionally its outputs are written as by build_grid_topo.py
+'''
+
+import json
+import itertools
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+import grid_binning
+import grid_adjacency
+import grid_graph
+from grid_geodesy import vincenty_km, DistanceKernel
+
+
+# columns of the sweep report, in order
+report_columns = ["cell_size", "threshold", "migration_radius", "num_nodes", "pop", "num_edges", "num_components"]
+
+# structures and settings shared by the worker processes (see init_sweep_worker)
+sweep_state = {}
+
+
+def load_points(csv_path, bbox, weight_column = None):
+    """
+    :param csv_path: structures csv file with required columns lat,lon
+    :param bbox: bounding box (x_min, x_max, y_min, y_max)
+    :param weight_column: optional column with per structure weights (e.g. pop)
+    :return: arrays lons, lats and weights (None if no weight column) of the structures within the bounding box
+    """
+
+    records = pd.read_csv(csv_path)
+    records = records[grid_binning.get_bbox_mask(records.lon.values, records.lat.values, bbox)]
+
+    weights = None if weight_column is None else records[weight_column].values.astype(np.float64)
+
+    return records.lon.values.astype(np.float64), records.lat.values.astype(np.float64), weights
+
+
+def get_grid_size(bbox, cell_size):
+    """
+    :return: number of grid cells along the x and y axis of the bounding box for a cell size (in m), as in build_grid_topo.py
+    """
+
+    x_min, x_max, y_min, y_max = bbox
+
+    num_cells_x = int(1000*vincenty_km(y_min, x_min, y_min, x_max)/cell_size) + 1
+    num_cells_y = int(1000*vincenty_km(y_min, x_min, y_max, x_min)/cell_size) + 1
+
+    return num_cells_x, num_cells_y
+
+
+def get_configs(cell_sizes, thresholds, migration_radii):
+    """
+    :return: list of (cell_size, threshold, migration_radius) of all combinations, ordered by cell size so that workers reuse binned grids
+    """
+    return list(itertools.product(sorted(cell_sizes), thresholds, migration_radii))
+
+
+def get_config_suffix(config):
+    """
+    :return: output file name suffix of a configuration, e.g. _50m_t5_r3
+    """
+    return "_" + str(config[0]) + "m_t" + ("%g" % config[1]) + "_r" + str(config[2])
+
+
+def init_sweep_worker(state):
+    sweep_state.clear()
+    sweep_state.update(state)
+    sweep_state["grids"] = {}
+
+
+def get_binned_grid(cell_size):
+    """
+    :return: sorted occupied cell keys, counts, xedges, yedges and distance kernel of the structures binned at the given cell size; cached per process
+    """
+
+    grids = sweep_state["grids"]
+
+    if cell_size not in grids:
+
+        # keep only the current cell size; configs are ordered by cell size
+        grids.clear()
+
+        lons, lats, weights = sweep_state["points"]
+        num_cells_x, num_cells_y = get_grid_size(sweep_state["bbox"], cell_size)
+
+        xedges, yedges = grid_binning.get_histogram_edges((lons.min(), lons.max()), (lats.min(), lats.max()), num_cells_x, num_cells_y)
+        cell_keys, cell_counts = grid_binning.sparse_histogram2d(lons, lats, xedges, yedges, weights)
+
+        kernel = DistanceKernel.from_axes((xedges[1:] + xedges[:-1])/2, (yedges[1:] + yedges[:-1])/2)
+
+        grids[cell_size] = (cell_keys, cell_counts, xedges, yedges, kernel)
+
+    return grids[cell_size]
+
+
+def evaluate_config(config):
+    """
+    :param config: (cell_size, threshold, migration_radius)
+    :return: dict of report columns (see report_columns)
+    """
+
+    cell_size, threshold, migration_radius = config
+
+    cell_keys, cell_counts, xedges, yedges, kernel = get_binned_grid(cell_size)
+
+    num_cells_y = len(yedges) - 1
+
+    x_mid = (xedges[1:] + xedges[:-1])/2
+    y_mid = (yedges[1:] + yedges[:-1])/2
+
+    kept = cell_counts >= threshold
+    filtered_cell_keys = cell_keys[kept]
+    filtered_cells_counts = cell_counts[kept]
+    filtered_cells_idx = (filtered_cell_keys // num_cells_y, filtered_cell_keys % num_cells_y)
+
+    num_nodes = len(filtered_cell_keys)
+
+    src, dst, w = grid_adjacency.build_adjacency(filtered_cells_idx[0], filtered_cells_idx[1], x_mid, y_mid, migration_radius, kernel)
+
+    # population per node as in pop_gridded.csv
+    pops = (filtered_cells_counts * sweep_state["pop_per_count"]).astype(np.int64)
+
+    if num_nodes > 0:
+        num_components = connected_components(csr_matrix((np.ones(len(src)), (src, dst)), shape = (num_nodes, num_nodes)), directed = False)[0]
+    else:
+        num_components = 0
+
+    if sweep_state["write_outputs"]:
+        write_config_outputs(config, filtered_cells_idx, filtered_cells_counts, pops, x_mid, y_mid, src, dst, w)
+
+    return {
+                "cell_size": cell_size,
+                "threshold": threshold,
+                "migration_radius": migration_radius,
+                "num_nodes": num_nodes,
+                "pop": int(pops.sum()),
+                "num_edges": int((src < dst).sum()),
+                "num_components": int(num_components)
+            }
+
+
+def write_config_outputs(config, filtered_cells_idx, filtered_cells_counts, pops, x_mid, y_mid, src, dst, w):
+    """
+    write the nodes csv, binary grid graph and json adjacency list of a configuration, in the formats of build_grid_topo.py
+    (e.g. pop_gridded_50m_t5_r3.csv, gridded_households_adj_graph_50m_t5_r3.npz, gridded_households_adj_list_50m_t5_r3.json)
+    """
+
+    suffix = get_config_suffix(config)
+    num_nodes = len(filtered_cells_counts)
+
+    pop_nodes = "node_label,lat,lon,pop,num_hhs\n"
+
+    for i, idx_x in enumerate(filtered_cells_idx[0]):
+
+        idx_y = filtered_cells_idx[1][i]
+
+        pop_nodes += str(i) + "," + str(y_mid[idx_y]) + "," + str(x_mid[idx_x]) + "," + str(pops[i]) + "," + str(filtered_cells_counts[i]) + "\n"
+
+    with open("pop_gridded" + suffix + ".csv", "w") as phg_f:
+        phg_f.write(pop_nodes)
+
+    adj_indptr, adj_indices, adj_weights = grid_graph.to_csr(src, dst, w, num_nodes)
+    grid_graph.save_csr("gridded_households_adj_graph" + suffix + ".npz", adj_indptr, adj_indices, adj_weights)
+
+    if sweep_state["export_adj_list_json"]:
+        with open("gridded_households_adj_list" + suffix + ".json", "w") as a_f:
+            json.dump(grid_adjacency.to_adj_list(src, dst, w, num_nodes), a_f, indent = 3)
+
+
+def run_sweep(points, bbox, cell_sizes, thresholds, migration_radii, num_processes = 1, pop_per_count = 1, write_outputs = False, export_adj_list_json = True):
+    """
+    :param points: (lons, lats, weights) of the structures within the bounding box (e.g. returned by load_points)
+    :param bbox: bounding box (x_min, x_max, y_min, y_max); determines the number of cells for each cell size
+    :param cell_sizes: list of cell sizes (in m)
+    :param thresholds: list of minimum (weighted) counts of structures per kept cell
+    :param migration_radii: list of neighborhood radii in hops
+    :param num_processes: number of worker processes; configurations are evaluated in the calling process if 1
+    :param pop_per_count: population per (weighted) structure count, e.g. avg_household_size for households or 1 for pop weighted structures
+    :param write_outputs: also write the outputs of each configuration (see write_config_outputs)
+    :param export_adj_list_json: include the json adjacency lists in the written outputs
+    :return: pandas DataFrame with one row per configuration (see report_columns)
+    """
+
+    state = {
+                "points": points,
+                "bbox": bbox,
+                "pop_per_count": pop_per_count,
+                "write_outputs": write_outputs,
+                "export_adj_list_json": export_adj_list_json
+            }
+
+    configs = get_configs(cell_sizes, thresholds, migration_radii)
+
+    if num_processes > 1:
+
+        # contiguous chunks of configs (i.e. mostly of the same cell size) per task, so that workers rarely rebin
+        chunksize = max(1, len(configs) // (4 * num_processes))
+
+        pool = multiprocessing.Pool(processes = num_processes, initializer = init_sweep_worker, initargs = (state,))
+        try:
+            results = pool.map(evaluate_config, configs, chunksize = chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    else:
+        init_sweep_worker(state)
+        results = [evaluate_config(config) for config in configs]
+
+    return pd.DataFrame(results, columns = report_columns)
@@ -0,0 +1,149 @@
+'''
+- classification of Open Street Map elements into layers (e.g. building, hospital, school) by their tags, evaluating all layers once per element
+  (see download_osm_structures.py, download_osm_hospitals.py and extract_osm_structures.py)
+- layers are defined by Overpass QL tag filters, as the properties of download_osm_structures.py (e.g. ["building"]["building"!="no"]), so that the same filters
+  select the elements of a (union) Overpass query and classify its response or the elements of a local OSM extract
+- the filters are compiled once into a rule table: tag conditions (key present or absent, =, !=, ~ and !~ regular expressions) grouped by layer with their regular
+  expressions compiled, and the set of the keys of the positive conditions; elements without any of these keys (most elements, e.g. untagged way nodes)
+  are rejected by a single set intersection
+- an element can be in several layers (e.g. a building tagged amenity=hospital); its type in a layer is the value of the first type tag of the layer it has
+  (see layer_type_tags), or the layer name
+'''
+
+import re
+
+
+# default layers (Overpass QL tag filters), as the properties of download_osm_structures.py
+layer_filters = {
+                    "building": '["building"]["building"!="no"]',
+                    "hospital": '["amenity"="hospital"]["health_facility:type"]',
+                    "health_care": '["amenity"]["amenity"~"pharmacy|doctors"]',
+                    "school": '["amenity"]["amenity"="school"]'
+                }
+
+# tags of the type of the elements of a layer, in order of preference; layers with type tags get a type column (e.g. structures_hospitals.csv)
+layer_type_tags = {
+                    "hospital": ["health_facility:type", "amenity"],
+                    "health_care": ["healthcare", "amenity"],
+                    "school": ["school", "amenity"]
+                }
+
+# one tag condition of an Overpass QL filter: ["key"], [!"key"], ["key"="value"], ["key"!="value"], ["key"~"regex"], ["key"!~"regex"] (optionally ,i: case insensitive)
+condition_pattern = re.compile(r'\[\s*(!?)\s*"((?:[^"\\]|\\.)*)"\s*(?:(=|!=|~|!~)\s*"((?:[^"\\]|\\.)*)"\s*(,\s*i)?\s*)?\]')
+
+
+def unescape(value):
+    """
+    :return: value of an Overpass QL string (backslash escapes removed)
+    """
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def parse_filter(tag_filter):
+    """
+    :param tag_filter: Overpass QL tag filter (e.g. '["building"]["building"!="no"]')
+    :return: list of the tag conditions (key, operator, value) of the filter; operators: "" (key present), "!" (key absent), "=", "!=", "~", "!~"
+             (regular expression search; value compiled)
+    """
+
+    conditions = []
+
+    pos = 0
+    tag_filter = tag_filter.strip()
+
+    while pos < len(tag_filter):
+
+        match = condition_pattern.match(tag_filter, pos)
+        if match is None:
+            raise ValueError("Unsupported Overpass QL tag filter " + tag_filter + " at " + tag_filter[pos:])
+
+        negated, key, operator, value, case_insensitive = match.groups()
+        key = unescape(key)
+
+        if operator is None:
+            conditions.append((key, "!" if negated else "", None))
+        elif operator in ("~", "!~"):
+            conditions.append((key, operator, re.compile(unescape(value), re.IGNORECASE if case_insensitive else 0)))
+        else:
+            conditions.append((key, operator, unescape(value)))
+
+        pos = match.end()
+        while pos < len(tag_filter) and tag_filter[pos].isspace():
+            pos += 1
+
+    return conditions
+
+
+def compile_rules(filters, type_tags = layer_type_tags):
+    """
+    :param filters: dict of layer to its Overpass QL tag filter (e.g. properties in download_osm_structures.py)
+    :param type_tags: dict of layer to its type tags (see layer_type_tags)
+    :return: rule table: dict with layers (list of (layer, tag conditions, type tags), in layer order) and keys (set of the keys of the positive conditions)
+    """
+
+    layers = []
+    keys = set()
+
+    for layer in sorted(filters):
+
+        conditions = parse_filter(filters[layer])
+
+        positive_keys = [key for key, operator, value in conditions if operator in ("", "=", "~")]
+        if not positive_keys:
+            raise ValueError("The filter of layer " + layer + " needs a tag that is present (e.g. [\"building\"])")
+
+        keys.update(positive_keys)
+        layers.append((layer, conditions, type_tags.get(layer, [])))
+
+    return {"layers": layers, "keys": keys}
+
+
+def meets_condition(tags, condition):
+    """
+    :return: True if the tags (dict) of an element meet a tag condition
+    """
+
+    key, operator, value = condition
+    tag = tags.get(key)
+
+    if operator == "":
+        return tag is not None
+    if operator == "!":
+        return tag is None
+    if operator == "=":
+        return tag == value
+    if operator == "!=":
+        return tag != value
+    if operator == "~":
+        return tag is not None and value.search(tag) is not None
+    if operator == "!~":
+        return tag is None or value.search(tag) is None
+
+    raise ValueError("Unsupported tag condition operator " + operator)
+
+
+def classify(tags, rules):
+    """
+    :param tags: dict of the tags of an element
+    :param rules: rule table (see compile_rules)
+    :return: list of (layer, type) of the layers of the element
+    """
+
+    if not tags or rules["keys"].isdisjoint(tags):
+        return []
+
+    element_layers = []
+
+    for layer, conditions, type_tags in rules["layers"]:
+
+        if all(meets_condition(tags, condition) for condition in conditions):
+
+            element_type = layer
+            for tag in type_tags:
+                if tag in tags:
+                    element_type = tags[tag]
+                    break
+
+            element_layers.append((layer, element_type))
+
+    return element_layers
@@ -0,0 +1,232 @@
+'''
+- parallel tiled gridding: the grid is split into tiles (bands of columns along the x axis); structures are binned and the local adjacency of the kept cells
+  is built tile by tile in a process pool, and the tiles are then merged (see num_processes in build_grid_topo.py)
+- each tile also bins the halo columns within migration_radius of its borders, so that edges crossing tile borders are found and weighted exactly;
+  a tile only keeps its own cells and the edges from its own cells
+- in chunked (out-of-core) mode, the structures csv is read once, one chunk at a time, and the points of each chunk are appended to a temporary binary
+  shard per tile (the tile's own and halo columns); each worker then streams its own shard, so the csv is parsed once whatever the number of tiles
+  and memory stays bounded by the chunk size
+- tiles share the global histogram edges (and so the global cell keys idx_x * num_cells_y + idx_y and the distance kernel), so the merged nodes, edges
+  and their order are identical to those of a single-process run (see grid_binning.sparse_histogram2d, grid_adjacency.build_adjacency)
+'''
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+import grid_binning
+import grid_adjacency
+
+
+def get_tile_columns(num_cells_x, num_tiles):
+    """
+    :param num_cells_x: number of grid cells along the x axis
+    :param num_tiles: number of tiles
+    :return: list of (first column, last column + 1) of each non-empty tile, in x order
+    """
+
+    bounds = np.linspace(0, num_cells_x, num_tiles + 1).astype(np.int64)
+
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def get_halo_columns(columns, num_cells_x, migration_radius):
+    """
+    :return: (first column, last column + 1) of a tile extended by migration_radius halo columns on both sides (clipped to the grid)
+    """
+    return max(columns[0] - migration_radius, 0), min(columns[1] + migration_radius, num_cells_x)
+
+
+def bin_tile_points(lons, lats, weights, xedges, yedges, halo_columns):
+    """
+    :return: arrays of sorted occupied (global) cell keys and counts of the points within the halo columns
+    """
+
+    idx_x = grid_binning.get_cell_indices(lons, xedges)
+    in_tile = (idx_x >= halo_columns[0]) & (idx_x < halo_columns[1])
+
+    return grid_binning.sparse_histogram2d(lons[in_tile], lats[in_tile], xedges, yedges, None if weights is None else weights[in_tile])
+
+
+def write_tile_shards(csv, xedges, tile_halo_columns, shard_dir):
+    """
+    read the structures csv once, in chunks, and append the points of each chunk within the halo columns of each tile to the tile's shard file
+
+    :param csv: (csv_path, bbox, chunk_size, weight_column, default_weight)
+    :param tile_halo_columns: list of (first column, last column + 1) of each tile extended by its halo columns (see get_halo_columns)
+    :param shard_dir: directory of the shard files
+    :return: list of the shard (path, number of chunks) of each tile; a chunk is a 2d array of lon, lat (and weight) columns (see read_tile_shard)
+    """
+
+    csv_path, bbox, chunk_size, weight_column, default_weight = csv
+    columns = ["lon", "lat"] if weight_column is None else ["lon", "lat", weight_column]
+
+    paths = [os.path.join(shard_dir, "tile_%d.npy" % i) for i in range(len(tile_halo_columns))]
+    num_chunks = [0] * len(tile_halo_columns)
+
+    shard_files = [open(path, "wb") for path in paths]
+    try:
+        for points in grid_binning.read_points_chunks(csv_path, bbox, columns, chunk_size):
+            if len(points) == 0:
+                continue
+
+            weights = grid_binning.get_chunk_weights(points, weight_column, default_weight)
+            chunk = points[:, :2] if weights is None else np.column_stack((points[:, :2], weights))
+
+            idx_x = grid_binning.get_cell_indices(points[:, 0], xedges)
+
+            for i, halo_columns in enumerate(tile_halo_columns):
+                in_tile = (idx_x >= halo_columns[0]) & (idx_x < halo_columns[1])
+                if in_tile.any():
+                    np.save(shard_files[i], chunk[in_tile])
+                    num_chunks[i] += 1
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+
+    return list(zip(paths, num_chunks))
+
+
+def read_tile_shard(shard):
+    """
+    :param shard: (path, number of chunks) of a tile shard (see write_tile_shards)
+    :return: generator of the chunks (2d arrays of lon, lat and optional weight columns) of the shard, in csv order
+    """
+
+    path, num_chunks = shard
+
+    with open(path, "rb") as shard_file:
+        for i in range(num_chunks):
+            yield np.load(shard_file)
+
+
+def grid_tile(tile):
+    """
+    bin the structures of a tile (and its halo) and build the local adjacency of its kept cells; a process pool worker
+
+    :param tile: dict with keys columns, xedges, yedges, cell_threshold, migration_radius and either
+                 points (lons, lats, weights) or shard (path, number of chunks; see write_tile_shards) to stream the structures from
+    :return: sorted occupied cell keys and counts of the tile's own cells, and source keys, destination keys, weights of the edges from its own kept cells
+    """
+
+    xedges = tile["xedges"]
+    yedges = tile["yedges"]
+    migration_radius = tile["migration_radius"]
+
+    num_cells_x = len(xedges) - 1
+    num_cells_y = len(yedges) - 1
+
+    halo_columns = get_halo_columns(tile["columns"], num_cells_x, migration_radius)
+
+    if "points" in tile:
+
+        lons, lats, weights = tile["points"]
+        cell_keys, cell_counts = bin_tile_points(lons, lats, weights, xedges, yedges, halo_columns)
+
+    else:
+
+        cell_keys = np.zeros(0, dtype = np.int64)
+        cell_counts = np.zeros(0)
+
+        # same chunks and merge order as grid_binning.sparse_histogram2d_chunked, so that weighted counts are summed identically
+        for points in read_tile_shard(tile["shard"]):
+
+            weights = points[:, 2] if points.shape[1] > 2 else None
+
+            chunk_keys, chunk_counts = bin_tile_points(points[:, 0], points[:, 1], weights, xedges, yedges, halo_columns)
+            cell_keys, cell_counts = grid_binning.merge_sparse_histograms([cell_keys, chunk_keys], [cell_counts, chunk_counts])
+
+    kept_keys = cell_keys[cell_counts >= tile["cell_threshold"]]
+    kept_idx_x = kept_keys // num_cells_y
+
+    x_mid = (xedges[1:] + xedges[:-1])/2
+    y_mid = (yedges[1:] + yedges[:-1])/2
+
+    src, dst, w = grid_adjacency.build_adjacency(kept_idx_x, kept_keys % num_cells_y, x_mid, y_mid, migration_radius)
+
+    # halo cells belong to the neighboring tiles
+    own_cells = (cell_keys // num_cells_y >= tile["columns"][0]) & (cell_keys // num_cells_y < tile["columns"][1])
+    own_src = (kept_idx_x[src] >= tile["columns"][0]) & (kept_idx_x[src] < tile["columns"][1])
+
+    return cell_keys[own_cells], cell_counts[own_cells], kept_keys[src[own_src]], kept_keys[dst[own_src]], w[own_src]
+
+
+def build_tiled_grid(xedges, yedges, cell_threshold, migration_radius, num_processes, num_tiles = None, points = None, csv = None):
+    """
+    :param xedges: global cell edges along the x axis
+    :param yedges: global cell edges along the y axis
+    :param cell_threshold: minimum (weighted) count of a kept cell
+    :param migration_radius: neighborhood radius in hops
+    :param num_processes: number of worker processes
+    :param num_tiles: number of tiles; defaults to num_processes
+    :param points: (lons, lats, weights) arrays of the structures within the bounding box; weights may be None
+    :param csv: alternatively (csv_path, bbox, chunk_size, weight_column, default_weight); the structures csv is then read once, in chunks,
+                into temporary per tile shards that each tile streams (see write_tile_shards)
+    :return: arrays of sorted occupied cell keys and counts (all occupied cells, as grid_binning.sparse_histogram2d), and arrays src, dst, w
+             of the local grid graph edges of the kept cells (as grid_adjacency.build_adjacency; src/dst are positions in the kept cells)
+    """
+
+    if num_tiles is None:
+        num_tiles = num_processes
+
+    tile_columns = get_tile_columns(len(xedges) - 1, num_tiles)
+    tile_halo_columns = [get_halo_columns(columns, len(xedges) - 1, migration_radius) for columns in tile_columns]
+
+    if points is not None:
+        points_idx_x = grid_binning.get_cell_indices(points[0], xedges)
+    else:
+        shard_dir = tempfile.mkdtemp(prefix = "grid_tiles_")
+
+    try:
+        if points is None:
+            shards = write_tile_shards(csv, xedges, tile_halo_columns, shard_dir)
+
+        tiles = []
+        for i, columns in enumerate(tile_columns):
+
+            tile = {
+                        "columns": columns,
+                        "xedges": xedges,
+                        "yedges": yedges,
+                        "cell_threshold": cell_threshold,
+                        "migration_radius": migration_radius
+                    }
+
+            if points is not None:
+                lons, lats, weights = points
+
+                # only send each worker the points of its tile and halo
+                halo_columns = tile_halo_columns[i]
+                in_tile = (points_idx_x >= halo_columns[0]) & (points_idx_x < halo_columns[1])
+
+                tile["points"] = (lons[in_tile], lats[in_tile], None if weights is None else weights[in_tile])
+            else:
+                tile["shard"] = shards[i]
+
+            tiles.append(tile)
+
+        pool = multiprocessing.Pool(processes = num_processes)
+        try:
+            results = pool.map(grid_tile, tiles, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+
+    finally:
+        if points is None:
+            shutil.rmtree(shard_dir, ignore_errors = True)
+
+    # tiles are bands of columns in x order, so concatenating them keeps cell keys sorted and edges ordered by source cell
+    cell_keys = np.concatenate([result[0] for result in results])
+    cell_counts = np.concatenate([result[1] for result in results])
+
+    kept_keys = cell_keys[cell_counts >= cell_threshold]
+
+    src = np.searchsorted(kept_keys, np.concatenate([result[2] for result in results]))
+    dst = np.searchsorted(kept_keys, np.concatenate([result[3] for result in results]))
+    w = np.concatenate([result[4] for result in results])
+
+    return cell_keys, cell_counts, src, dst, w
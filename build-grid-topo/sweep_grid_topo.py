@@ -0,0 +1,84 @@
+'''
+- sweep grid topo configurations (cell size x cell threshold x migration radius) on a single read of the structures, in a process pool (see grid_sweep.py)
+- e.g. to choose the configuration of build_grid_topo.py (or build_grid_topo_structs.py with --weight-column pop --pop-per-count 1) for a geography
+  without re-running it, and without its plots, for each configuration
+- the defaults below can be overridden from the command line, e.g.
+  python sweep_grid_topo.py --cell-sizes 50 100 250 --thresholds 3 5 10 --migration-radii 1 2 3 --processes 4
+
+- input:     - structures csv file with required columns lat,lon # see example input files (structures_households.csv)
+
+- output:    - csv report with one row per configuration and columns cell_size,threshold,migration_radius,num_nodes,pop,num_edges,num_components (e.g. grid_topo_sweep.csv)
+             - optional (--write-outputs): for each configuration, the outputs of build_grid_topo.py with a configuration suffix
+               # e.g. pop_gridded_50m_t5_r3.csv, gridded_households_adj_graph_50m_t5_r3.npz, gridded_households_adj_list_50m_t5_r3.json
+'''
+
+import argparse
+import logging
+
+import grid_sweep
+
+
+# square grid cell/pixel sides (in m) to sweep
+sweep_cell_sizes = [50, 100, 250, 500]
+
+# cell thresholds (minimum number of households per cell) to sweep
+sweep_thresholds = [1, 5, 10]
+
+# migration radii (in neighborhood hops) to sweep
+sweep_migration_radii = [1, 2, 3]
+
+# number of worker processes
+num_processes = 4
+
+# average household size (in people); population per structure count
+avg_household_size = 4.5
+
+structures_csv = "structures_households.csv"
+
+report_csv = "grid_topo_sweep.csv"
+
+
+# lat lon bounding box to filter input buildings if needed
+
+#area around Moron
+
+x_min = -74.339894
+x_max = -74.093235
+y_min = 18.511138
+y_max = 18.597931
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Sweep grid topo configurations (cell size, cell threshold, migration radius) on a single read of the structures")
+    parser.add_argument("--structures", default = structures_csv, help = "structures csv file with columns lat,lon")
+    parser.add_argument("--bbox", type = float, nargs = 4, default = [x_min, x_max, y_min, y_max], metavar = ("X_MIN", "X_MAX", "Y_MIN", "Y_MAX"), help = "lat lon bounding box")
+    parser.add_argument("--cell-sizes", type = int, nargs = "+", default = sweep_cell_sizes, help = "cell sizes (in m)")
+    parser.add_argument("--thresholds", type = float, nargs = "+", default = sweep_thresholds, help = "minimum (weighted) number of structures per cell")
+    parser.add_argument("--migration-radii", type = int, nargs = "+", default = sweep_migration_radii, help = "migration radii (in neighborhood hops)")
+    parser.add_argument("--processes", type = int, default = num_processes, help = "number of worker processes")
+    parser.add_argument("--weight-column", default = None, help = "optional column with per structure weights (e.g. pop)")
+    parser.add_argument("--pop-per-count", type = float, default = avg_household_size, help = "population per (weighted) structure count")
+    parser.add_argument("--report", default = report_csv, help = "csv report file")
+    parser.add_argument("--write-outputs", action = "store_true", help = "also write the nodes csv and grid graph of each configuration")
+    parser.add_argument("--no-adj-list-json", action = "store_true", help = "do not write json adjacency lists with --write-outputs")
+    args = parser.parse_args()
+
+
+    logging.basicConfig(format='%(message)s', level='INFO')
+
+
+    logging.info("Reading data...")
+
+    bbox = tuple(args.bbox)
+    points = grid_sweep.load_points(args.structures, bbox, args.weight_column)
+
+    logging.info("Sweeping " + str(len(args.cell_sizes) * len(args.thresholds) * len(args.migration_radii)) + " configurations of " + str(len(points[0])) + " structures in " + str(args.processes) + " processes...")
+
+    report = grid_sweep.run_sweep(points, bbox, args.cell_sizes, args.thresholds, args.migration_radii, args.processes, args.pop_per_count, args.write_outputs, not args.no_adj_list_json)
+
+    report.to_csv(args.report, index = False)
+
+    logging.info(report.to_string(index = False))
+    logging.info("Sweep report saved to " + args.report)
@@ -0,0 +1,123 @@
+'''
+- search the grid topo configuration (cell size x cell threshold, for a given migration radius) of a geography that hits a target number of nodes
+  or fits a simulation memory budget per core, on a single read of the structures (see grid_cost.py)
+- candidate configurations are evaluated as in sweep_grid_topo.py; around the target, the cell sizes are refined by bisection for each threshold
+- the simulation memory and runtime of each configuration are predicted by the cost model fitted to the calibration table of past runs (sim_cost_calibration.csv),
+  assuming balanced cores and no communication between cores; see ../sims-grid-topo/input/predict_sim_cost.py for a prediction from a built grid and its partition
+- the cost model is only loaded for a memory budget (which needs measured runs in the calibration table); for a target number of nodes alone,
+  the configurations are searched on their grid stats and the cost columns are left empty
+- the defaults below can be overridden from the command line, e.g.
+  python tune_grid_topo.py --target-nodes 5000 --cores 24
+  python tune_grid_topo.py --memory-budget-mb 2000 --cores 24 --cell-sizes 50 100 250 500 1000
+
+- input:     - structures csv file with required columns lat,lon # see example input files (structures_households.csv)
+             - calibration table of measured past runs (sim_cost_calibration.csv; only for a memory budget; ships without runs, append your own first)
+
+- output:    - csv report with one row per evaluated configuration and columns cell_size,threshold,migration_radius,num_nodes,pop,num_edges,num_components,
+               memory_mb_per_core,memory_mb,timestep_s,selected (e.g. grid_topo_tuning.csv); the selected configuration is also logged
+'''
+
+import argparse
+import logging
+
+import grid_sweep
+import grid_cost
+
+
+# candidate square grid cell/pixel sides (in m)
+tune_cell_sizes = [50, 100, 250, 500, 1000]
+
+# candidate cell thresholds (minimum number of households per cell)
+tune_thresholds = [1, 5, 10]
+
+# how far people would definitely go by foot in units of neighborhood hops (as migration_radius in build_grid_topo.py)
+migration_radius = 3
+
+# number of cores of the simulation (num_cores in the sims-grid-topo examples)
+num_cores = 24
+
+# number of cell size bisections per threshold around the target
+num_refinements = 4
+
+# number of worker processes
+num_processes = 1
+
+# average household size (in people); population per structure count
+avg_household_size = 4.5
+
+structures_csv = "structures_households.csv"
+
+report_csv = "grid_topo_tuning.csv"
+
+
+# lat lon bounding box to filter input buildings if needed
+
+#area around Moron
+
+x_min = -74.339894
+x_max = -74.093235
+y_min = 18.511138
+y_max = 18.597931
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Search the grid topo configuration (cell size, cell threshold) for a target number of nodes or a simulation memory budget per core")
+    parser.add_argument("--structures", default = structures_csv, help = "structures csv file with columns lat,lon")
+    parser.add_argument("--bbox", type = float, nargs = 4, default = [x_min, x_max, y_min, y_max], metavar = ("X_MIN", "X_MAX", "Y_MIN", "Y_MAX"), help = "lat lon bounding box")
+    parser.add_argument("--target-nodes", type = int, default = None, help = "target number of nodes")
+    parser.add_argument("--memory-budget-mb", type = float, default = None, help = "max predicted simulation memory per core (in MB)")
+    parser.add_argument("--cores", type = int, default = num_cores, help = "number of simulation cores")
+    parser.add_argument("--cell-sizes", type = int, nargs = "+", default = tune_cell_sizes, help = "candidate cell sizes (in m)")
+    parser.add_argument("--thresholds", type = float, nargs = "+", default = tune_thresholds, help = "candidate minimum (weighted) number of structures per cell")
+    parser.add_argument("--migration-radius", type = int, default = migration_radius, help = "migration radius (in neighborhood hops)")
+    parser.add_argument("--refinements", type = int, default = num_refinements, help = "number of cell size bisections per threshold around the target")
+    parser.add_argument("--processes", type = int, default = num_processes, help = "number of worker processes")
+    parser.add_argument("--weight-column", default = None, help = "optional column with per structure weights (e.g. pop)")
+    parser.add_argument("--pop-per-count", type = float, default = avg_household_size, help = "population per (weighted) structure count")
+    parser.add_argument("--calibration", default = grid_cost.calibration_csv, help = "calibration table of past runs")
+    parser.add_argument("--report", default = report_csv, help = "csv report file")
+    args = parser.parse_args()
+
+
+    logging.basicConfig(format='%(message)s', level='INFO')
+
+    if args.target_nodes is None and args.memory_budget_mb is None:
+        parser.error("set --target-nodes and/or --memory-budget-mb")
+
+
+    # the cost model is only needed for a memory budget; otherwise the cost columns are left empty
+    model = None
+
+    if args.memory_budget_mb is not None:
+        model = grid_cost.load_cost_model(args.calibration)
+
+        if model is None:
+            parser.error("--memory-budget-mb needs measured runs in the calibration table " + args.calibration + " (see grid_cost.py)")
+
+    logging.info("Reading data...")
+
+    bbox = tuple(args.bbox)
+    points = grid_sweep.load_points(args.structures, bbox, args.weight_column)
+
+    logging.info("Searching " + str(len(args.cell_sizes) * len(args.thresholds)) + " configurations of " + str(len(points[0])) + " structures (and " + str(args.refinements) + " refinements per threshold)...")
+
+    report, selected = grid_cost.tune_grid(points, bbox, args.cell_sizes, args.thresholds, args.migration_radius, model, args.cores, args.target_nodes, args.memory_budget_mb,
+                                           args.processes, args.pop_per_count, args.refinements)
+
+    report["selected"] = report.index == selected
+    report.to_csv(args.report, index = False)
+
+    logging.info(report.to_string(index = False))
+    logging.info("Tuning report saved to " + args.report)
+
+    if selected is None:
+        logging.info("No configuration fits the memory budget of " + str(args.memory_budget_mb) + " MB per core; try larger cell sizes or thresholds, or more cores")
+    else:
+        config = report.loc[selected]
+        if model is None:
+            logging.info("Selected cell_size = " + str(int(config.cell_size)) + ", cell_household_threshold = " + ("%g" % config.threshold) + ": " + str(int(config.num_nodes)) + " nodes (no cost predictions without a memory budget)")
+        else:
+            logging.info("Selected cell_size = " + str(int(config.cell_size)) + ", cell_household_threshold = " + ("%g" % config.threshold) + ": " + str(int(config.num_nodes)) + " nodes, " +
+                         str(int(config.memory_mb_per_core)) + " MB per core, " + str(round(config.timestep_s, 3)) + " s per timestep on " + str(args.cores) + " cores (predicted)")
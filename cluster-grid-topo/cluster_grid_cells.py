@@ -4,12 +4,17 @@
 - contains code for clustering based on dbscan as well; agglomerative tends to work better
 
 - input:     - csv with columns node_label,lat,lon,pop,google_alt (e.g. pop_gridded_alts.csv) # could change google_alt easily
+               optional column cell_id (anchored grid; see ../build-grid-topo/grid_anchor.py)
 - output:    - csv with appended column cluster_label (e.g. grid_cluster_labels.csv)
+             - if the input has column cell_id: cache of the clustering (e.g. grid_cluster_cache.npz); the clustering is reused as long as
+               the cells (by cell id), their attributes and the clustering parameters are unchanged
 '''
 
 
+import os
 import math
 import json
+import hashlib
 from collections import defaultdict
 import itertools
 import logging
@@ -116,6 +121,45 @@ def get_cluster_spanner(aggClusterer):
     return spanner
 
 
+def get_clustering_fingerprint(cell_ids, points, params):
+    """
+    :param cell_ids: array of stable cell ids (see ../build-grid-topo/grid_anchor.py)
+    :param points: array of cells attributes used for clustering
+    :param params: dict of clustering parameters
+    :return: hex digest identifying the clustering inputs
+    """
+    fingerprint = hashlib.sha1()
+    fingerprint.update(np.ascontiguousarray(cell_ids, dtype = np.int64).tobytes())
+    fingerprint.update(np.ascontiguousarray(points, dtype = np.float64).tobytes())
+    fingerprint.update(json.dumps(params, sort_keys = True).encode("utf-8"))
+
+    return fingerprint.hexdigest()
+
+
+def load_cached_clustering(cache_path, fingerprint, model):
+    """
+    restore the fitted attributes (labels_, children_, n_leaves_) of an agglomerative clustering model from a cache stored by save_cached_clustering
+
+    :return: True if the cache exists and was computed from the same inputs (i.e. has the same fingerprint); the model is left unchanged otherwise
+    """
+    if not os.path.exists(cache_path):
+        return False
+
+    with np.load(cache_path) as cache:
+        if str(cache["fingerprint"]) != fingerprint:
+            return False
+
+        model.labels_ = cache["labels"]
+        model.children_ = cache["children"]
+        model.n_leaves_ = int(cache["n_leaves"])
+
+    return True
+
+
+def save_cached_clustering(cache_path, fingerprint, cell_ids, model):
+    np.savez(cache_path, fingerprint = np.array(fingerprint), cell_ids = np.asarray(cell_ids, dtype = np.int64), labels = model.labels_, children = model.children_, n_leaves = np.array(model.n_leaves_))
+
+
 # NOTE: the following clustering parameters are just sample values for a small area in Haiti; 
 # the output clusters may or may not be reasonable in the context of health seeking behavior for instance;
 # the clustering parameters used for Haiti Gand'Anse and sud region are commented below when differing from the sample ones
@@ -136,6 +180,9 @@ connectivity = "radius_neighbors_graph"
 #connectivity = "none"
 linkage = "ward"
 
+# cache of the clustering of cells keyed by their stable cell ids; used if the input csv has column cell_id 
+cluster_cache = "grid_cluster_cache.npz"
+
 
 if __name__ == '__main__':
     
@@ -149,19 +196,36 @@ if __name__ == '__main__':
 
     points_scaled = MinMaxScaler().fit_transform(points)
     
-   
-   
-    neighborhoods = NearestNeighbors(radius = max_radius, algorithm = 'auto')
-    neighborhoods.fit(points_scaled) 
     
-    points_distance_matrix = neighborhoods.radius_neighbors_graph(points_scaled, mode = 'distance') # using Euclidean distance metric for now; may need to convert points to cartesian coordinates  
-
-    logging.info("Calculated neighborhood graph")
+    # skip clustering if the same cells were clustered in a previous run with the same attributes and parameters
+    cluster_fingerprint = None
+    model = AgglomerativeClustering(n_clusters = n_clusters, linkage = linkage, compute_full_tree = True)
     
+    if 'cell_id' in cell_records.columns:
+        cluster_fingerprint = get_clustering_fingerprint(cell_records["cell_id"].values, points, {"max_radius": max_radius, "n_clusters": n_clusters, "connectivity": connectivity, "linkage": linkage})
+    
+    if cluster_fingerprint is not None and load_cached_clustering(cluster_cache, cluster_fingerprint, model):
+        
+        logging.info("Reusing cached clusters from " + cluster_cache)
+        
+    else:
+   
+        neighborhoods = NearestNeighbors(radius = max_radius, algorithm = 'auto')
+        neighborhoods.fit(points_scaled) 
+        
+        points_distance_matrix = neighborhoods.radius_neighbors_graph(points_scaled, mode = 'distance') # using Euclidean distance metric for now; may need to convert points to cartesian coordinates  
     
-    logging.info("Calculating clusters...")    
-    model = AgglomerativeClustering(n_clusters = n_clusters, connectivity = points_distance_matrix, linkage = linkage, compute_full_tree = True).fit(points_scaled)
-    #model = AgglomerativeClustering(n_clusters = n_clusters, linkage=linkage).fit(points_scaled) # no connectivity structure imposed
+        logging.info("Calculated neighborhood graph")
+        
+        
+        logging.info("Calculating clusters...")    
+        model = AgglomerativeClustering(n_clusters = n_clusters, connectivity = points_distance_matrix, linkage = linkage, compute_full_tree = True).fit(points_scaled)
+        #model = AgglomerativeClustering(n_clusters = n_clusters, linkage=linkage).fit(points_scaled) # no connectivity structure imposed
+        
+        if cluster_fingerprint is not None:
+            save_cached_clustering(cluster_cache, cluster_fingerprint, cell_records["cell_id"].values, model)
+            
+            logging.info("Cached clusters in " + cluster_cache)
 
 
     # add labels to csv 
@@ -16,14 +16,18 @@ import json
 import numpy as np
 import random
 import os
+import sys
 import math
 
 import matplotlib.pyplot as plt
 
 import networkx as nx
-from geopy.distance import vincenty
 from networkx.readwrite import json_graph
 
+# grid distance helpers are shared with the grid topo build scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "build-grid-topo"))
+from grid_geodesy import DistanceKernel, vincenty_km
+
 
 
 
@@ -63,6 +67,30 @@ ys = nx.get_node_attributes(G, 'lat')
 # group nodes by rates
 hs_rate_groups = {}
 
+
+# calculate the distances between all nodes and the HFs they link to in one batch
+# the nodes are grid cells, so the distances only depend on the source cell's row (latitude band) and the cell offset to the HF; 
+# they are read from a (row, dx, dy) distance kernel of the grid instead of calling vincenty for each link
+node_hf_links = G.edges()
+node_hf_dists = {}
+if node_hf_links:
+    link_srcs, link_dsts = zip(*node_hf_links)
+    node_xs = np.array([xs[node] for node in nodes])
+    node_ys = np.array([ys[node] for node in nodes])
+    node_idxs = dict(zip(nodes, range(len(nodes))))
+    srcs = np.array([node_idxs[node] for node in link_srcs])
+    dsts = np.array([node_idxs[hf] for hf in link_dsts])
+    
+    try:
+        distance_kernel, node_cols, node_rows = DistanceKernel.from_centroids(node_xs, node_ys)
+        link_ds = distance_kernel.lookup(node_rows[srcs], node_cols[dsts] - node_cols[srcs], node_rows[dsts] - node_rows[srcs])
+    except ValueError:
+        # nodes are not on a regular grid; calculate the distances directly
+        link_ds = vincenty_km(node_ys[srcs], node_xs[srcs], node_ys[dsts], node_xs[dsts])
+        
+    node_hf_dists = dict(zip(node_hf_links, link_ds.tolist()))
+
+
 # calculate health seeking rate for each node based on the HFs in its HFCA graph neighborhood, their link weights and distance
 for node in nodes:
     hfs = G.neighbors(node)
@@ -86,7 +114,7 @@ for node in nodes:
            hf_weight = w
            
         # calcualte distance between the node and the health facility
-        d = vincenty((ys[node], xs[node]), (ys[hf], xs[hf])).km
+        d = node_hf_dists[(node, hf)]
         
         if hf == 200:
             print node
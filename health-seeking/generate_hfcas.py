@@ -28,7 +28,7 @@ traveling to closer facilities “as the crow flies”. Since the protocol is pr
 furthermore, the same individuals in each grid cell might decide to go to different HFs over multiple clinical episodes. 
 Changing the parameters of the model could collapse it to special cases with different properties.
 
-- input:      - json grid topo graph adjacency list (e.g. gridded_households_adj_list.json as generated by ../build-grid-topo/build_grid_topo.py or build_grid_topo_w_hospitals.py) 
+- input:      - binary grid topo graph (e.g. gridded_households_adj_graph.npz) or json grid topo graph adjacency list (e.g. gridded_households_adj_list.json) as generated by ../build-grid-topo/build_grid_topo.py or build_grid_topo_w_hospitals.py
               - csv grid topo cells labeled by clusters w/ required columns node_label,lon,lat,pop,cluster_label (e.g. grid_cluster_labels.csv generated by ../cluster-grid-topo/cluster_grid_cells.py)
               - health facility locations on the grid w/ requried columns 'lon', 'lat', 'node_label' where node_label indicates the grid cell the health facility is in (e.g. hospitals_node_labeled.csv as generated by ../build-grid-topo/build_grid_topo_w_hospitals.py) 
               
@@ -44,6 +44,7 @@ import json
 import numpy as np
 import random
 import os
+import sys
 
 import matplotlib.pyplot as plt
 
@@ -51,6 +52,10 @@ import networkx as nx
 from networkx.readwrite import json_graph
 from networkx.utils import generate_unique_node
 
+# binary grid graph loader is shared with the grid topo build scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "build-grid-topo"))
+import grid_graph
+
 
 # not currently used but left for reference if needed
 def all_sources_shortest_paths_to_dests(G, dsts):
@@ -205,8 +210,12 @@ highest_density_cells_num = 5 # how many of the top cells with highest populatio
 
 
 
-with open("gridded_households_adj_list.json", "r") as al_f:
-    adjacency_list = json.load(al_f)
+# prefer the binary grid graph (e.g. gridded_households_adj_graph.npz as generated by ../build-grid-topo/build_grid_topo.py); loading it is much faster than the json adjacency list
+if os.path.exists("gridded_households_adj_graph.npz"):
+    adjacency_list = grid_graph.csr_to_adj_list(*grid_graph.load_csr("gridded_households_adj_graph.npz"))
+else:
+    with open("gridded_households_adj_list.json", "r") as al_f:
+        adjacency_list = json.load(al_f)
     
 nodes_records = pd.read_csv("grid_cluster_labels.csv").as_matrix(['node_label', 'lon', 'lat', 'pop', 'cluster_label'])
 
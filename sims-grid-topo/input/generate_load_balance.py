@@ -0,0 +1,106 @@
+'''
+Generate the DTK load balance file of a multi-core grid topo simulation, instead of the one generated by SpatialManager(generate_load_balancing = True)
+
+Grid nodes are partitioned across num_cores cores by population weighted recursive coordinate bisection, refined along the part borders to cut fewer
+migration edges (see ../../build-grid-topo/grid_partition.py); the expected work (population) and communication (migration edges across cores) of each core are reported
+
+input:     - csv of grid nodes w required columns node_label,lat,lon,pop (e.g. pop_gridded_alts.csv or pop_gridded.csv)
+           - binary grid topo graph (e.g. gridded_households_adj_graph.npz) or json grid topo graph adjacency list (e.g. gridded_households_adj_list.json) as generated by ../../build-grid-topo/build_grid_topo.py
+           - demographics file of the simulation, mapping node labels (FacilityName) to dtk node ids (e.g. Hispaniola_30arcsec_demographics.json; see generate_grid_map.py)
+output:    - load balance file (e.g. Haiti_Grand_Anse_test_loadbalance_24procs.bin); copy it to the geography directory of the simulation input files
+             (the Load_Balance_Filename of the sims-grid-topo examples) and run the examples with generate_load_balancing = False
+           - csv report of the partition per core (e.g. loadbalance_24procs_report.csv)
+'''
+
+import os
+import sys
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+import matplotlib.pyplot as plt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "build-grid-topo"))
+import grid_graph
+import grid_partition
+
+
+# number of cores of the simulation (num_cores in the sims-grid-topo examples)
+num_cores = 24
+
+# prefix of the simulation input files (prefix in the sims-grid-topo examples)
+prefix = "Haiti_Grand_Anse_test"
+
+population_input_file = "pop_gridded_alts.csv"
+demographics_file = "Hispaniola_30arcsec_demographics.json" # change as needed
+
+# max ratio of a core's population to the mean population per core accepted when refining the partition to cut fewer migration edges
+max_imbalance = 1.05
+
+# max number of refinement passes over the nodes on the border between cores; 0 keeps the recursive coordinate bisection partition
+refine_passes = 4
+
+
+logging.basicConfig(format='%(message)s', level='INFO')
+
+node_records = pd.read_csv(population_input_file)
+
+node_labels = [str(node_label) for node_label in node_records.node_label.values]
+pops = node_records["pop"].values.astype(np.float64)
+
+
+# prefer the binary grid graph; loading it is much faster than the json adjacency list
+if os.path.exists("gridded_households_adj_graph.npz"):
+    adjacency_list = grid_graph.csr_to_adj_list(*grid_graph.load_csr("gridded_households_adj_graph.npz"))
+else:
+    with open("gridded_households_adj_list.json", "r") as al_f:
+        adjacency_list = json.load(al_f)
+
+# grid graph over the nodes in the order of the csv records; edges to nodes that are not in the csv are ignored
+adj_indptr, adj_indices, adj_weights = grid_graph.get_node_graph(adjacency_list, node_labels)
+
+
+with open(demographics_file, "r") as d_f:
+    demo = json.load(d_f)
+
+node_labels_2_node_ids = {}
+for node in demo["Nodes"]:
+    node_labels_2_node_ids[str(node["NodeAttributes"]["FacilityName"])] = node["NodeID"]
+
+missing = [node_label for node_label in node_labels if node_label not in node_labels_2_node_ids]
+if missing:
+    raise ValueError(str(len(missing)) + " nodes (e.g. " + missing[0] + ") are not in " + demographics_file)
+
+node_ids = np.array([node_labels_2_node_ids[node_label] for node_label in node_labels], dtype = np.uint32)
+
+
+logging.info("Partitioning " + str(len(node_labels)) + " nodes across " + str(num_cores) + " cores...")
+
+parts = grid_partition.recursive_bisection(node_records.lon.values, node_records.lat.values, pops, num_cores)
+report, num_cut_edges = grid_partition.get_partition_report(parts, adj_indptr, adj_indices, pops, num_cores)
+
+logging.info("Recursive coordinate bisection: max/mean core population " + str(report["pop"].max() / report["pop"].mean()) + ", " + str(num_cut_edges) + " migration edges across cores")
+
+if refine_passes:
+    parts = grid_partition.refine_partition(parts, adj_indptr, adj_indices, pops, num_cores, max_imbalance, refine_passes)
+    report, num_cut_edges = grid_partition.get_partition_report(parts, adj_indptr, adj_indices, pops, num_cores)
+
+    logging.info("Refined partition: max/mean core population " + str(report["pop"].max() / report["pop"].mean()) + ", " + str(num_cut_edges) + " migration edges across cores")
+
+
+load_balance_file = prefix + "_loadbalance_" + str(num_cores) + "procs.bin"
+grid_partition.save_load_balance(load_balance_file, node_ids, parts, num_cores)
+
+logging.info("Load balance saved to " + load_balance_file)
+
+report_file = "loadbalance_" + str(num_cores) + "procs_report.csv"
+report.to_csv(report_file, index = False)
+
+logging.info("Per core work and communication saved to " + report_file)
+
+
+# plot nodes colored by core
+plt.scatter(node_records.lon.values, node_records.lat.values, s = np.sqrt(pops), c = parts, cmap = 'jet', linewidths = 0)
+plt.show()
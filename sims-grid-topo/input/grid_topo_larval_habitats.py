@@ -5,19 +5,30 @@ The function is a piecewise linear dependence as briefly discussed in vector hab
 https://wiki.idmod.org/display/EMOD/2017/02/13/Haiti%3A+gridded+households+topology+analysis
 
 input:     - csv of nodes positions and their elevation w required columns node_label,google_alt,lat,lon  (e.g. pop_gridded_alts.csv); google_alt can easily be changed for different altitude est
+             optional column cell_id (anchored grid; see ../../build-grid-topo/grid_anchor.py)
 output:    - json of nodes to habitats map for each cell in the grid (e.g. grid_habs.json)  
+           - if the input has column cell_id: cache of habitats by cell id (e.g. grid_habs_cache.json); cells cached in previous runs with the same
+             habitat parameters and bounds and the same altitude reuse their cached habitats (which can thus also be edited per cell)
 '''
 
+import os
+import sys
 import pandas as pd
 import json
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "build-grid-topo"))
+import grid_anchor
+
 
 # would very very likely want to change those
 temp_h_zero = 900 # temporary habitat at sea level per 7500
 const_h_zero = 3200 # const habitat at sea level per 7500
 
+# cache of habitats keyed by the stable cell ids of an anchored grid
+habs_cache = "grid_habs_cache.json"
+
 # this is just an example function; may want to redefine the altitude habitat dependency 
 def get_habs_by_alt(alt):
     
@@ -78,31 +89,56 @@ points = node_records.as_matrix(['node_label', 'google_alt', 'lat', 'lon'])
 
 # bounding box for nodes of interest if needed
 x_hab_bound_min = -74.0763
-x_hab_bound_min = -73.7603
+x_hab_bound_max = -73.7603
 y_hab_bound_max = 18.3072
 y_hab_bound_min = 18.0088
 
 gridded_hh_habs = {}
 
+# cached habitats are only reused for the same habitat parameters and bounds (and the same altitude, cached with the habitats of each cell)
+habs_cache_meta = {"temp_h_zero": temp_h_zero, "const_h_zero": const_h_zero, "x_hab_bound_min": x_hab_bound_min, "x_hab_bound_max": x_hab_bound_max,
+                   "y_hab_bound_min": y_hab_bound_min, "y_hab_bound_max": y_hab_bound_max}
+
+cell_ids = node_records['cell_id'].values if 'cell_id' in node_records.columns else None
+cached_cells = grid_anchor.load_cell_cache(habs_cache, habs_cache_meta) if cell_ids is not None else {}
+
 temp_h_vs_alts = []
 const_h_vs_alts = []
 
-for point in points:
+for i, point in enumerate(points):
     
-    if not (point[2] > y_hab_bound_min and point[2] < y_hab_bound_min and point[3] > x_hab_bound_min and point[3] < x_hab_bound_max):
+    in_hab_bound = point[2] > y_hab_bound_min and point[2] < y_hab_bound_min and point[3] > x_hab_bound_min and point[3] < x_hab_bound_max
+    
+    # skip cells processed in previous runs
+    habs = None
+    if cell_ids is not None:
+        cached = grid_anchor.get_cached_value(cached_cells, cell_ids[i], point[2], point[3])
+        if cached is not None and cached.get("alt") == float(point[1]):
+            habs = cached["habs"]
+    
+    if habs is None:
+        
+        if not in_hab_bound:
+            habs = get_habs_by_alt(point[1])
+        else:
+            habs = {
+                    "temp_h" : 0.1*temp_h_zero,
+                    "const_h" : 0.1*const_h_zero
+            }
+        
+        if cell_ids is not None:
+            grid_anchor.set_cached_value(cached_cells, cell_ids[i], point[2], point[3], {"alt": float(point[1]), "habs": habs})
+    
+    if not in_hab_bound:
         alt = point[1]
-        habs = get_habs_by_alt(alt)
         
         temp_h_vs_alts.append([alt, habs["temp_h"]])
         const_h_vs_alts.append([alt, habs["const_h"]])
-        
-    else:
-        habs = {
-                "temp_h" : 0.1*temp_h_zero,
-                "const_h" : 0.1*const_h_zero
-        }
     
     gridded_hh_habs[int(point[0])] = habs
+
+if cell_ids is not None:
+    grid_anchor.save_cell_cache(habs_cache, cached_cells, habs_cache_meta)
       
 temp_h_vs_alts = np.array(sorted(temp_h_vs_alts, key=lambda tup: tup[0]))
 const_h_vs_alts = np.array(sorted(const_h_vs_alts, key=lambda tup: tup[0]))
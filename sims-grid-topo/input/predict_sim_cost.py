@@ -0,0 +1,115 @@
+'''
+Predict the memory and runtime of a multi-core grid topo simulation before submitting it, from the built grid and its partition across the cores
+
+The cost model is fitted to the calibration table of past runs ../../build-grid-topo/sim_cost_calibration.csv (see ../../build-grid-topo/grid_cost.py);
+it ships without runs: append measured runs to it first (until then only the grid stats are reported). To choose the grid configuration (cell size, threshold) for a memory budget or a target number of nodes
+see ../../build-grid-topo/tune_grid_topo.py
+
+input:     - csv of grid nodes w required columns node_label,lat,lon,pop (e.g. pop_gridded_alts.csv or pop_gridded.csv)
+           - binary grid topo graph (e.g. gridded_households_adj_graph.npz) or json grid topo graph adjacency list (e.g. gridded_households_adj_list.json) as generated by ../../build-grid-topo/build_grid_topo.py
+           - optional: load balance file and demographics file of the simulation (e.g. as generated by generate_load_balance.py); otherwise nodes are
+             partitioned as in generate_load_balance.py
+output:    - csv of the predicted memory and runtime per timestep of each core (e.g. sim_cost_24procs.csv)
+'''
+
+import os
+import sys
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "build-grid-topo"))
+import grid_graph
+import grid_partition
+import grid_cost
+
+
+# number of cores of the simulation (num_cores in the sims-grid-topo examples)
+num_cores = 24
+
+# simulation duration in days (e.g. int(365*num_years) in the sims-grid-topo examples)
+simulation_days = 36
+
+population_input_file = "pop_gridded_alts.csv"
+
+# load balance file of the simulation and the demographics file mapping node labels (FacilityName) to its node ids; None to partition as in generate_load_balance.py
+load_balance_file = None # e.g. "Haiti_Grand_Anse_test_loadbalance_24procs.bin"
+demographics_file = "Hispaniola_30arcsec_demographics.json" # change as needed
+
+# calibration table of past runs
+calibration_file = grid_cost.calibration_csv
+
+
+logging.basicConfig(format='%(message)s', level='INFO')
+
+# fails early if the calibration table has too few measured runs; None if it has no runs (grid stats only)
+model = grid_cost.load_cost_model(calibration_file)
+
+node_records = pd.read_csv(population_input_file)
+
+node_labels = [str(node_label) for node_label in node_records.node_label.values]
+pops = node_records["pop"].values.astype(np.float64)
+
+
+# prefer the binary grid graph; loading it is much faster than the json adjacency list
+if os.path.exists("gridded_households_adj_graph.npz"):
+    adjacency_list = grid_graph.csr_to_adj_list(*grid_graph.load_csr("gridded_households_adj_graph.npz"))
+else:
+    with open("gridded_households_adj_list.json", "r") as al_f:
+        adjacency_list = json.load(al_f)
+
+# grid graph over the nodes in the order of the csv records; edges to nodes that are not in the csv are ignored
+adj_indptr, adj_indices, adj_weights = grid_graph.get_node_graph(adjacency_list, node_labels)
+
+
+grid_stats = grid_cost.get_grid_stats(pops, adj_indptr, adj_indices)
+
+logging.info("Grid: " + str(grid_stats["num_nodes"]) + " nodes, population " + str(int(grid_stats["pop"])) + " (max " + str(int(grid_stats["max_node_pop"])) + " per node), " +
+             str(grid_stats["num_links"]) + " migration links (fan-out mean " + str(round(grid_stats["mean_fan_out"], 1)) + ", max " + str(grid_stats["max_fan_out"]) + ")")
+
+if model is None:
+    logging.info("No cost predictions: the calibration table " + calibration_file + " has no runs; append measured runs to it (see grid_cost.py)")
+    sys.exit(0)
+
+
+if load_balance_file:
+
+    logging.info("Reading the partition from " + load_balance_file + "...")
+
+    with open(demographics_file, "r") as d_f:
+        demo = json.load(d_f)
+
+    node_ids_2_node_labels = {}
+    for node in demo["Nodes"]:
+        node_ids_2_node_labels[node["NodeID"]] = str(node["NodeAttributes"]["FacilityName"])
+
+    node_ids, node_id_parts = grid_partition.load_load_balance(load_balance_file, num_cores)
+
+    node_pos = dict((node_label, i) for i, node_label in enumerate(node_labels))
+
+    parts = np.zeros(len(node_labels), dtype = np.int64)
+    for node_id, part in zip(node_ids.tolist(), node_id_parts.tolist()):
+        parts[node_pos[node_ids_2_node_labels[node_id]]] = part
+
+else:
+
+    logging.info("Partitioning the nodes across " + str(num_cores) + " cores (see generate_load_balance.py)...")
+
+    parts = grid_partition.recursive_bisection(node_records.lon.values, node_records.lat.values, pops, num_cores)
+    parts = grid_partition.refine_partition(parts, adj_indptr, adj_indices, pops, num_cores)
+
+
+core_costs = grid_cost.predict_core_costs(model, parts, pops, adj_indptr, adj_indices, num_cores)
+
+timestep_s = core_costs.timestep_s.max()
+
+logging.info("Predicted memory: " + str(int(core_costs.memory_mb.sum())) + " MB in total, max " + str(int(core_costs.memory_mb.max())) + " MB per core")
+logging.info("Predicted runtime: " + str(round(timestep_s, 3)) + " s per timestep (slowest core " + str(core_costs.timestep_s.idxmax()) + "; mean core " +
+             str(round(core_costs.timestep_s.mean(), 3)) + " s), " + str(round(timestep_s * simulation_days / 60., 1)) + " minutes for " + str(simulation_days) + " days")
+
+cost_file = "sim_cost_" + str(num_cores) + "procs.csv"
+core_costs.to_csv(cost_file, index = False)
+
+logging.info("Per core predictions saved to " + cost_file)